@@ -0,0 +1,57 @@
+#!/usr/bin/env python
+"""
+Compact region files: remove free sectors between chunks, and report the
+fragmentation before and after.
+"""
+
+import os, sys
+from optparse import OptionParser
+
+# local module
+try:
+    import nbt
+except ImportError:
+    # nbt not in search path. Let's see if it can be found in the parent folder
+    extrasearchpath = os.path.realpath(os.path.join(__file__,os.pardir,os.pardir))
+    if not os.path.exists(os.path.join(extrasearchpath,'nbt')):
+        raise
+    sys.path.append(extrasearchpath)
+from nbt.region import RegionFile, RegionFileFormatError, COMPACT_OFFSET, COMPACT_ZORDER
+
+
+def compact_regionfile(filename, order=COMPACT_OFFSET, dry_run=False):
+    region = RegionFile(filename)
+    try:
+        if dry_run:
+            print("%s: %s" % (filename, region.fragmentation()))
+        else:
+            before, after = region.compact(order)
+            print("%s: before: %s" % (filename, before))
+            print("%s: after:  %s" % (filename, after))
+    finally:
+        region.close()
+
+
+if __name__ == '__main__':
+    parser = OptionParser(usage="%prog [options] regionfile...")
+    parser.add_option("-z", "--zorder", dest="order", default=COMPACT_OFFSET,
+                    action="store_const", const=COMPACT_ZORDER,
+                    help="Order chunks along a Z-order curve, instead of keeping their order")
+    parser.add_option("-n", "--dry-run", dest="dry_run", default=False,
+                    action="store_true", help="Only report the fragmentation")
+
+    (options, args) = parser.parse_args()
+    if (len(args) == 0):
+        print("No region file specified! Use -n to only report fragmentation; -z for Z-order")
+        sys.exit(64) # EX_USAGE
+
+    for filename in args:
+        try:
+            compact_regionfile(filename, options.order, options.dry_run)
+        except IOError as e:
+            sys.stderr.write("%s: %s\n" % (filename, e))
+            sys.exit(72) # EX_IOERR
+        except RegionFileFormatError as e:
+            sys.stderr.write("%s: %s\n" % (filename, e))
+            sys.exit(65) # EX_DATAERR
+    sys.exit(0)
@@ -20,6 +20,16 @@ except ImportError:
         raise
     sys.path.append(extrasearchpath)
 from nbt.region import RegionFile, RegionFileFormatError
+from nbt.compression import get_codec, decompress
+
+
+def has_codec(compression):
+    """Return True if chunks with this compression type can be decompressed."""
+    try:
+        get_codec(compression)
+    except KeyError:
+        return False
+    return True
 
 
 class ChunkMetadata(object):
@@ -151,7 +161,7 @@ def analyse_regionfile(filename, warnings=True):
                     errors.append("chunk %d,%d is uncompressed. This is deprecated." % (x, z))
                 elif c.compression == 1:
                     errors.append("chunk %d,%d uses GZip compression. This is deprecated." % (x, z))
-                elif c.compression > 2:
+                elif not has_codec(c.compression):
                     errors.append("chunk %d,%d uses an unknown compression type (%d)." % (x, z, c.compression))
                 if c.length + 4 > allocatedbytes: # TODO 4 or 5?
                     errors.append("chunk %d,%d is %d bytes (4+1+%d) and requires %d sectors, " \
@@ -179,7 +189,7 @@ def analyse_regionfile(filename, warnings=True):
                 compresseddata = None
                 data = None
                 try:
-                    if 0 <= c.compression <= 2:
+                    if has_codec(c.compression):
                         region.file.seek(4096*c.sectorstart + 5)
                         compresseddata = region.file.read(c.length - 1)
                 except Exception as e:
@@ -196,6 +206,11 @@ def analyse_regionfile(filename, warnings=True):
                         data = zlib.decompress(compresseddata)
                     except Exception as e:
                         errors.append("Error decompressing chunk %d,%d using zlib: %s" % (x, z, str(e)))
+                elif has_codec(c.compression) and compresseddata is not None:
+                    try:
+                        data = decompress(c.compression, compresseddata)
+                    except Exception as e:
+                        errors.append("Error decompressing chunk %d,%d using %s: %s" % (x, z, get_codec(c.compression).name, str(e)))
                 if data:
                     c.uncompressedlength = len(data)
                     if data[0] != 10:
@@ -1,4 +1,7 @@
-__all__ = ["nbt", "world", "region", "chunk"]
+__all__ = ["nbt", "world", "region", "chunk", "arena", "stream", "mapped",
+           "parallel", "columnar", "export", "schema", "compression",
+           "from_python"]
+from .nbt import from_python
 from . import *
 
 # Documentation only automatically includes functions specified in __all__.
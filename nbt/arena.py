@@ -0,0 +1,577 @@
+"""
+Compact, read-only view of an NBT document.
+
+An NBTArena indexes an uncompressed NBT buffer in a few flat arrays, rather
+than creating a TAG object for each tag. Names and values are only decoded
+when they are accessed through an ArenaCursor.
+
+The tags are stored in depth-first order. For each tag, the arena stores the
+type, the offset of the name, the offset of the payload and the index just
+past the last descendant. The children of a tag are found by jumping from
+subtree end to subtree end.
+
+For more information about the NBT format:
+https://minecraft.wiki/w/NBT_format
+"""
+
+from array import array
+from struct import Struct, error as StructError
+from gzip import GzipFile
+import sys
+
+from .nbt import TAG_END, TAG_BYTE, TAG_SHORT, TAG_INT, TAG_LONG, \
+    TAG_FLOAT, TAG_DOUBLE, TAG_BYTE_ARRAY, TAG_STRING, TAG_LIST, \
+    TAG_COMPOUND, TAG_INT_ARRAY, TAG_LONG_ARRAY, TAGLIST, \
+    MalformedFileError, DEFAULT_LIMITS
+
+if sys.version_info >= (3,):
+    basestring = str
+else:
+    range = xrange
+
+try:
+    array('q')
+    _INDEX_TYPE = 'q'
+except ValueError:  # Python 2 has no 'q' type code
+    _INDEX_TYPE = 'l'
+
+_BYTE = Struct(">b")
+_USHORT = Struct(">H")
+_INT = Struct(">i")
+
+_SCALARS = {
+    TAG_BYTE: Struct(">b"),
+    TAG_SHORT: Struct(">h"),
+    TAG_INT: Struct(">i"),
+    TAG_LONG: Struct(">q"),
+    TAG_FLOAT: Struct(">f"),
+    TAG_DOUBLE: Struct(">d"),
+}
+"""Struct of each fixed size tag type"""
+
+_ITEMSIZES = {TAG_BYTE_ARRAY: 1, TAG_INT_ARRAY: 4, TAG_LONG_ARRAY: 8}
+"""Element size in bytes of each array tag type"""
+
+_ARRAY_FORMATS = {TAG_INT_ARRAY: "i", TAG_LONG_ARRAY: "q"}
+
+_INDEX_MAGIC = b"NBTARENA"
+_INDEX_HEADER = Struct("<BBqqH")
+"""byte order, item size, number of tags, document size and key size"""
+
+
+class NBTArena(object):
+    """
+    Flat index over an uncompressed NBT buffer.
+
+    data can be any object supporting the buffer protocol, such as bytes,
+    bytearray, a memoryview or an mmap. The buffer is not copied, and must
+    not be modified while the arena is in use.
+    """
+
+    def __init__(self, data, limits=None):
+        self.data = data
+        self.limits = limits if limits is not None else DEFAULT_LIMITS
+        self.types = array('b')
+        """tag type of each tag"""
+        self.names = array(_INDEX_TYPE)
+        """offset of the name (including the length prefix) of each tag,
+        -1 for elements of a TAG_List"""
+        self.offsets = array(_INDEX_TYPE)
+        """offset of the payload of each tag"""
+        self.ends = array(_INDEX_TYPE)
+        """index following the last descendant of each tag"""
+        self.size = 0
+        """number of bytes in data used by the document"""
+        try:
+            self._index()
+        except StructError:
+            raise MalformedFileError(
+                "Partial File Parse: file possibly truncated.")
+
+    @classmethod
+    def from_file(cls, filename=None, fileobj=None, limits=None):
+        """Read a GZip-compressed NBT file, and return its arena."""
+        if filename:
+            f = GzipFile(filename, 'rb')
+        elif fileobj:
+            f = GzipFile(fileobj=fileobj)
+        else:
+            raise ValueError(
+                "NBTArena.from_file(): Need to specify either a "
+                "filename or a file object")
+        try:
+            return cls(f.read(), limits)
+        finally:
+            f.close()
+
+    def save_index(self, fileobj, key=b""):
+        """
+        Write the index arrays to fileobj, so they can be read back with
+        load_index() without parsing the document again. key is an
+        arbitrary byte string (e.g. the size and modification time of the
+        data) stored along with the index, and checked by load_index().
+        """
+        fileobj.write(_INDEX_MAGIC)
+        fileobj.write(_INDEX_HEADER.pack(
+            sys.byteorder == 'little', self.names.itemsize, len(self.types),
+            self.size, len(key)))
+        fileobj.write(key)
+        for values in (self.types, self.names, self.offsets, self.ends):
+            fileobj.write(values.tobytes())
+
+    @classmethod
+    def load_index(cls, data, fileobj, key=b"", limits=None):
+        """
+        Return an arena for data, with the index read from fileobj (written
+        by save_index()). Return None if the index is not valid for this
+        platform, or was saved with a different key.
+        """
+        if fileobj.read(len(_INDEX_MAGIC)) != _INDEX_MAGIC:
+            return None
+        header = fileobj.read(_INDEX_HEADER.size)
+        if len(header) != _INDEX_HEADER.size:
+            return None
+        little, itemsize, count, size, keysize = _INDEX_HEADER.unpack(header)
+        if bool(little) != (sys.byteorder == 'little') or \
+                itemsize != array(_INDEX_TYPE).itemsize or \
+                fileobj.read(keysize) != key or size > len(data):
+            return None
+        arena = cls.__new__(cls)
+        arena.data = data
+        arena.limits = limits if limits is not None else DEFAULT_LIMITS
+        arena.size = size
+        arena.types = array('b')
+        arena.names = array(_INDEX_TYPE)
+        arena.offsets = array(_INDEX_TYPE)
+        arena.ends = array(_INDEX_TYPE)
+        for values in (arena.types, arena.names, arena.offsets, arena.ends):
+            raw = fileobj.read(count * values.itemsize)
+            if len(raw) != count * values.itemsize:
+                return None
+            values.frombytes(raw)
+        return arena
+
+    def _add(self, tagtype, name, offset):
+        self.types.append(tagtype)
+        self.names.append(name)
+        self.offsets.append(offset)
+        self.ends.append(0)
+        return len(self.types) - 1
+
+    def _index(self):
+        data = self.data
+        length = len(data)
+        max_depth = self.limits.max_depth
+        max_length = self.limits.max_length
+        types, ends = self.types, self.ends
+
+        if _BYTE.unpack_from(data, 0)[0] != TAG_COMPOUND:
+            raise MalformedFileError("First record is not a Compound Tag")
+        pos = 3 + _USHORT.unpack_from(data, 1)[0]
+        self._add(TAG_COMPOUND, 1, pos)
+        # Each stack entry is [index, element type, remaining elements].
+        # The element type is None for compounds.
+        stack = [[0, None, 0]]
+        while stack:
+            frame = stack[-1]
+            if frame[1] is None:
+                tagtype = _BYTE.unpack_from(data, pos)[0]
+                pos += 1
+                if tagtype == TAG_END:
+                    ends[frame[0]] = len(types)
+                    stack.pop()
+                    continue
+                namepos = pos
+                pos += 2 + _USHORT.unpack_from(data, pos)[0]
+            else:
+                if frame[2] == 0:
+                    ends[frame[0]] = len(types)
+                    stack.pop()
+                    continue
+                frame[2] -= 1
+                tagtype = frame[1]
+                namepos = -1
+            index = self._add(tagtype, namepos, pos)
+
+            if tagtype in _SCALARS:
+                pos += _SCALARS[tagtype].size
+            elif tagtype == TAG_STRING:
+                pos += 2 + _USHORT.unpack_from(data, pos)[0]
+            elif tagtype in _ITEMSIZES:
+                count = _INT.unpack_from(data, pos)[0]
+                if count < 0 or (max_length is not None and count > max_length):
+                    raise MalformedFileError("Invalid array length %d" % count)
+                pos += 4 + count * _ITEMSIZES[tagtype]
+            elif tagtype == TAG_COMPOUND or tagtype == TAG_LIST:
+                if max_depth is not None and len(stack) >= max_depth:
+                    raise MalformedFileError(
+                        "Nesting depth exceeds the maximum of %d" % max_depth)
+                if tagtype == TAG_COMPOUND:
+                    stack.append([index, None, 0])
+                else:
+                    elementtype = _BYTE.unpack_from(data, pos)[0]
+                    count = _INT.unpack_from(data, pos + 1)[0]
+                    if count < 0 or (max_length is not None and count > max_length):
+                        raise MalformedFileError("Invalid list length %d" % count)
+                    if count > 0 and (elementtype == TAG_END or
+                                      elementtype not in TAGLIST):
+                        raise MalformedFileError(
+                            "Invalid list element type %d" % elementtype)
+                    pos += 5
+                    stack.append([index, elementtype, count])
+                continue
+            else:
+                raise MalformedFileError("Unrecognised tag type %d" % tagtype)
+            if pos > length:
+                raise MalformedFileError(
+                    "Partial File Parse: file possibly truncated.")
+            ends[index] = index + 1
+        self.size = pos
+
+    def __len__(self):
+        """Return the number of tags in the document."""
+        return len(self.types)
+
+    @property
+    def root(self):
+        """ArenaCursor of the root TAG_Compound."""
+        return ArenaCursor(self, 0)
+
+    def find(self, path):
+        """Shortcut for self.root.find(path)."""
+        return self.root.find(path)
+
+    def __repr__(self):
+        return "<%s with %d tags at 0x%x>" % (
+            self.__class__.__name__, len(self.types), id(self))
+
+
+class ArenaCursor(object):
+    """
+    Reference to a single tag in an NBTArena.
+
+    Cursors are cheap: they only hold the arena and the index of the tag.
+    """
+    __slots__ = ('arena', 'index')
+
+    def __init__(self, arena, index):
+        self.arena = arena
+        self.index = index
+
+    @property
+    def id(self):
+        """Tag type, one of the TAG_* constants."""
+        return self.arena.types[self.index]
+
+    @property
+    def name(self):
+        """Name of the tag, or None for elements of a TAG_List."""
+        namepos = self.arena.names[self.index]
+        if namepos < 0:
+            return None
+        return _decode_string(self.arena.data, namepos)
+
+    @property
+    def offset(self):
+        """Offset of the payload of this tag in the buffer."""
+        return self.arena.offsets[self.index]
+
+    def __eq__(self, other):
+        return isinstance(other, ArenaCursor) and \
+            self.arena is other.arena and self.index == other.index
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def __hash__(self):
+        return hash((id(self.arena), self.index))
+
+    def __len__(self):
+        """Return the number of elements for collections, arrays and
+        strings."""
+        tagtype = self.id
+        data, offset = self.arena.data, self.offset
+        if tagtype == TAG_COMPOUND:
+            return sum(1 for _ in self._child_indices())
+        elif tagtype == TAG_LIST:
+            return _INT.unpack_from(data, offset + 1)[0]
+        elif tagtype in _ITEMSIZES:
+            return _INT.unpack_from(data, offset)[0]
+        elif tagtype == TAG_STRING:
+            return len(self.value())
+        raise TypeError("%s has no len()" % TAGLIST[tagtype].__name__)
+
+    def _child_indices(self):
+        ends = self.arena.ends
+        i = self.index + 1
+        end = ends[self.index]
+        while i < end:
+            yield i
+            i = ends[i]
+
+    def children(self):
+        """Yield a cursor for each child of a TAG_Compound or TAG_List."""
+        arena = self.arena
+        for i in self._child_indices():
+            yield ArenaCursor(arena, i)
+
+    def keys(self):
+        """Return the names of the children of a TAG_Compound."""
+        return [child.name for child in self.children()]
+
+    def __getitem__(self, key):
+        """Return the child with the given name (for a TAG_Compound), or
+        at the given index (for a TAG_List)."""
+        if isinstance(key, basestring):
+            child = self._find_name(key)
+            if child is None:
+                raise KeyError("Tag %s does not exist" % key)
+            return child
+        elif isinstance(key, int):
+            if key < 0:
+                key += len(self)
+            for i, child in enumerate(self.children()):
+                if i == key:
+                    return child
+            raise IndexError("index %d out of range" % key)
+        raise TypeError(
+            "key needs to be either name of tag, or index of tag, "
+            "not a %s" % type(key).__name__)
+
+    def _find_name(self, name):
+        arena = self.arena
+        data, names = arena.data, arena.names
+        encoded = name.encode("utf-8")
+        size = len(encoded)
+        for i in self._child_indices():
+            namepos = names[i]
+            if namepos >= 0 and \
+                    _USHORT.unpack_from(data, namepos)[0] == size and \
+                    data[namepos + 2:namepos + 2 + size] == encoded:
+                return ArenaCursor(arena, i)
+        return None
+
+    def find(self, path):
+        """
+        Return the cursor at path, or None if it does not exist.
+
+        path is either a sequence of names and list indices, or a string
+        with names separated by slashes, e.g. "Level/Sections/0/Y".
+        """
+        if isinstance(path, basestring):
+            path = [int(p) if p.lstrip('-').isdigit() else p
+                    for p in path.split('/') if p]
+        cursor = self
+        for key in path:
+            if cursor.id not in (TAG_COMPOUND, TAG_LIST):
+                return None
+            try:
+                cursor = cursor[key]
+            except (KeyError, IndexError, TypeError):
+                return None
+        return cursor
+
+    def walk(self, prune=None):
+        """
+        Yield a (path, cursor) tuple for this tag and all its descendants,
+        in document order, like :meth:`nbt.nbt.TAG.walk`.
+
+        If prune is given, it is called as prune(path, cursor) for each
+        TAG_Compound and TAG_List (including empty ones); if it returns True,
+        that subtree is skipped without decoding anything in it.
+        """
+        arena = self.arena
+        data, types, names, ends = \
+            arena.data, arena.types, arena.names, arena.ends
+        yield (), self
+        if prune is not None and self.id in (TAG_COMPOUND, TAG_LIST) and \
+                prune((), self):
+            return
+        end = ends[self.index]
+        if end == self.index + 1:
+            return
+        # Each stack entry is [subtree end, path, next list index].
+        stack = [[end, (), 0]]
+        i = self.index + 1
+        while i < end:
+            while stack[-1][0] <= i:
+                stack.pop()
+            frame = stack[-1]
+            if names[i] < 0:
+                key = frame[2]
+                frame[2] += 1
+            else:
+                key = _decode_string(data, names[i])
+            path = frame[1] + (key,)
+            cursor = ArenaCursor(arena, i)
+            yield path, cursor
+            if prune is not None and types[i] in (TAG_COMPOUND, TAG_LIST) \
+                    and prune(path, cursor):
+                i = ends[i]
+                continue
+            if ends[i] > i + 1:
+                stack.append([ends[i], path, 0])
+            i += 1
+
+    def find_all(self, name=None, predicate=None, prune=None):
+        """
+        Return a list of cursors of all tags (including this tag) with the
+        given name for which predicate(cursor) returns True. Names are
+        compared without decoding them. See walk() for the prune parameter.
+        """
+        arena = self.arena
+        data, names = arena.data, arena.names
+        if prune is None:
+            # No paths are needed: simply scan the subtree.
+            cursors = (ArenaCursor(arena, i) for i in
+                       range(self.index, arena.ends[self.index]))
+        else:
+            cursors = (cursor for path, cursor in self.walk(prune))
+        if name is not None:
+            encoded = name.encode("utf-8")
+            size = len(encoded)
+        result = []
+        for cursor in cursors:
+            if name is not None:
+                namepos = names[cursor.index]
+                if namepos < 0 or \
+                        _USHORT.unpack_from(data, namepos)[0] != size or \
+                        data[namepos + 2:namepos + 2 + size] != encoded:
+                    continue
+            if predicate is None or predicate(cursor):
+                result.append(cursor)
+        return result
+
+    def value(self):
+        """
+        Decode and return the value of this tag, using the same Python types
+        as the value attribute of the corresponding TAG class. For a
+        TAG_Compound or TAG_List, a list of cursors is returned.
+        """
+        tagtype = self.id
+        if tagtype in (TAG_COMPOUND, TAG_LIST):
+            return list(self.children())
+        return _decode_value(self.arena.data, tagtype, self.offset)
+
+    def to_tag(self):
+        """Parse this subtree into regular (mutable) TAG objects."""
+        return _parse_tag(self.arena.data, self.id, self.offset, self.name)
+
+    def tag_info(self):
+        """Return Unicode string with class, name and a value summary."""
+        return "%s(%r) at %d" % (TAGLIST[self.id].__name__, self.name,
+                                 self.offset)
+
+    def __repr__(self):
+        return "<%s %s>" % (self.__class__.__name__, self.tag_info())
+
+
+class _BufferReader(object):
+    """File-like object reading from a buffer, starting at offset."""
+
+    def __init__(self, data, offset):
+        self.data = data
+        self.pos = offset
+
+    def read(self, size):
+        result = bytes(self.data[self.pos:self.pos + size])
+        self.pos += len(result)
+        return result
+
+    def tell(self):
+        return self.pos
+
+
+def _parse_tag(data, tagtype, offset, name):
+    """Parse the payload at offset into regular TAG objects."""
+    tag = TAGLIST[tagtype]()
+    tag._parse_buffer(_BufferReader(data, offset))
+    tag.name = name
+    return tag
+
+
+def _decode_string(data, offset):
+    """Decode a string with a 2-byte length prefix at offset."""
+    size = _USHORT.unpack_from(data, offset)[0]
+    return bytes(data[offset + 2:offset + 2 + size]).decode("utf-8")
+
+
+def _decode_value(data, tagtype, offset):
+    """Decode the payload at offset of a tag, other than a TAG_Compound or
+    TAG_List."""
+    if tagtype in _SCALARS:
+        return _SCALARS[tagtype].unpack_from(data, offset)[0]
+    elif tagtype == TAG_STRING:
+        return _decode_string(data, offset)
+    elif tagtype == TAG_BYTE_ARRAY:
+        count = _INT.unpack_from(data, offset)[0]
+        return bytearray(data[offset + 4:offset + 4 + count])
+    elif tagtype in _ARRAY_FORMATS:
+        count = _INT.unpack_from(data, offset)[0]
+        fmt = ">%d%s" % (count, _ARRAY_FORMATS[tagtype])
+        return list(Struct(fmt).unpack_from(data, offset + 4))
+    raise MalformedFileError("Unrecognised tag type %d" % tagtype)
+
+
+def _fixed_size(tagtype):
+    """Return the payload size of a tag type, or None if it varies."""
+    scalar = _SCALARS.get(tagtype)
+    return scalar.size if scalar is not None else None
+
+
+def _skip(data, tagtype, offset):
+    """
+    Return the offset just past the payload at offset, without decoding
+    it. Array payloads and lists of fixed size elements are skipped in one
+    step; nested collections are skipped with an explicit stack.
+    """
+    # Each stack entry is [element type, remaining elements].
+    # The element type is None for compounds.
+    stack = []
+    while True:
+        if tagtype in _SCALARS:
+            offset += _SCALARS[tagtype].size
+        elif tagtype == TAG_STRING:
+            offset += 2 + _USHORT.unpack_from(data, offset)[0]
+        elif tagtype in _ITEMSIZES:
+            count = _INT.unpack_from(data, offset)[0]
+            if count < 0:
+                raise MalformedFileError("Invalid array length %d" % count)
+            offset += 4 + count * _ITEMSIZES[tagtype]
+        elif tagtype == TAG_COMPOUND:
+            stack.append([None, 0])
+        elif tagtype == TAG_LIST:
+            elementtype = _BYTE.unpack_from(data, offset)[0]
+            count = _INT.unpack_from(data, offset + 1)[0]
+            if count < 0:
+                raise MalformedFileError("Invalid list length %d" % count)
+            offset += 5
+            size = _fixed_size(elementtype)
+            if size is not None:
+                offset += count * size
+            elif count > 0:
+                stack.append([elementtype, count])
+        else:
+            raise MalformedFileError("Unrecognised tag type %d" % tagtype)
+        if offset > len(data):
+            raise MalformedFileError(
+                "Partial File Parse: file possibly truncated.")
+
+        # find the next tag to skip
+        while stack:
+            frame = stack[-1]
+            if frame[0] is None:
+                tagtype = _BYTE.unpack_from(data, offset)[0]
+                offset += 1
+                if tagtype == TAG_END:
+                    stack.pop()
+                    continue
+                offset += 2 + _USHORT.unpack_from(data, offset)[0]
+                break
+            elif frame[1] > 0:
+                frame[1] -= 1
+                tagtype = frame[0]
+                break
+            stack.pop()
+        else:
+            return offset
@@ -0,0 +1,351 @@
+"""
+Columnar view of a TAG_List of TAG_Compounds.
+
+A list of entities or tile entities is usually analysed field by field:
+the health of all mobs, or the positions of all items. ColumnarList turns
+the list of compounds into one typed column per field (struct-of-arrays),
+so aggregations work on an array instead of looking up each field in each
+compound.
+
+Column names are the names of the fields. Fields of nested compounds are
+named "parent/child", and the elements of a list of numbers get an index:
+"Pos[0]", "Pos[1]", "Pos[2]". Numbers are stored in an array.array; strings
+and all other tags (arrays, lists of compounds, ...) in a list. Each column
+has a mask with a 1 for each row where the field is present. Missing
+values are stored as 0 (numbers) or None (other values).
+"""
+
+from array import array
+from itertools import compress
+from struct import error as StructError
+import sys
+
+from .nbt import TAG_BYTE, TAG_SHORT, TAG_INT, TAG_LONG, TAG_FLOAT, \
+    TAG_DOUBLE, TAG_STRING, TAG_LIST, TAG_COMPOUND, TAG_END, \
+    MalformedFileError, _INT32_TYPECODE, _INT64_TYPECODE
+from .arena import _BYTE, _INT, _USHORT, _SCALARS, _decode_string, \
+    _parse_tag, _skip
+from .mapped import MappedCursor
+
+if sys.version_info < (3,):
+    range = xrange
+
+_TYPECODES = {
+    TAG_BYTE: 'b',
+    TAG_SHORT: 'h',
+    TAG_INT: _INT32_TYPECODE,
+    TAG_LONG: _INT64_TYPECODE,
+    TAG_FLOAT: 'f',
+    TAG_DOUBLE: 'd',
+}
+"""array.array type code of each numeric tag type"""
+
+_INTEGER_TYPECODES = ('b', 'h', _INT32_TYPECODE, _INT64_TYPECODE)
+
+
+def _promote(a, b):
+    """Return a type code that can hold values of type codes a and b."""
+    if a == b:
+        return a
+    if a in _INTEGER_TYPECODES and b in _INTEGER_TYPECODES:
+        return max(a, b, key=_INTEGER_TYPECODES.index)
+    if a in ('b', 'h', 'f') and b in ('b', 'h', 'f'):
+        return 'f'
+    return 'd'
+
+
+class Column(object):
+    """
+    Values of one field for all rows of a ColumnarList.
+
+    values is an array.array for numeric fields, and a list otherwise.
+    mask is a bytearray with a 1 for each row where the field is present.
+    """
+
+    def __init__(self, name, typecode=None):
+        self.name = name
+        self.typecode = typecode
+        """array.array type code, or None if values is a list"""
+        self.values = array(typecode) if typecode else []
+        self.mask = bytearray()
+
+    def _set(self, row, value, typecode):
+        """Set the value at row (which is at or after the last row)."""
+        if typecode != self.typecode:
+            self._convert(typecode)
+        values = self.values
+        missing = row - len(values)
+        if missing < 0:
+            # a name occurs twice in one compound; keep the last value
+            values[row] = value
+            return
+        if missing:
+            self._pad(missing)
+        values.append(value)
+        self.mask.append(1)
+
+    def _pad(self, count):
+        if self.typecode:
+            self.values.extend(array(self.typecode, [0]) * count)
+        else:
+            self.values.extend([None] * count)
+        self.mask.extend(bytearray(count))
+
+    def _convert(self, typecode):
+        """Change the type of the values, so typecode values fit in."""
+        if self.typecode and typecode:
+            typecode = _promote(self.typecode, typecode)
+            if typecode != self.typecode:
+                self.values = array(typecode, self.values)
+                self.typecode = typecode
+        elif self.typecode:
+            self.values = [v if present else None for v, present
+                           in zip(self.values, self.mask)]
+            self.typecode = None
+
+    def __len__(self):
+        return len(self.mask)
+
+    def __getitem__(self, row):
+        """Return the value at row, or None if the field is missing."""
+        return self.values[row] if self.mask[row] else None
+
+    def __iter__(self):
+        for value, present in zip(self.values, self.mask):
+            yield value if present else None
+
+    def present(self):
+        """Return the values of the rows where the field is present."""
+        return list(compress(self.values, self.mask))
+
+    def count(self):
+        """Return the number of rows where the field is present."""
+        return self.mask.count(b"\x01")
+
+    def sum(self):
+        """Return the sum of the present values."""
+        if not self.typecode:
+            raise TypeError("Column %s is not numeric" % self.name)
+        # missing values are 0
+        return sum(self.values)
+
+    def min(self):
+        """Return the smallest present value, or None."""
+        return min(self.present()) if self.count() else None
+
+    def max(self):
+        """Return the largest present value, or None."""
+        return max(self.present()) if self.count() else None
+
+    def mean(self):
+        """Return the mean of the present values, or None."""
+        count = self.count()
+        return self.sum() / float(count) if count else None
+
+    def to_numpy(self):
+        """
+        Return the column as numpy.ma.MaskedArray, with missing values
+        masked. Requires NumPy.
+        """
+        import numpy
+        mask = numpy.frombuffer(bytes(self.mask), dtype=numpy.uint8) == 0
+        if self.typecode:
+            values = numpy.array(self.values, dtype=self.values.typecode)
+        else:
+            values = numpy.empty(len(self.values), dtype=object)
+            values[:] = self.values
+        return numpy.ma.masked_array(values, mask=mask)
+
+    def __repr__(self):
+        return "<%s(%r, %r) %d of %d present>" % (
+            self.__class__.__name__, self.name, self.typecode,
+            self.count(), len(self))
+
+
+class ColumnarList(object):
+    """
+    Struct-of-arrays view of a TAG_List of TAG_Compounds.
+
+    Build it with from_tag() or from_buffer(). Columns are looked up by
+    name: ``entities["Health"].mean()``.
+    """
+
+    def __init__(self):
+        self.columns = {}
+        """Dictionary of Column objects by name"""
+        self.names = []
+        """Column names, in order of first appearance"""
+        self.length = 0
+        """Number of rows"""
+
+    @classmethod
+    def from_tag(cls, taglist, columns=None):
+        """
+        Build the columns from a TAG_List of TAG_Compounds.
+        If columns is specified, only columns with these names are built.
+        """
+        if taglist.id != TAG_LIST:
+            raise TypeError("%s is not a TAG_List" % taglist.tag_info())
+        if taglist.tags and taglist.tagID != TAG_COMPOUND:
+            raise TypeError("%s is not a list of compounds"
+                            % taglist.tag_info())
+        columnar = cls()
+        wanted = set(columns) if columns is not None else None
+        for row, compound in enumerate(taglist.tags):
+            # Nested compounds are visited in place, as in from_buffer().
+            stack = [(iter(compound.tags), "")]
+            while stack:
+                tags, prefix = stack[-1]
+                tag = next(tags, None)
+                if tag is None:
+                    stack.pop()
+                    continue
+                name = prefix + tag.name
+                tagtype = tag.id
+                if tagtype == TAG_COMPOUND:
+                    stack.append((iter(tag.tags), name + "/"))
+                elif tagtype == TAG_LIST and tag.tagID in _TYPECODES:
+                    typecode = _TYPECODES[tag.tagID]
+                    for i, element in enumerate(tag.tags):
+                        columnar._set("%s[%d]" % (name, i), row,
+                                      element.value, typecode, wanted)
+                elif tagtype in _TYPECODES:
+                    columnar._set(name, row, tag.value, _TYPECODES[tagtype],
+                                  wanted)
+                elif tagtype == TAG_STRING:
+                    columnar._set(name, row, tag.value, None, wanted)
+                else:
+                    columnar._set(name, row, tag, None, wanted)
+        columnar._finish(len(taglist.tags))
+        return columnar
+
+    @classmethod
+    def from_buffer(cls, data, path, columns=None):
+        """
+        Build the columns directly from uncompressed NBT data, without
+        creating TAG objects for numbers and strings.
+
+        data is a bytes-like object (e.g. the data of a MappedNBTFile) with
+        an NBT document, and path the path of the TAG_List of TAG_Compounds
+        in that document, as for MappedNBTFile.find().
+        If columns is specified, only columns with these names are built.
+        Raise MalformedFileError if the data is truncated or invalid.
+        """
+        try:
+            return cls._from_buffer(data, path, columns)
+        except StructError:
+            raise MalformedFileError(
+                "Partial File Parse: file possibly truncated.")
+        except UnicodeDecodeError as e:
+            raise MalformedFileError("Invalid UTF-8 in string: %s" % e)
+
+    @classmethod
+    def _from_buffer(cls, data, path, columns):
+        namelength = _USHORT.unpack_from(data, 1)[0]
+        if _BYTE.unpack_from(data, 0)[0] != TAG_COMPOUND:
+            raise MalformedFileError("First record is not a Compound Tag")
+        cursor = MappedCursor(data, TAG_COMPOUND, 3 + namelength, 1)
+        cursor = cursor.find(path)
+        if cursor is None:
+            raise KeyError("Tag %s does not exist" % (path,))
+        if cursor.id != TAG_LIST:
+            raise TypeError("%s is not a TAG_List" % (path,))
+        elementtype = _BYTE.unpack_from(data, cursor.offset)[0]
+        count = _INT.unpack_from(data, cursor.offset + 1)[0]
+        if count < 0:
+            raise MalformedFileError("Invalid list length %d" % count)
+        if count and elementtype != TAG_COMPOUND:
+            raise TypeError("%s is not a list of compounds" % (path,))
+
+        columnar = cls()
+        wanted = set(columns) if columns is not None else None
+        names = {}  # cache of decoded names, by raw name
+        offset = cursor.offset + 5
+        for row in range(count):
+            prefixes = [""]
+            while prefixes:
+                tagtype = _BYTE.unpack_from(data, offset)[0]
+                if tagtype == TAG_END:
+                    prefixes.pop()
+                    offset += 1
+                    continue
+                size = _USHORT.unpack_from(data, offset + 1)[0]
+                start = offset + 3
+                offset = start + size
+                raw = bytes(data[start:offset])
+                name = names.get(raw)
+                if name is None:
+                    name = names[raw] = raw.decode("utf-8")
+                name = prefixes[-1] + name
+                if tagtype == TAG_COMPOUND:
+                    prefixes.append(name + "/")
+                    continue
+                end = _skip(data, tagtype, offset)
+                if tagtype in _SCALARS:
+                    columnar._set(name, row, _SCALARS[tagtype].unpack_from(
+                        data, offset)[0], _TYPECODES[tagtype], wanted)
+                elif tagtype == TAG_STRING:
+                    columnar._set(name, row, _decode_string(data, offset),
+                                  None, wanted)
+                elif tagtype == TAG_LIST and \
+                        _BYTE.unpack_from(data, offset)[0] in _SCALARS:
+                    elementtype = _BYTE.unpack_from(data, offset)[0]
+                    scalar = _SCALARS[elementtype]
+                    typecode = _TYPECODES[elementtype]
+                    position = offset + 5
+                    for i in range(_INT.unpack_from(data, offset + 1)[0]):
+                        columnar._set("%s[%d]" % (name, i), row,
+                                      scalar.unpack_from(data, position)[0],
+                                      typecode, wanted)
+                        position += scalar.size
+                elif wanted is None or name in wanted:
+                    tag = _parse_tag(data, tagtype, offset,
+                                     name.rsplit("/", 1)[-1])
+                    columnar._set(name, row, tag, None, wanted)
+                offset = end
+        columnar._finish(count)
+        return columnar
+
+    def _set(self, name, row, value, typecode, wanted):
+        if wanted is not None and name not in wanted:
+            return
+        column = self.columns.get(name)
+        if column is None:
+            column = self.columns[name] = Column(name, typecode)
+            self.names.append(name)
+        column._set(row, value, typecode)
+
+    def _finish(self, length):
+        """Pad all columns to length rows."""
+        self.length = length
+        for column in self.columns.values():
+            if len(column) < length:
+                column._pad(length - len(column))
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, name):
+        """Return the Column with the given name."""
+        return self.columns[name]
+
+    def __contains__(self, name):
+        return name in self.columns
+
+    def keys(self):
+        """Return the column names, in order of first appearance."""
+        return list(self.names)
+
+    def row(self, index):
+        """Return a dictionary with the present values of one row."""
+        if index < 0:
+            index += self.length
+        if not 0 <= index < self.length:
+            raise IndexError("row %d out of range" % index)
+        return dict((name, column.values[index])
+                    for name, column in self.columns.items()
+                    if column.mask[index])
+
+    def __repr__(self):
+        return "<%s with %d rows, %d columns>" % (
+            self.__class__.__name__, self.length, len(self.names))
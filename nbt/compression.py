@@ -0,0 +1,339 @@
+"""
+Compression of chunks in region files.
+
+Each chunk in a region file is preceded by a compression byte. This module
+keeps a registry of codecs by compression byte, each with a function to
+decompress and a function to compress chunk data. Built in are:
+
+- 0: uncompressed (non-standard; written by early versions of this library)
+- 1: GZip (deprecated)
+- 2: zlib (default)
+- 3: uncompressed
+- 4: LZ4, in the LZ4Block stream format of lz4-java, as used by Minecraft
+
+LZ4 uses the lz4 module (python-lz4) when it is installed. Without it,
+LZ4 data is decoded in pure Python, and written in uncompressed ("raw")
+LZ4 blocks, which every LZ4Block reader accepts.
+
+Each LZ4 block has an xxHash32 checksum, calculated with the xxhash module
+when it is installed. The pure Python fallback takes about 8 ms per 64 KiB
+block, which is slower than zlib, so checksums are only verified on read if
+xxhash is installed (see LZ4_VERIFY). Writing always needs the checksum.
+
+Other codecs, e.g. for compression byte 127 (a custom algorithm, of which
+the namespaced name precedes the data), can be added with register_codec().
+The functions of a codec receive and return the complete chunk data after
+the compression byte.
+"""
+
+from struct import Struct
+from io import BytesIO
+import gzip
+import zlib
+import sys
+
+try:
+    import lz4.block as _lz4block
+except ImportError:
+    _lz4block = None
+
+try:
+    import xxhash as _xxhash
+except ImportError:
+    _xxhash = None
+
+if sys.version_info < (3,):
+    range = xrange
+
+COMPRESSION_NONE = 0
+"""Constant indicating that the chunk is not compressed (non-standard)."""
+COMPRESSION_GZIP = 1
+"""Constant indicating that the chunk is GZip compressed."""
+COMPRESSION_ZLIB = 2
+"""Constant indicating that the chunk is zlib compressed."""
+COMPRESSION_UNCOMPRESSED = 3
+"""Constant indicating that the chunk is not compressed."""
+COMPRESSION_LZ4 = 4
+"""Constant indicating that the chunk is LZ4 compressed (LZ4Block format)."""
+COMPRESSION_CUSTOM = 127
+"""Constant indicating a custom compression algorithm. No codec is built in."""
+
+
+class Codec(object):
+    """Functions to decompress and compress chunk data of one compression type."""
+    def __init__(self, compression, name, decompress, compress=None):
+        self.compression = compression
+        """The compression byte"""
+        self.name = name
+        self.decompress = decompress
+        """Function which returns the decompressed bytes of a bytes-like object"""
+        self.compress = compress
+        """Function which returns compressed bytes, or None if writing is not supported"""
+    def __repr__(self):
+        return "<%s %d (%s)>" % (self.__class__.__name__, self.compression, self.name)
+
+
+_CODECS = {}
+
+
+def register_codec(compression, decompress, compress=None, name=None):
+    """
+    Register the functions to decompress and compress chunks with the given
+    compression byte, replacing any existing codec. Return the Codec.
+    """
+    codec = Codec(compression, name or "compression %d" % compression,
+                  decompress, compress)
+    _CODECS[compression] = codec
+    return codec
+
+
+def get_codec(compression):
+    """Return the Codec for a compression byte. Raise a KeyError if there is none."""
+    return _CODECS[compression]
+
+
+def decompress(compression, data):
+    """Return the decompressed data of a chunk with the given compression byte."""
+    return get_codec(compression).decompress(data)
+
+
+def compress(compression, data):
+    """
+    Return data compressed with the given compression type.
+    Raise a ValueError if the compression type can not be written.
+    """
+    codec = _CODECS.get(compression)
+    if codec is None or codec.compress is None:
+        raise ValueError("Unknown compression type %d" % compression)
+    return codec.compress(data)
+
+
+def _copy(data):
+    """Return a bytes-like object (e.g. a memoryview) as bytes."""
+    return memoryview(data).tobytes()
+
+
+def _gzip_decompress(data):
+    # Python 3.1 and earlier do not yet support gzip.decompress(chunk)
+    f = gzip.GzipFile(fileobj=BytesIO(data))
+    try:
+        return bytes(f.read())
+    finally:
+        f.close()
+
+
+def _gzip_compress(data):
+    # Python 3.1 and earlier do not yet support `data = gzip.compress(data)`.
+    compressed_file = BytesIO()
+    f = gzip.GzipFile(fileobj=compressed_file, mode="wb")
+    f.write(data)
+    f.close()
+    return compressed_file.getvalue()
+
+
+# xxHash32, used for the checksums of LZ4 blocks.
+
+_PRIME32_1 = 2654435761
+_PRIME32_2 = 2246822519
+_PRIME32_3 = 3266489917
+_PRIME32_4 = 668265263
+_PRIME32_5 = 374761393
+_MASK32 = 0xFFFFFFFF
+_LANES = Struct("<4I")
+_UINT = Struct("<I")
+
+
+def xxh32(data, seed=0):
+    """Return the 32-bit xxHash of a bytes-like object."""
+    if _xxhash is not None:
+        return _xxhash.xxh32(_copy(data), seed).intdigest()
+    data = _copy(data)
+    length = len(data)
+    offset = 0
+    if length >= 16:
+        v1 = (seed + _PRIME32_1 + _PRIME32_2) & _MASK32
+        v2 = (seed + _PRIME32_2) & _MASK32
+        v3 = seed
+        v4 = (seed - _PRIME32_1) & _MASK32
+        for offset in range(0, length - 15, 16):
+            a, b, c, d = _LANES.unpack_from(data, offset)
+            v1 = (v1 + a * _PRIME32_2) & _MASK32
+            v1 = (((v1 << 13) | (v1 >> 19)) * _PRIME32_1) & _MASK32
+            v2 = (v2 + b * _PRIME32_2) & _MASK32
+            v2 = (((v2 << 13) | (v2 >> 19)) * _PRIME32_1) & _MASK32
+            v3 = (v3 + c * _PRIME32_2) & _MASK32
+            v3 = (((v3 << 13) | (v3 >> 19)) * _PRIME32_1) & _MASK32
+            v4 = (v4 + d * _PRIME32_2) & _MASK32
+            v4 = (((v4 << 13) | (v4 >> 19)) * _PRIME32_1) & _MASK32
+        offset = length - length % 16
+        h = (((v1 << 1) | (v1 >> 31)) + ((v2 << 7) | (v2 >> 25)) +
+             ((v3 << 12) | (v3 >> 20)) + ((v4 << 18) | (v4 >> 14))) & _MASK32
+    else:
+        h = (seed + _PRIME32_5) & _MASK32
+    h = (h + length) & _MASK32
+    while offset + 4 <= length:
+        h = (h + _UINT.unpack_from(data, offset)[0] * _PRIME32_3) & _MASK32
+        h = (((h << 17) | (h >> 15)) * _PRIME32_4) & _MASK32
+        offset += 4
+    for byte in bytearray(data[offset:]):
+        h = (h + byte * _PRIME32_5) & _MASK32
+        h = (((h << 11) | (h >> 21)) * _PRIME32_1) & _MASK32
+    h ^= h >> 15
+    h = (h * _PRIME32_2) & _MASK32
+    h ^= h >> 13
+    h = (h * _PRIME32_3) & _MASK32
+    h ^= h >> 16
+    return h
+
+
+# LZ4Block stream format of lz4-java: each block has a 21-byte header with
+# a magic string, a token (compression method and block size), the
+# compressed and decompressed length, and a checksum of the decompressed
+# data. The stream ends with an empty block.
+
+LZ4_MAGIC = b"LZ4Block"
+LZ4_BLOCK_SIZE = 1 << 16
+"""Maximum number of decompressed bytes in each written LZ4 block."""
+LZ4_SEED = 0x9747b28c
+"""Seed of the xxHash32 checksum of each LZ4 block."""
+LZ4_VERIFY = None
+"""
+Verify the checksum of LZ4 blocks on read: True, False, or None to verify
+only if the xxhash module is installed.
+"""
+
+_LZ4_HEADER = Struct("<8sBiiI")
+_LZ4_METHOD_RAW = 0x10
+_LZ4_METHOD_LZ4 = 0x20
+_LZ4_LEVEL_BASE = 10
+_LZ4_LEVEL = 6  # block size 1 << (10 + 6)
+_LZ4_CHECKSUM_MASK = 0x0FFFFFFF
+
+
+def lz4_block_decompress(data, size):
+    """
+    Decompress one LZ4 block (without frame or header) of size decompressed bytes.
+    Uses the lz4 module if installed, and otherwise decodes in pure Python.
+    """
+    if _lz4block is not None:
+        return _lz4block.decompress(_copy(data), uncompressed_size=size)
+    src = bytearray(data)
+    end = len(src)
+    dst = bytearray()
+    i = 0
+    while i < end:
+        token = src[i]
+        i += 1
+        length = token >> 4
+        if length == 15:
+            while True:
+                n = src[i]
+                i += 1
+                length += n
+                if n != 255:
+                    break
+        dst += src[i:i + length]
+        i += length
+        if i >= end:
+            # the last sequence only has literals
+            break
+        offset = src[i] | (src[i + 1] << 8)
+        i += 2
+        length = token & 15
+        if length == 15:
+            while True:
+                n = src[i]
+                i += 1
+                length += n
+                if n != 255:
+                    break
+        length += 4
+        start = len(dst) - offset
+        if offset == 0 or start < 0:
+            raise ValueError("Invalid LZ4 match offset %d" % offset)
+        if length <= offset:
+            dst += dst[start:start + length]
+        else:
+            # the match overlaps the output: repeat the last offset bytes
+            pattern = dst[start:]
+            dst += (pattern * (length // offset + 1))[:length]
+    if len(dst) != size:
+        raise ValueError("LZ4 block decompressed to %d bytes instead of %d"
+                         % (len(dst), size))
+    return bytes(dst)
+
+
+def lz4_decompress(data, verify=None):
+    """
+    Return the decompressed data of an LZ4Block stream. verify overrides
+    LZ4_VERIFY, to verify the checksum of each block.
+    """
+    if verify is None:
+        verify = LZ4_VERIFY
+    if verify is None:
+        verify = _xxhash is not None
+    data = memoryview(data)
+    offset = 0
+    blocks = []
+    while offset < len(data):
+        if len(data) - offset < _LZ4_HEADER.size:
+            raise ValueError("LZ4Block stream is truncated")
+        magic, token, compressed, size, checksum = \
+            _LZ4_HEADER.unpack_from(data, offset)
+        if magic != LZ4_MAGIC:
+            raise ValueError("Not an LZ4Block stream")
+        offset += _LZ4_HEADER.size
+        method = token & 0xF0
+        if size < 0 or compressed < 0 or \
+                size > 1 << (_LZ4_LEVEL_BASE + (token & 0x0F)) or \
+                (size == 0) != (compressed == 0) or \
+                (method == _LZ4_METHOD_RAW and size != compressed):
+            raise ValueError("Invalid LZ4Block header")
+        if size == 0:
+            # end of stream
+            break
+        if len(data) - offset < compressed:
+            raise ValueError("LZ4Block stream is truncated")
+        block = data[offset:offset + compressed]
+        offset += compressed
+        if method == _LZ4_METHOD_RAW:
+            block = block.tobytes()
+        elif method == _LZ4_METHOD_LZ4:
+            block = lz4_block_decompress(block, size)
+        else:
+            raise ValueError("Unknown LZ4Block compression method 0x%02x" % method)
+        if verify and xxh32(block, LZ4_SEED) & _LZ4_CHECKSUM_MASK != checksum:
+            raise ValueError("LZ4Block checksum mismatch")
+        blocks.append(block)
+    return b"".join(blocks)
+
+
+def lz4_compress(data):
+    """
+    Return data as an LZ4Block stream. Without the lz4 module, the blocks are
+    stored uncompressed.
+    """
+    data = _copy(data)
+    parts = []
+    for start in range(0, len(data), LZ4_BLOCK_SIZE):
+        block = data[start:start + LZ4_BLOCK_SIZE]
+        checksum = xxh32(block, LZ4_SEED) & _LZ4_CHECKSUM_MASK
+        compressed = None
+        if _lz4block is not None:
+            compressed = _lz4block.compress(block, store_size=False)
+        if compressed is not None and len(compressed) < len(block):
+            method = _LZ4_METHOD_LZ4
+        else:
+            method, compressed = _LZ4_METHOD_RAW, block
+        parts.append(_LZ4_HEADER.pack(LZ4_MAGIC, method | _LZ4_LEVEL,
+                                      len(compressed), len(block), checksum))
+        parts.append(compressed)
+    parts.append(_LZ4_HEADER.pack(LZ4_MAGIC, _LZ4_METHOD_RAW | _LZ4_LEVEL, 0, 0, 0))
+    return b"".join(parts)
+
+
+register_codec(COMPRESSION_NONE, _copy, _copy, "uncompressed")
+register_codec(COMPRESSION_GZIP, _gzip_decompress, _gzip_compress, "gzip")
+register_codec(COMPRESSION_ZLIB, zlib.decompress, zlib.compress, "zlib")
+register_codec(COMPRESSION_UNCOMPRESSED, _copy, _copy, "uncompressed")
+register_codec(COMPRESSION_LZ4, lz4_decompress, lz4_compress, "lz4")
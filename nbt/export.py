@@ -0,0 +1,232 @@
+"""
+Export NBT data as JSON, straight from the binary data.
+
+The exporter reads the NBT data tag by tag and writes the JSON text as it
+goes, without creating TAG objects or building the output in memory.
+Arrays are written compactly, as one JSON array of numbers.
+
+By default, each tag is written as plain JSON value: numbers, strings,
+arrays and objects. With typed=True, each tag is written as an object
+with its type: ``{"type": "short", "value": 3}``. Lists also have an
+``"elementType"``.
+
+Byte arrays are written as signed bytes, like TAG_Byte values. Float
+values that are not finite (NaN, infinity) are written as null, since
+JSON can not represent them.
+"""
+
+from array import array
+from gzip import GzipFile
+from io import BytesIO
+import json
+import math
+import sys
+
+from .nbt import TAG_END, TAG_BYTE, TAG_SHORT, TAG_INT, TAG_LONG, \
+    TAG_FLOAT, TAG_DOUBLE, TAG_BYTE_ARRAY, TAG_STRING, TAG_LIST, \
+    TAG_COMPOUND, TAG_INT_ARRAY, TAG_LONG_ARRAY, MalformedFileError, \
+    DEFAULT_LIMITS, _LimitedReader, _check_length, _check_string, \
+    _enter, _leave, _StringWriter, _INT32_TYPECODE, _INT64_TYPECODE
+from .arena import _BYTE, _USHORT, _INT, _SCALARS
+from .region import RegionFileFormatError
+
+if sys.version_info < (3,):
+    range = xrange
+
+TYPE_NAMES = {
+    TAG_BYTE: "byte",
+    TAG_SHORT: "short",
+    TAG_INT: "int",
+    TAG_LONG: "long",
+    TAG_FLOAT: "float",
+    TAG_DOUBLE: "double",
+    TAG_BYTE_ARRAY: "byte_array",
+    TAG_STRING: "string",
+    TAG_LIST: "list",
+    TAG_COMPOUND: "compound",
+    TAG_INT_ARRAY: "int_array",
+    TAG_LONG_ARRAY: "long_array",
+    TAG_END: "end",
+}
+"""Type names used in typed output"""
+
+_ARRAYS = {
+    TAG_BYTE_ARRAY: 'b',
+    TAG_INT_ARRAY: _INT32_TYPECODE,
+    TAG_LONG_ARRAY: _INT64_TYPECODE,
+}
+"""array.array type code of the elements of each array tag type"""
+
+ARRAY_BLOCK = 65536
+"""Number of array elements read and written at a time"""
+
+
+def _read(reader, size):
+    data = reader.read(size)
+    if len(data) != size:
+        raise MalformedFileError(
+            "Partial File Parse: file possibly truncated.")
+    return data
+
+
+def _read_string(reader):
+    length = _USHORT.unpack(_read(reader, 2))[0]
+    _check_string(reader, length)
+    try:
+        return _read(reader, length).decode("utf-8")
+    except UnicodeDecodeError as e:
+        raise MalformedFileError("Invalid UTF-8 in string: %s" % e)
+
+
+def _format_float(value):
+    if math.isinf(value) or math.isnan(value):
+        return "null"
+    return repr(value)
+
+
+def write_json(fileobj, out, typed=False, limits=None):
+    """
+    Read one uncompressed NBT document from the file object fileobj, and
+    write it as JSON to the text file out.
+    """
+    limits = limits if limits is not None else DEFAULT_LIMITS
+    reader = _LimitedReader(fileobj, limits)
+    if _BYTE.unpack(_read(reader, 1))[0] != TAG_COMPOUND:
+        raise MalformedFileError("First record is not a Compound Tag")
+    _read_string(reader)
+    write = out.write
+    # Each stack entry is [element type, remaining elements, first element].
+    # The element type is None for compounds.
+    if typed:
+        write('{"type":"compound","value":{')
+    else:
+        write('{')
+    stack = [[None, 0, True]]
+    _enter(reader)
+    while stack:
+        frame = stack[-1]
+        if frame[0] is None:
+            tagtype = _BYTE.unpack(_read(reader, 1))[0]
+            if tagtype == TAG_END:
+                write('}}' if typed else '}')
+                stack.pop()
+                _leave(reader)
+                continue
+            name = _read_string(reader)
+            write(json.dumps(name) + ':' if frame[2]
+                  else ',' + json.dumps(name) + ':')
+        else:
+            if frame[1] == 0:
+                write(']}' if typed else ']')
+                stack.pop()
+                _leave(reader)
+                continue
+            frame[1] -= 1
+            tagtype = frame[0]
+            if not frame[2]:
+                write(',')
+        frame[2] = False
+
+        if tagtype == TAG_LIST:
+            elementtype = _BYTE.unpack(_read(reader, 1))[0]
+            count = _INT.unpack(_read(reader, 4))[0]
+            if elementtype not in TYPE_NAMES:
+                raise MalformedFileError(
+                    "Unrecognised tag type %d" % elementtype)
+            if elementtype == TAG_END and count > 0:
+                raise MalformedFileError("List of %d TAG_End elements"
+                                         % count)
+            _check_length(reader, count, 1)
+            if typed:
+                write('{"type":"list","elementType":"%s","value":['
+                      % TYPE_NAMES[elementtype])
+            else:
+                write('[')
+            _enter(reader)
+            stack.append([elementtype, count, True])
+            continue
+        elif tagtype == TAG_COMPOUND:
+            write('{"type":"compound","value":{' if typed else '{')
+            _enter(reader)
+            stack.append([None, 0, True])
+            continue
+
+        if typed:
+            write('{"type":"%s","value":' % TYPE_NAMES[tagtype])
+        if tagtype in _SCALARS:
+            scalar = _SCALARS[tagtype]
+            value = scalar.unpack(_read(reader, scalar.size))[0]
+            if tagtype in (TAG_FLOAT, TAG_DOUBLE):
+                write(_format_float(value))
+            else:
+                write(str(value))
+        elif tagtype == TAG_STRING:
+            write(json.dumps(_read_string(reader)))
+        elif tagtype in _ARRAYS:
+            _write_array(reader, tagtype, write)
+        else:
+            raise MalformedFileError("Unrecognised tag type %d" % tagtype)
+        if typed:
+            write('}')
+
+
+def _write_array(reader, tagtype, write):
+    """Copy an array payload from reader to write, block by block."""
+    typecode = _ARRAYS[tagtype]
+    itemsize = array(typecode).itemsize
+    count = _INT.unpack(_read(reader, 4))[0]
+    _check_length(reader, count, itemsize)
+    write('[')
+    separator = ''
+    while count > 0:
+        n = min(count, ARRAY_BLOCK)
+        values = array(typecode)
+        values.frombytes(_read(reader, n * itemsize))
+        if sys.byteorder == 'little' and itemsize > 1:
+            values.byteswap()
+        write(separator + ','.join(map(str, values)))
+        separator = ','
+        count -= n
+    write(']')
+
+
+def write_json_file(filename, out, typed=False, limits=None):
+    """
+    Write the NBT file with the given name as JSON to the text file out.
+    The file may be GZip-compressed or uncompressed.
+    """
+    with open(filename, 'rb') as f:
+        magic = f.read(2)
+        f.seek(0)
+        if magic == b"\x1f\x8b":
+            f = GzipFile(fileobj=f)
+        write_json(f, out, typed, limits)
+
+
+def write_region_jsonl(region, out, typed=False):
+    """
+    Write each readable chunk of a RegionFile as one line of JSON to the
+    text file out. Each line is an object with the chunk coordinates
+    ("x", "z") within the region, the "timestamp" and the chunk "data".
+    Chunks that can not be read are skipped, like in
+    RegionFile.iter_chunks().
+
+    Only one chunk is in memory at a time.
+    """
+    for m in region.get_metadata():
+        try:
+            data = region.get_blockdata(m.x, m.z)
+        except RegionFileFormatError:
+            continue
+        # Write the chunk to a buffer first, so a corrupt chunk does not
+        # leave an incomplete line behind.
+        line = _StringWriter()
+        try:
+            write_json(BytesIO(data), line, typed, region.limits)
+        except MalformedFileError:
+            continue
+        out.write('{"x":%d,"z":%d,"timestamp":%d,"data":'
+                  % (m.x, m.z, m.timestamp))
+        out.write(line.getvalue())
+        out.write('}\n')
+
@@ -0,0 +1,304 @@
+"""
+Random access into large, uncompressed NBT files using mmap.
+
+A MappedNBTFile maps the file in memory rather than reading it. Path
+lookups and list iteration skip over everything that is not needed, so only
+the pages that are actually used are read from disk.
+
+Optionally, an index of all tags (an :class:`nbt.arena.NBTArena`) is stored
+in a sidecar file next to the NBT file. It is built on first open, and makes
+each later lookup a jump to a known offset.
+"""
+
+import os
+import mmap
+from struct import error as StructError
+
+from .nbt import TAG_COMPOUND, TAG_LIST, TAG_STRING, TAG_END, TAGLIST, \
+    MalformedFileError, DEFAULT_LIMITS
+from .arena import NBTArena, _BYTE, _USHORT, _INT, _ITEMSIZES, \
+    _decode_string, _decode_value, _fixed_size, _parse_tag, _skip
+
+import sys
+if sys.version_info >= (3,):
+    basestring = str
+
+INDEX_SUFFIX = ".idx"
+"""Suffix of the index sidecar file, appended to the NBT file name."""
+
+
+class MappedNBTFile(object):
+    """
+    Memory-mapped, read-only, uncompressed NBT file.
+
+    Lookups return cursors with the same interface as
+    :class:`nbt.arena.ArenaCursor`: ``id``, ``name``, ``offset``,
+    ``value()``, ``children()``, ``find()``, ``to_tag()`` and item access by
+    name or index.
+    """
+
+    def __init__(self, filename, index=False, limits=None):
+        """
+        Open an uncompressed NBT file.
+
+        index is False (no index: each lookup scans the path), True (use an
+        index sidecar file named filename + INDEX_SUFFIX) or the name of the
+        sidecar file. The sidecar file is created if it does not exist, or
+        if it is outdated.
+        """
+        self.filename = filename
+        self.limits = limits if limits is not None else DEFAULT_LIMITS
+        self.arena = None
+        """NBTArena with the index, or None if no index is used"""
+        self.file = open(filename, 'rb')
+        try:
+            size = os.fstat(self.file.fileno()).st_size
+            if size < 3:
+                raise MalformedFileError(
+                    "Partial File Parse: file possibly truncated.")
+            self.data = mmap.mmap(self.file.fileno(), 0,
+                                  access=mmap.ACCESS_READ)
+            if self.data[:2] == b"\x1f\x8b":
+                raise MalformedFileError(
+                    "%s is GZip compressed; only uncompressed files can "
+                    "be memory-mapped" % filename)
+            if _BYTE.unpack_from(self.data, 0)[0] != TAG_COMPOUND:
+                raise MalformedFileError("First record is not a Compound Tag")
+            if index:
+                if index is True:
+                    index = filename + INDEX_SUFFIX
+                self.indexfile = index
+                self._open_index(index)
+        except:
+            self.close()
+            raise
+
+    def _index_key(self):
+        stat = os.fstat(self.file.fileno())
+        return ("%d:%d" % (stat.st_size, stat.st_mtime * 1000)).encode("ascii")
+
+    def _open_index(self, indexfile):
+        key = self._index_key()
+        if os.path.exists(indexfile):
+            with open(indexfile, 'rb') as f:
+                self.arena = NBTArena.load_index(self.data, f, key,
+                                                 self.limits)
+        if self.arena is None:
+            try:
+                self.arena = NBTArena(self.data, self.limits)
+            except StructError:
+                raise MalformedFileError(
+                    "Partial File Parse: file possibly truncated.")
+            tempfile = indexfile + ".tmp"
+            with open(tempfile, 'wb') as f:
+                self.arena.save_index(f, key)
+            _replace(tempfile, indexfile)
+
+    @property
+    def root(self):
+        """Cursor of the root TAG_Compound."""
+        if self.arena is not None:
+            return self.arena.root
+        namelength = _USHORT.unpack_from(self.data, 1)[0]
+        return MappedCursor(self.data, TAG_COMPOUND, 3 + namelength, 1)
+
+    @property
+    def name(self):
+        """Name of the root TAG_Compound."""
+        return _decode_string(self.data, 1)
+
+    def find(self, path):
+        """
+        Return the cursor at path, or None if it does not exist.
+
+        path is either a sequence of names and list indices, or a string
+        with names separated by slashes, e.g. "Level/Sections/0/Y".
+        """
+        try:
+            return self.root.find(path)
+        except StructError:
+            raise MalformedFileError(
+                "Partial File Parse: file possibly truncated.")
+
+    def iter_list(self, path):
+        """Yield a cursor for each element of the TAG_List at path."""
+        cursor = self.find(path)
+        if cursor is None:
+            raise KeyError("Tag %s does not exist" % (path,))
+        if cursor.id != TAG_LIST:
+            raise TypeError("%s is not a TAG_List" % (path,))
+        return cursor.children()
+
+    def close(self):
+        """Close the file and release the memory map."""
+        self.arena = None
+        data = getattr(self, 'data', None)
+        if data is not None:
+            data.close()
+            self.data = None
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __repr__(self):
+        return "<%s(%r) at 0x%x>" % (
+            self.__class__.__name__, self.filename, id(self))
+
+
+def _replace(src, dst):
+    """Rename src to dst, overwriting dst if it exists."""
+    if hasattr(os, 'replace'):
+        os.replace(src, dst)
+    else:
+        # Python 2: os.rename() does not overwrite files on Windows.
+        if os.name == 'nt' and os.path.exists(dst):
+            os.remove(dst)
+        os.rename(src, dst)
+
+
+class MappedCursor(object):
+    """
+    Reference to a tag in a buffer, found without an index.
+
+    Lookups in a TAG_Compound scan its children, skipping the payload of
+    each child that does not match. Elements of a list with fixed size
+    elements are located directly.
+    """
+    __slots__ = ('data', 'id', 'offset', 'nameoffset')
+
+    def __init__(self, data, tagtype, offset, nameoffset=-1):
+        self.data = data
+        self.id = tagtype
+        """Tag type, one of the TAG_* constants."""
+        self.offset = offset
+        """Offset of the payload of this tag in the buffer."""
+        self.nameoffset = nameoffset
+        """Offset of the name, or -1 for elements of a TAG_List"""
+
+    @property
+    def name(self):
+        """Name of the tag, or None for elements of a TAG_List."""
+        if self.nameoffset < 0:
+            return None
+        return _decode_string(self.data, self.nameoffset)
+
+    def __len__(self):
+        """Return the number of elements for collections, arrays and
+        strings."""
+        if self.id == TAG_COMPOUND:
+            return sum(1 for _ in self.children())
+        elif self.id == TAG_LIST:
+            return _INT.unpack_from(self.data, self.offset + 1)[0]
+        elif self.id in _ITEMSIZES:
+            return _INT.unpack_from(self.data, self.offset)[0]
+        elif self.id == TAG_STRING:
+            return len(self.value())
+        raise TypeError("%s has no len()" % TAGLIST[self.id].__name__)
+
+    def children(self):
+        """Yield a cursor for each child of a TAG_Compound or TAG_List."""
+        data = self.data
+        if self.id == TAG_COMPOUND:
+            offset = self.offset
+            while True:
+                tagtype = _BYTE.unpack_from(data, offset)[0]
+                if tagtype == TAG_END:
+                    return
+                nameoffset = offset + 1
+                offset = nameoffset + 2 + \
+                    _USHORT.unpack_from(data, nameoffset)[0]
+                yield MappedCursor(data, tagtype, offset, nameoffset)
+                offset = _skip(data, tagtype, offset)
+        elif self.id == TAG_LIST:
+            elementtype = _BYTE.unpack_from(data, self.offset)[0]
+            count = _INT.unpack_from(data, self.offset + 1)[0]
+            offset = self.offset + 5
+            for i in range(count):
+                yield MappedCursor(data, elementtype, offset)
+                offset = _skip(data, elementtype, offset)
+
+    def keys(self):
+        """Return the names of the children of a TAG_Compound."""
+        return [child.name for child in self.children()]
+
+    def __getitem__(self, key):
+        """Return the child with the given name (for a TAG_Compound), or
+        at the given index (for a TAG_List)."""
+        if isinstance(key, basestring):
+            if self.id == TAG_COMPOUND:
+                encoded = key.encode("utf-8")
+                size = len(encoded)
+                data = self.data
+                for child in self.children():
+                    start = child.nameoffset + 2
+                    if child.offset - start == size and \
+                            data[start:child.offset] == encoded:
+                        return child
+            raise KeyError("Tag %s does not exist" % key)
+        elif isinstance(key, int):
+            if self.id != TAG_LIST:
+                raise TypeError("Only elements of a TAG_List have an index")
+            length = len(self)
+            if key < 0:
+                key += length
+            if not 0 <= key < length:
+                raise IndexError("index %d out of range" % key)
+            elementtype = _BYTE.unpack_from(self.data, self.offset)[0]
+            size = _fixed_size(elementtype)
+            if size is not None:
+                return MappedCursor(self.data, elementtype,
+                                    self.offset + 5 + key * size)
+            for i, child in enumerate(self.children()):
+                if i == key:
+                    return child
+        raise TypeError(
+            "key needs to be either name of tag, or index of tag, "
+            "not a %s" % type(key).__name__)
+
+    def find(self, path):
+        """
+        Return the cursor at path, or None if it does not exist.
+
+        path is either a sequence of names and list indices, or a string
+        with names separated by slashes, e.g. "Level/Sections/0/Y".
+        """
+        if isinstance(path, basestring):
+            path = [int(p) if p.lstrip('-').isdigit() else p
+                    for p in path.split('/') if p]
+        cursor = self
+        for key in path:
+            if cursor.id not in (TAG_COMPOUND, TAG_LIST):
+                return None
+            try:
+                cursor = cursor[key]
+            except (KeyError, IndexError, TypeError):
+                return None
+        return cursor
+
+    def value(self):
+        """
+        Decode and return the value of this tag, using the same Python types
+        as the value attribute of the corresponding TAG class. For a
+        TAG_Compound or TAG_List, a list of cursors is returned.
+        """
+        if self.id in (TAG_COMPOUND, TAG_LIST):
+            return list(self.children())
+        return _decode_value(self.data, self.id, self.offset)
+
+    def to_tag(self):
+        """Parse this subtree into regular (mutable) TAG objects."""
+        return _parse_tag(self.data, self.id, self.offset, self.name)
+
+    def tag_info(self):
+        """Return Unicode string with class, name and offset."""
+        return "%s(%r) at %d" % (TAGLIST[self.id].__name__, self.name,
+                                 self.offset)
+
+    def __repr__(self):
+        return "<%s %s>" % (self.__class__.__name__, self.tag_info())
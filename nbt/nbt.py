@@ -7,19 +7,29 @@ https://minecraft.wiki/w/NBT_format
 
 from struct import Struct, error as StructError
 from gzip import GzipFile
+from io import BytesIO
+from array import array
+import copy
 try:
-    from collections.abc import MutableMapping, MutableSequence, Sequence
+    from collections.abc import Mapping, MutableMapping, MutableSequence, \
+        Sequence
 except ImportError:  # for Python 2.7
-    from collections import MutableMapping, MutableSequence, Sequence
+    from collections import Mapping, MutableMapping, MutableSequence, \
+        Sequence
 import sys
 
 _PY3 = sys.version_info >= (3,)
 if _PY3:
     unicode = str
     basestring = str
+    long = int
 else:
     range = xrange
 
+# array type codes for 32-bit and 64-bit signed integers
+_INT32_TYPECODE = 'i' if array('i').itemsize == 4 else 'l'
+_INT64_TYPECODE = 'l' if array('l').itemsize == 8 else 'q'
+
 TAG_END = 0
 TAG_BYTE = 1
 TAG_SHORT = 2
@@ -40,6 +50,206 @@ class MalformedFileError(Exception):
     pass
 
 
+class ParseLimits(object):
+    """
+    Resource limits enforced while parsing NBT data.
+
+    A corrupt or hostile file may claim an array or list of billions of
+    elements. The limits are checked as soon as a length is read, so parsing
+    fails with a MalformedFileError before anything is allocated.
+    Any limit can be set to None to disable it.
+    """
+
+    def __init__(self, max_bytes=None, max_depth=512, max_length=2**24,
+                 max_string_length=32767):
+        self.max_bytes = max_bytes
+        """maximum number of (uncompressed) bytes read for one file"""
+        self.max_depth = max_depth
+        """maximum nesting depth of TAG_Compound and TAG_List"""
+        self.max_length = max_length
+        """maximum number of elements in a TAG_List or array tag"""
+        self.max_string_length = max_string_length
+        """maximum length in bytes of a TAG_String or tag name"""
+
+    def __repr__(self):
+        return "%s(max_bytes=%r, max_depth=%r, max_length=%r, " \
+               "max_string_length=%r)" % (
+                   self.__class__.__name__, self.max_bytes, self.max_depth,
+                   self.max_length, self.max_string_length)
+
+
+DEFAULT_LIMITS = ParseLimits()
+"""ParseLimits used by NBTFile and RegionFile if no limits are specified."""
+
+
+class _LimitedReader(object):
+    """
+    Wrapper around a file object that enforces a ParseLimits instance.
+
+    Tags parse from the wrapper as from any other buffer; the _check_*
+    helpers below only do work if the buffer is a _LimitedReader.
+    Reads are only counted if limits.max_bytes is set. Otherwise, read is
+    the read method of the buffer itself, and lengths are checked against
+    the size of the data (if known) when they are decoded.
+    """
+
+    def __init__(self, buffer, limits, size=None):
+        self.buffer = buffer
+        self.limits = limits
+        self.depth = 0
+        if size is None and isinstance(buffer, BytesIO):
+            position = buffer.tell()
+            size = buffer.seek(0, 2) - position
+            buffer.seek(position)
+        # Bytes that may still be read. The actual data size (if known) is
+        # a tighter bound than limits.max_bytes.
+        self.remaining = limits.max_bytes
+        if size is not None and (self.remaining is None
+                                 or size < self.remaining):
+            self.remaining = size
+        self.end = None
+        if limits.max_bytes is None:
+            self.read = buffer.read
+            if size is not None:
+                self.end = buffer.tell() + size
+
+    def read(self, size):
+        if self.remaining is not None:
+            if size > self.remaining:
+                raise MalformedFileError(
+                    "Attempt to read %d bytes, while only %d bytes are left"
+                    % (size, self.remaining))
+            self.remaining -= size
+        return self.buffer.read(size)
+
+    def check_length(self, length, itemsize):
+        limit = self.limits.max_length
+        if limit is not None and length > limit:
+            raise MalformedFileError(
+                "Length %d exceeds the maximum of %d elements"
+                % (length, limit))
+        if self.end is not None:
+            remaining = self.end - self.buffer.tell()
+        else:
+            remaining = self.remaining
+        if remaining is not None and length * itemsize > remaining:
+            raise MalformedFileError(
+                "Length %d requires %d bytes, while only %d bytes are left"
+                % (length, length * itemsize, remaining))
+
+    def check_string(self, length):
+        limit = self.limits.max_string_length
+        if limit is not None and length > limit:
+            raise MalformedFileError(
+                "String length %d exceeds the maximum of %d bytes"
+                % (length, limit))
+
+    def enter(self):
+        self.depth += 1
+        limit = self.limits.max_depth
+        if limit is not None and self.depth > limit:
+            raise MalformedFileError(
+                "Nesting depth exceeds the maximum of %d" % limit)
+
+    def leave(self):
+        self.depth -= 1
+
+
+def _check_length(buffer, length, itemsize):
+    """Raise MalformedFileError if a list or array length is invalid.
+    itemsize is the minimum size of an element in bytes."""
+    if length < 0:
+        raise MalformedFileError("Negative length %d" % length)
+    if isinstance(buffer, _LimitedReader):
+        buffer.check_length(length, itemsize)
+
+
+def _check_string(buffer, length):
+    """Raise MalformedFileError if a string length is invalid."""
+    if length < 0:
+        raise MalformedFileError("Negative string length %d" % length)
+    if isinstance(buffer, _LimitedReader):
+        buffer.check_string(length)
+
+
+def _enter(buffer):
+    """Increase the nesting depth, raise MalformedFileError if too deep."""
+    if isinstance(buffer, _LimitedReader):
+        buffer.enter()
+
+
+def _leave(buffer):
+    """Decrease the nesting depth."""
+    if isinstance(buffer, _LimitedReader):
+        buffer.leave()
+
+
+def _is_ndarray(value):
+    """Return True if value looks like a NumPy array or scalar. NumPy is
+    not imported; it is not a dependency."""
+    return hasattr(value, 'dtype') and hasattr(value, 'ndim')
+
+
+def _to_bytearray(value):
+    """Convert a bytes-like object or sequence of integers to a bytearray."""
+    if isinstance(value, (int, long)):
+        raise TypeError("value must be a sequence, not an integer")
+    try:
+        if memoryview(value).itemsize == 1:
+            return bytearray(value)
+    except TypeError:
+        pass  # no buffer protocol
+    return bytearray(v & 0xFF for v in value)
+
+
+def _to_array(value, typecode):
+    """Convert an array.array or NumPy array with integer values to an
+    array.array with the given (signed) type code, without per-element
+    conversion in Python. Return other sequences as a list.
+    Raise ValueError if a value does not fit.
+    """
+    itemsize = array(typecode).itemsize
+    if isinstance(value, array):
+        if value.typecode in 'fd':
+            raise TypeError("Can not store %s values in an integer array"
+                            % value.typecode)
+        if value.typecode == typecode:
+            return value[:]
+        if value.typecode.islower() and value.itemsize == itemsize:
+            # same signed type under another type code
+            result = array(typecode)
+            result.frombytes(value.tobytes())
+            return result
+        try:
+            return array(typecode, value)
+        except OverflowError as e:
+            raise ValueError('%s' % e)
+    if _is_ndarray(value):
+        if value.dtype.kind not in 'iub':
+            raise TypeError("Can not store %s values in an integer array"
+                            % value.dtype)
+        if value.ndim != 1:
+            raise ValueError("Can not store a %d-dimensional array in an "
+                             "array tag" % value.ndim)
+        if value.dtype.kind != 'b' and len(value):
+            bits = 8 * itemsize
+            if int(value.min()) < -2**(bits - 1) or \
+                    int(value.max()) >= 2**(bits - 1):
+                raise ValueError("Array values do not fit in %d bits" % bits)
+        result = array(typecode)
+        result.frombytes(value.astype('=i%d' % itemsize).tobytes())
+        return result
+    return list(value)
+
+
+def _array_to_bytes(value):
+    """Return the big-endian binary representation of an array.array."""
+    if sys.byteorder == 'little':
+        value = value[:]
+        value.byteswap()
+    return value.tobytes()
+
+
 class TAG(object):
     """TAG, a variable with an intrinsic name."""
     id = None
@@ -55,6 +265,51 @@ class TAG(object):
     def _render_buffer(self, buffer):
         raise NotImplementedError(self.__class__.__name__)
 
+    # Traversal of tree
+    def walk(self, prune=None):
+        """
+        Yield a (path, tag) tuple for this tag and all its descendants,
+        in document order. path is a tuple of names (for children of a
+        TAG_Compound) and indices (for elements of a TAG_List), relative to
+        this tag.
+
+        If prune is given, it is called as prune(path, tag) for each
+        TAG_Compound and TAG_List; if it returns True, the children of that
+        tag are skipped.
+        """
+        stack = [((), self)]
+        while stack:
+            path, tag = stack.pop()
+            yield path, tag
+            if isinstance(tag, TAG_Compound):
+                if prune is not None and prune(path, tag):
+                    continue
+                children = [(path + (child.name,), child)
+                            for child in tag.tags]
+            elif isinstance(tag, TAG_List):
+                if prune is not None and prune(path, tag):
+                    continue
+                children = [(path + (i,), child)
+                            for i, child in enumerate(tag.tags)]
+            else:
+                continue
+            children.reverse()
+            stack.extend(children)
+
+    def find_all(self, name=None, predicate=None, prune=None):
+        """
+        Return a list of all tags (including this tag) with the given name
+        for which predicate(tag) returns True. Both name and predicate are
+        optional. See walk() for the prune parameter.
+        """
+        return [tag for path, tag in self.walk(prune)
+                if (name is None or tag.name == name)
+                and (predicate is None or predicate(tag))]
+
+    def freeze(self):
+        """Return an immutable, hashable copy of this tag as a FrozenTAG."""
+        return FrozenTAG(self.id, self.name, self.value, cls=self.__class__)
+
     # Printing and Formatting of tree
     def tag_info(self):
         """Return Unicode string with class, name and unnested value."""
@@ -180,15 +435,22 @@ class TAG_Byte_Array(TAG, MutableSequence):
     """
     id = TAG_BYTE_ARRAY
 
-    def __init__(self, name=None, buffer=None):
-        # TODO: add a value parameter as well
+    def __init__(self, name=None, buffer=None, value=None):
+        """
+        value may be any bytes-like object (bytes, bytearray,
+        array.array('b'), a NumPy int8 array, ...), which is copied
+        without per-element conversion, or a sequence of integers.
+        """
         super(TAG_Byte_Array, self).__init__(name=name)
+        if value is not None:
+            self.value = _to_bytearray(value)
         if buffer:
             self._parse_buffer(buffer)
 
     # Parsers and Generators
     def _parse_buffer(self, buffer):
         length = TAG_Int(buffer=buffer)
+        _check_length(buffer, length.value, 1)
         self.value = bytearray(buffer.read(length.value))
 
     def _render_buffer(self, buffer):
@@ -220,6 +482,10 @@ class TAG_Byte_Array(TAG, MutableSequence):
         # TODO: check type of value, or is this done by self.value already?
         self.value.insert(key, value)
 
+    def freeze(self):
+        return FrozenTAG(self.id, self.name, bytes(self.value),
+                         cls=self.__class__)
+
     # Printing and Formatting of tree
     def valuestr(self):
         return "[%i byte(s)]" % len(self.value)
@@ -237,10 +503,19 @@ class TAG_Int_Array(TAG, MutableSequence):
     an intrinsic name whose values must be integers
     """
     id = TAG_INT_ARRAY
+    itemsize = 4
 
-    def __init__(self, name=None, buffer=None):
-        # TODO: add a value parameter as well
+    def __init__(self, name=None, buffer=None, value=None):
+        """
+        value may be a sequence of integers, an array.array or a
+        one-dimensional NumPy array. Arrays are stored as an array.array of
+        int32 values, without per-element conversion, and are written
+        without per-element conversion too. Raise ValueError if an integer
+        does not fit in 32 bits.
+        """
         super(TAG_Int_Array, self).__init__(name=name)
+        if value is not None:
+            self.value = _to_array(value, _INT32_TYPECODE)
         if buffer:
             self._parse_buffer(buffer)
 
@@ -251,14 +526,19 @@ class TAG_Int_Array(TAG, MutableSequence):
     # Parsers and Generators
     def _parse_buffer(self, buffer):
         length = TAG_Int(buffer=buffer).value
+        _check_length(buffer, length, self.itemsize)
         self.update_fmt(length)
         self.value = list(self.fmt.unpack(buffer.read(self.fmt.size)))
 
     def _render_buffer(self, buffer):
         length = len(self.value)
-        self.update_fmt(length)
         TAG_Int(length)._render_buffer(buffer)
-        buffer.write(self.fmt.pack(*self.value))
+        if isinstance(self.value, array) and \
+                self.value.itemsize == self.itemsize:
+            buffer.write(_array_to_bytes(self.value))
+        else:
+            self.update_fmt(length)
+            buffer.write(self.fmt.pack(*self.value))
 
     # Mixin methods
     def __len__(self):
@@ -282,6 +562,10 @@ class TAG_Int_Array(TAG, MutableSequence):
     def insert(self, key, value):
         self.value.insert(key, value)
 
+    def freeze(self):
+        return FrozenTAG(self.id, self.name, tuple(self.value),
+                         cls=self.__class__)
+
     # Printing and Formatting of tree
     def valuestr(self):
         return "[%i int(s)]" % len(self.value)
@@ -293,9 +577,19 @@ class TAG_Long_Array(TAG, MutableSequence):
     an intrinsic name whose values must be integers
     """
     id = TAG_LONG_ARRAY
+    itemsize = 8
 
-    def __init__(self, name=None, buffer=None):
+    def __init__(self, name=None, buffer=None, value=None):
+        """
+        value may be a sequence of integers, an array.array or a
+        one-dimensional NumPy array. Arrays are stored as an array.array of
+        int64 values, without per-element conversion, and are written
+        without per-element conversion too. Raise ValueError if an integer
+        does not fit in 64 bits.
+        """
         super(TAG_Long_Array, self).__init__(name=name)
+        if value is not None:
+            self.value = _to_array(value, _INT64_TYPECODE)
         if buffer:
             self._parse_buffer(buffer)
 
@@ -306,14 +600,19 @@ class TAG_Long_Array(TAG, MutableSequence):
     # Parsers and Generators
     def _parse_buffer(self, buffer):
         length = TAG_Int(buffer=buffer).value
+        _check_length(buffer, length, self.itemsize)
         self.update_fmt(length)
         self.value = list(self.fmt.unpack(buffer.read(self.fmt.size)))
 
     def _render_buffer(self, buffer):
         length = len(self.value)
-        self.update_fmt(length)
         TAG_Int(length)._render_buffer(buffer)
-        buffer.write(self.fmt.pack(*self.value))
+        if isinstance(self.value, array) and \
+                self.value.itemsize == self.itemsize:
+            buffer.write(_array_to_bytes(self.value))
+        else:
+            self.update_fmt(length)
+            buffer.write(self.fmt.pack(*self.value))
 
     # Mixin methods
     def __len__(self):
@@ -337,6 +636,10 @@ class TAG_Long_Array(TAG, MutableSequence):
     def insert(self, key, value):
         self.value.insert(key, value)
 
+    def freeze(self):
+        return FrozenTAG(self.id, self.name, tuple(self.value),
+                         cls=self.__class__)
+
     # Printing and Formatting of tree
     def valuestr(self):
         return "[%i long(s)]" % len(self.value)
@@ -357,6 +660,7 @@ class TAG_String(TAG, Sequence):
     # Parsers and Generators
     def _parse_buffer(self, buffer):
         length = TAG_Short(buffer=buffer)
+        _check_string(buffer, length.value)
         read = buffer.read(length.value)
         if len(read) != length.value:
             raise StructError()
@@ -395,11 +699,13 @@ class TAG_List(TAG, MutableSequence):
 
     def __init__(self, type=None, value=None, name=None, buffer=None):
         super(TAG_List, self).__init__(value, name)
+        self.tags = list(value) if value is not None else []
         if type:
             self.tagID = type.id
+        elif self.tags:
+            self.tagID = self.tags[0].id
         else:
             self.tagID = None
-        self.tags = []
         if buffer:
             self._parse_buffer(buffer)
         # if self.tagID == None:
@@ -410,8 +716,22 @@ class TAG_List(TAG, MutableSequence):
         self.tagID = TAG_Byte(buffer=buffer).value
         self.tags = []
         length = TAG_Int(buffer=buffer)
-        for x in range(length.value):
-            self.tags.append(TAGLIST[self.tagID](buffer=buffer))
+        try:
+            cls = TAGLIST[self.tagID]
+        except KeyError:
+            raise MalformedFileError("Unrecognised tag type %d" % self.tagID)
+        # Every element takes at least one byte, except TAG_End elements,
+        # which take none at all, and are only valid in an empty list.
+        if self.tagID == TAG_END and length.value > 0:
+            raise MalformedFileError("List of %d TAG_End elements"
+                                     % length.value)
+        _check_length(buffer, length.value, 1)
+        _enter(buffer)
+        try:
+            for x in range(length.value):
+                self.tags.append(cls(buffer=buffer))
+        finally:
+            _leave(buffer)
 
     def _render_buffer(self, buffer):
         TAG_Byte(self.tagID)._render_buffer(buffer)
@@ -446,6 +766,11 @@ class TAG_List(TAG, MutableSequence):
     def insert(self, key, value):
         self.tags.insert(key, value)
 
+    def freeze(self):
+        return FrozenTAG(self.id, self.name,
+                         tuple([tag.freeze() for tag in self.tags]),
+                         self.tagID, self.__class__)
+
     # Printing and Formatting of tree
     def __repr__(self):
         return "%i entries of type %s" % (
@@ -462,12 +787,9 @@ class TAG_List(TAG, MutableSequence):
         return "[" + ", ".join([tag.tag_info() for tag in self.tags]) + "]"
 
     def pretty_tree(self, indent=0):
-        output = [super(TAG_List, self).pretty_tree(indent)]
-        if len(self.tags):
-            output.append(("\t" * indent) + "{")
-            output.extend([tag.pretty_tree(indent + 1) for tag in self.tags])
-            output.append(("\t" * indent) + "}")
-        return '\n'.join(output)
+        output = _StringWriter()
+        pretty_print(self, output, indent=indent)
+        return output.getvalue()[:-1]  # without the final newline
 
 
 class TAG_Compound(TAG, MutableMapping):
@@ -477,33 +799,50 @@ class TAG_Compound(TAG, MutableMapping):
     """
     id = TAG_COMPOUND
 
-    def __init__(self, buffer=None, name=None):
-        # TODO: add a value parameter as well
+    def __init__(self, buffer=None, name=None, value=None):
+        """
+        value is either a sequence of named TAG objects, or a mapping of
+        names to TAG objects.
+        """
         super(TAG_Compound, self).__init__()
         self.tags = []
         if name:
             self.name = name
         else:
             self.name = ""
+        if value is not None:
+            if isinstance(value, Mapping):
+                # keys of a mapping are unique; no need to look up each name
+                for key, tag in value.items():
+                    assert isinstance(tag, TAG), "value must be an nbt.TAG"
+                    tag.name = key
+                    self.tags.append(tag)
+            else:
+                self.tags.extend(value)
         if buffer:
             self._parse_buffer(buffer)
 
     # Parsers and Generators
     def _parse_buffer(self, buffer):
-        while True:
-            type = TAG_Byte(buffer=buffer)
-            if type.value == TAG_END:
-                # print("found tag_end")
-                break
-            else:
-                name = TAG_String(buffer=buffer).value
-                try:
-                    tag = TAGLIST[type.value]()
-                except KeyError:
-                    raise ValueError("Unrecognised tag type %d" % type.value)
-                tag.name = name
-                self.tags.append(tag)
-                tag._parse_buffer(buffer)
+        _enter(buffer)
+        try:
+            while True:
+                type = TAG_Byte(buffer=buffer)
+                if type.value == TAG_END:
+                    # print("found tag_end")
+                    break
+                else:
+                    name = TAG_String(buffer=buffer).value
+                    try:
+                        tag = TAGLIST[type.value]()
+                    except KeyError:
+                        raise ValueError("Unrecognised tag type %d"
+                                         % type.value)
+                    tag.name = name
+                    self.tags.append(tag)
+                    tag._parse_buffer(buffer)
+        finally:
+            _leave(buffer)
 
     def _render_buffer(self, buffer):
         for tag in self.tags:
@@ -571,6 +910,11 @@ class TAG_Compound(TAG, MutableMapping):
     def keys(self):
         return [tag.name for tag in self.tags]
 
+    def freeze(self):
+        return FrozenTAG(self.id, self.name,
+                         tuple([tag.freeze() for tag in self.tags]),
+                         cls=self.__class__)
+
     def iteritems(self):
         for tag in self.tags:
             yield (tag.name, tag)
@@ -586,12 +930,9 @@ class TAG_Compound(TAG, MutableMapping):
         return '{%i Entries}' % len(self.tags)
 
     def pretty_tree(self, indent=0):
-        output = [super(TAG_Compound, self).pretty_tree(indent)]
-        if len(self.tags):
-            output.append(("\t" * indent) + "{")
-            output.extend([tag.pretty_tree(indent + 1) for tag in self.tags])
-            output.append(("\t" * indent) + "}")
-        return '\n'.join(output)
+        output = _StringWriter()
+        pretty_print(self, output, indent=indent)
+        return output.getvalue()[:-1]  # without the final newline
 
 
 TAGLIST = {TAG_END: _TAG_End, TAG_BYTE: TAG_Byte, TAG_SHORT: TAG_Short,
@@ -602,10 +943,277 @@ TAGLIST = {TAG_END: _TAG_End, TAG_BYTE: TAG_Byte, TAG_SHORT: TAG_Short,
            TAG_LONG_ARRAY: TAG_Long_Array}
 
 
+def pretty_print(tree, file=None, max_depth=None, max_items=None, indent=0):
+    """
+    Write the tree in the same format as pretty_tree() to file (default:
+    sys.stdout), line by line, without building the text in memory.
+
+    Only max_depth levels below tree are written; deeper collections are
+    summarized on one line. Of each TAG_List and TAG_Compound, only the
+    first max_items children are written, followed by a line with the
+    number of omitted children. Arrays are always summarized.
+    """
+    if file is None:
+        file = sys.stdout
+    write = file.write
+    write(("\t" * indent) + tree.tag_info() + "\n")
+    if tree.id not in (TAG_LIST, TAG_COMPOUND) or not tree.tags or \
+            max_depth is not None and max_depth < 1:
+        return
+    write(("\t" * indent) + "{\n")
+    # Each stack entry is [children, index of next child, indent, depth].
+    stack = [[tree.tags, 0, indent + 1, 1]]
+    while stack:
+        frame = stack[-1]
+        tags, index, indent, depth = frame
+        limit = len(tags)
+        if max_items is not None and max_items < limit:
+            limit = max_items
+        if index >= limit:
+            if limit < len(tags):
+                write(("\t" * indent) + "... (%i more)\n"
+                      % (len(tags) - limit))
+            stack.pop()
+            write(("\t" * (indent - 1)) + "}\n")
+            continue
+        frame[1] = index + 1
+        tag = tags[index]
+        write(("\t" * indent) + tag.tag_info() + "\n")
+        if tag.id in (TAG_LIST, TAG_COMPOUND) and tag.tags and \
+                (max_depth is None or depth < max_depth):
+            write(("\t" * indent) + "{\n")
+            stack.append([tag.tags, 0, indent + 1, depth + 1])
+
+
+class _StringWriter(object):
+    """File-like object collecting strings written to it."""
+
+    def __init__(self):
+        self.parts = []
+        self.write = self.parts.append
+
+    def getvalue(self):
+        return "".join(self.parts)
+
+
+class FrozenTAG(object):
+    """
+    Immutable copy of a TAG and its children, created by TAG.freeze().
+
+    A FrozenTAG is hashable (the hash is computed once, when it is created)
+    and can be compared, used as a dict key and shared between threads and
+    between trees. The value is a number or string for value tags, bytes
+    for a TAG_Byte_Array, a tuple of integers for other array tags, and a
+    tuple of FrozenTAGs for a TAG_List or TAG_Compound.
+
+    Use thaw() to get a regular, mutable TAG tree, of the same classes as
+    the original tree. A frozen NBTFile also keeps its filename. The class
+    and filename are not compared: a frozen NBTFile equals a frozen
+    TAG_Compound with the same name and children.
+    """
+    __slots__ = ('id', 'name', 'value', 'tagID', 'cls', 'filename', '_hash')
+
+    def __init__(self, id, name, value, tagID=None, cls=None, filename=None):
+        object.__setattr__(self, 'id', id)
+        object.__setattr__(self, 'name', name)
+        object.__setattr__(self, 'value', value)
+        object.__setattr__(self, 'tagID', tagID)
+        object.__setattr__(self, 'cls', cls)
+        object.__setattr__(self, 'filename', filename)
+        # Children are FrozenTAGs, so their (cached) hash is reused.
+        object.__setattr__(self, '_hash', hash((id, name, tagID, value)))
+
+    def __setattr__(self, name, value):
+        raise AttributeError("FrozenTAG is immutable")
+
+    def __delattr__(self, name):
+        raise AttributeError("FrozenTAG is immutable")
+
+    def __reduce__(self):
+        return (FrozenTAG, (self.id, self.name, self.value, self.tagID,
+                            self.cls, self.filename))
+
+    def __hash__(self):
+        return self._hash
+
+    def __eq__(self, other):
+        if self is other:
+            return True
+        if not isinstance(other, FrozenTAG) or self._hash != other._hash:
+            return False
+        return self.id == other.id and self.name == other.name and \
+            self.tagID == other.tagID and self.value == other.value
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def __len__(self):
+        return len(self.value)
+
+    def __iter__(self):
+        return iter(self.value)
+
+    def __getitem__(self, key):
+        """Return the child with the given name (for a TAG_Compound), or
+        the element at the given index."""
+        if isinstance(key, basestring):
+            for tag in self.value:
+                if isinstance(tag, FrozenTAG) and tag.name == key:
+                    return tag
+            raise KeyError("Tag %s does not exist" % key)
+        return self.value[key]
+
+    def keys(self):
+        """Return the names of the children of a TAG_Compound."""
+        return [tag.name for tag in self.value]
+
+    def thaw(self):
+        """Return a mutable copy, consisting of regular TAG objects."""
+        tag = (self.cls or TAGLIST[self.id])()
+        tag.name = self.name
+        if self.filename is not None:
+            tag.filename = self.filename
+        if self.id == TAG_COMPOUND:
+            tag.tags = [child.thaw() for child in self.value]
+        elif self.id == TAG_LIST:
+            tag.tagID = self.tagID
+            tag.tags = [child.thaw() for child in self.value]
+        elif self.id == TAG_BYTE_ARRAY:
+            tag.value = bytearray(self.value)
+        elif self.id in (TAG_INT_ARRAY, TAG_LONG_ARRAY):
+            tag.value = list(self.value)
+        else:
+            tag.value = self.value
+        return tag
+
+    def __repr__(self):
+        return "<%s %s(%r) at 0x%x>" % (
+            self.__class__.__name__, TAGLIST[self.id].__name__, self.name,
+            id(self))
+
+
+def _python_tag(obj):
+    """Return the TAG class for a Python value, and the value to pass
+    to it, or raise a TypeError."""
+    if isinstance(obj, bool):
+        return TAG_Byte, int(obj)
+    elif isinstance(obj, (int, long)):
+        if -2**31 <= obj < 2**31:
+            return TAG_Int, obj
+        return TAG_Long, obj
+    elif isinstance(obj, float):
+        return TAG_Double, obj
+    elif isinstance(obj, basestring) and not (_PY3 and isinstance(obj, bytes)):
+        return TAG_String, obj
+    elif isinstance(obj, (bytes, bytearray, memoryview)):
+        return TAG_Byte_Array, obj
+    elif isinstance(obj, array):
+        if obj.typecode in 'fd':
+            return TAG_List, obj
+        return {1: TAG_Byte_Array, 2: TAG_List, 4: TAG_Int_Array,
+                8: TAG_Long_Array}[obj.itemsize], obj
+    elif _is_ndarray(obj):
+        kind, itemsize = obj.dtype.kind, obj.dtype.itemsize
+        if obj.ndim == 0:
+            if kind in 'iu':
+                cls = {1: TAG_Byte, 2: TAG_Short, 4: TAG_Int,
+                       8: TAG_Long}[itemsize]
+                return cls, int(obj)
+            elif kind == 'f':
+                return (TAG_Float if itemsize == 4 else TAG_Double), \
+                    float(obj)
+            elif kind == 'b':
+                return TAG_Byte, int(obj)
+        elif kind == 'b' or (kind in 'iu' and itemsize == 1):
+            return TAG_Byte_Array, obj.ravel()
+        elif kind in 'iu' and itemsize in (4, 8):
+            return (TAG_Int_Array if itemsize == 4 else TAG_Long_Array), \
+                obj.ravel()
+        return TAG_List, obj.ravel().tolist()
+    elif isinstance(obj, Mapping):
+        return TAG_Compound, obj
+    elif isinstance(obj, (list, tuple)):
+        return TAG_List, obj
+    raise TypeError("Can not convert %s to a TAG" % type(obj).__name__)
+
+
+def from_python(obj, schema=None, name=None):
+    """
+    Convert a Python value to a tree of TAG objects.
+
+    - dict and other mappings become a TAG_Compound,
+    - list and tuple become a TAG_List,
+    - bool becomes a TAG_Byte, int a TAG_Int (or TAG_Long if it does not
+      fit in 32 bits), float a TAG_Double and str a TAG_String,
+    - bytes, bytearray, array.array and NumPy arrays become a
+      TAG_Byte_Array, TAG_Int_Array or TAG_Long_Array, depending on the
+      item size. The data is converted in bulk, not element by element.
+    - TAG objects are used as-is, or as a shallow copy if they get another
+      name.
+
+    schema overrides the inferred types. It is either a TAG class
+    (e.g. TAG_Short or TAG_Long_Array), a dict with a schema per key of a
+    mapping, or a list with a single element: the schema of all elements
+    of a list. Keys missing in the schema are inferred.
+
+    For example, from_python({'xPos': 3, 'Sections': [{'Y': 0}]},
+    schema={'Sections': [{'Y': TAG_Byte}]}).
+
+    To write the result to a file, use :class:`nbt.stream.NBTWriter`, or
+    add its tags to an NBTFile.
+    """
+    if isinstance(obj, TAG):
+        if name is not None and name != obj.name:
+            # do not rename the caller's tag
+            obj = copy.copy(obj)
+            obj.name = name
+        return obj
+    if isinstance(schema, type) and issubclass(schema, TAG):
+        cls, subschema = schema, None
+    else:
+        cls, subschema = None, schema
+    if cls is None or cls in (TAG_List, TAG_Compound):
+        inferred, obj = _python_tag(obj)
+        cls = cls or inferred
+
+    if cls is TAG_Compound:
+        if not isinstance(obj, Mapping):
+            raise TypeError("Can not convert %s to a TAG_Compound"
+                            % type(obj).__name__)
+        if not isinstance(subschema, Mapping):
+            subschema = {}
+        tag = TAG_Compound(name=name)
+        tag.tags = [from_python(value, subschema.get(key), unicode(key))
+                    for key, value in obj.items()]
+    elif cls is TAG_List:
+        if isinstance(subschema, (list, tuple)) and subschema:
+            elementschema = subschema[0]
+        else:
+            elementschema = None
+        tags = [from_python(value, elementschema) for value in obj]
+        ids = set(t.id for t in tags)
+        if len(ids) > 1:
+            if ids <= set([TAG_BYTE, TAG_SHORT, TAG_INT, TAG_LONG]):
+                # integers of different size: use the widest type
+                widest = TAGLIST[max(ids)]
+                tags = [widest(t.value) for t in tags]
+            else:
+                raise TypeError("List elements have different types: %s" %
+                                ", ".join(sorted(TAGLIST[i].__name__
+                                                 for i in ids)))
+        tag = TAG_List(type=TAGLIST[tags[0].id] if tags else _TAG_End,
+                       value=tags, name=name)
+    elif cls in (TAG_Byte_Array, TAG_Int_Array, TAG_Long_Array):
+        tag = cls(name=name, value=obj)
+    else:
+        tag = cls(value=obj, name=name)
+    return tag
+
+
 class NBTFile(TAG_Compound):
     """Represent an NBT file object."""
 
-    def __init__(self, filename=None, buffer=None, fileobj=None):
+    def __init__(self, filename=None, buffer=None, fileobj=None, limits=None):
         """
         Create a new NBTFile object.
         Specify either a filename, file object or data buffer.
@@ -615,9 +1223,13 @@ class NBTFile(TAG_Compound):
         If filename is specified, the file is closed after reading and writing.
         If file object is specified, the caller is responsible for closing the
         file.
+
+        limits is a ParseLimits instance, checked while parsing. If not
+        specified, DEFAULT_LIMITS is used.
         """
         super(NBTFile, self).__init__()
         self.filename = filename
+        self.limits = limits if limits is not None else DEFAULT_LIMITS
         self.type = TAG_Byte(self.id)
         closefile = True
         # make a file object
@@ -664,10 +1276,11 @@ class NBTFile(TAG_Compound):
             self.file = GzipFile(fileobj=fileobj)
         if self.file:
             try:
-                type = TAG_Byte(buffer=self.file)
+                buffer = _LimitedReader(self.file, self.limits)
+                type = TAG_Byte(buffer=buffer)
                 if type.value == self.id:
-                    name = TAG_String(buffer=self.file).value
-                    self._parse_buffer(self.file)
+                    name = TAG_String(buffer=buffer).value
+                    self._parse_buffer(buffer)
                     self.name = name
                     if closefile:
                         self.file.close()
@@ -683,6 +1296,13 @@ class NBTFile(TAG_Compound):
                 "filename or a file object"
             )
 
+    def freeze(self):
+        """Return an immutable copy as a FrozenTAG, which keeps the
+        filename."""
+        return FrozenTAG(self.id, self.name,
+                         tuple([tag.freeze() for tag in self.tags]),
+                         cls=self.__class__, filename=self.filename)
+
     def write_file(self, filename=None, buffer=None, fileobj=None):
         """Write this NBT file to a file."""
         closefile = True
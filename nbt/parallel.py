@@ -0,0 +1,236 @@
+"""
+Parse NBT files with very large top-level lists in multiple processes.
+
+Structure and schematic files often hold one enormous TAG_List of compounds
+(blocks or entities). parse_parallel() first skips over the document to
+find the element boundaries of such lists, without decoding them. The
+elements are then split into ranges, the ranges are parsed in a process
+pool, and the results are put back together in order.
+
+The result is a regular NBTFile, identical to the result of NBTFile().
+
+The gain is limited, since the parsed elements are pickled back to the
+calling process, and unpickling TAG objects takes half or more of the time
+of parsing them. For a list of 100,000 compounds, a serial parse took 2.6 s
+and unpickling the parsed elements 1.3 s, so parse_parallel() was at most
+about 1.6 times as fast as NBTFile(), with any number of workers; on other
+machines the gain was smaller. With a single CPU, a process pool is only
+slower, so everything is parsed in the calling process.
+"""
+
+import os
+from io import BytesIO
+from gzip import GzipFile
+from struct import error as StructError
+from array import array
+from bisect import bisect_left
+
+from .nbt import NBTFile, TAG_END, TAG_COMPOUND, TAG_LIST, TAGLIST, \
+    MalformedFileError, DEFAULT_LIMITS, _LimitedReader, _INT64_TYPECODE
+from .arena import _BufferReader, _BYTE, _INT, _USHORT, _decode_string, \
+    _fixed_size, _skip
+
+try:
+    from concurrent.futures import ProcessPoolExecutor
+except ImportError:  # Python 2 without the futures backport
+    ProcessPoolExecutor = None
+
+import sys
+if sys.version_info < (3,):
+    range = xrange
+
+DEFAULT_MIN_SIZE = 1 << 20
+"""Top-level lists with a smaller payload (in bytes) are parsed serially."""
+
+RANGES_PER_WORKER = 4
+"""Number of ranges per worker process, to even out the work load."""
+
+
+def parse_parallel(filename=None, buffer=None, fileobj=None, workers=None,
+                   min_size=DEFAULT_MIN_SIZE, limits=None, executor=None):
+    """
+    Parse an NBT file, parsing the elements of large top-level lists in
+    parallel, and return an NBTFile.
+
+    filename, buffer and fileobj are interpreted as by NBTFile(): a file
+    name or file object refers to GZip-compressed data, a buffer to
+    uncompressed data. buffer may also be a bytes-like object.
+
+    workers is the number of worker processes (default and maximum: the
+    number of CPUs). Only lists of compounds, lists or other variable size elements
+    with a payload of at least min_size bytes are parsed in parallel; all
+    other tags are parsed in this process.
+
+    executor is an optional concurrent.futures.Executor, to reuse an
+    existing pool. Otherwise, a ProcessPoolExecutor is created and shut
+    down for each call. If concurrent.futures is unavailable, everything
+    is parsed serially.
+    """
+    limits = limits if limits is not None else DEFAULT_LIMITS
+    data = _read(filename, buffer, fileobj)
+    if limits.max_bytes is not None and len(data) > limits.max_bytes:
+        raise MalformedFileError(
+            "File size %d exceeds the maximum of %d bytes"
+            % (len(data), limits.max_bytes))
+    if executor is None:
+        # More processes than CPUs only add overhead; with one CPU, the
+        # lists are parsed serially.
+        workers = min(workers or _cpu_count(), _cpu_count())
+    elif workers is None:
+        workers = _cpu_count()
+    try:
+        return _parse(data, workers, min_size, limits, executor)
+    except StructError:
+        raise MalformedFileError(
+            "Partial File Parse: file possibly truncated.")
+
+
+def _read(filename, buffer, fileobj):
+    """Return the uncompressed data of the file."""
+    if filename:
+        f = GzipFile(filename, 'rb')
+        try:
+            return f.read()
+        finally:
+            f.close()
+    elif buffer is not None:
+        if hasattr(buffer, 'read'):
+            return buffer.read()
+        return bytes(buffer)
+    elif fileobj:
+        return GzipFile(fileobj=fileobj).read()
+    raise ValueError(
+        "parse_parallel(): Need to specify either a "
+        "filename, a buffer or a file object")
+
+
+def _cpu_count():
+    try:
+        return os.cpu_count() or 1
+    except AttributeError:  # Python 2
+        import multiprocessing
+        return multiprocessing.cpu_count()
+
+
+def _parse(data, workers, min_size, limits, executor):
+    if len(data) < 3:
+        raise MalformedFileError(
+            "Partial File Parse: file possibly truncated.")
+    if _BYTE.unpack_from(data, 0)[0] != TAG_COMPOUND:
+        raise MalformedFileError("First record is not a Compound Tag")
+    nbtfile = NBTFile(limits=limits)
+    nbtfile.name = _decode_string(data, 1)
+    offset = 3 + _USHORT.unpack_from(data, 1)[0]
+
+    # First pass: find the boundaries of the top-level tags, and of the
+    # elements of large lists. Large lists are filled in later.
+    pending = []  # [(list tag, element type, ranges)]
+    while True:
+        tagtype = _BYTE.unpack_from(data, offset)[0]
+        if tagtype == TAG_END:
+            offset += 1
+            break
+        if tagtype not in TAGLIST:
+            raise MalformedFileError("Unrecognised tag type %d" % tagtype)
+        name = _decode_string(data, offset + 1)
+        start = offset + 3 + _USHORT.unpack_from(data, offset + 1)[0]
+        ends = None
+        if tagtype == TAG_LIST and \
+                _fixed_size(_BYTE.unpack_from(data, start)[0]) is None:
+            # skip the elements once, and keep their boundaries
+            elementtype, ends = _scan_list(data, start, limits)
+            end = ends[-1] if ends else start + 5
+        else:
+            end = _skip(data, tagtype, start)
+        if ends and end - start >= min_size:
+            ranges = _split_ranges(start + 5, ends, workers)
+            tag = TAGLIST[TAG_LIST](type=TAGLIST[elementtype], name=name)
+            pending.append((tag, elementtype, ranges))
+        else:
+            reader = _LimitedReader(_BufferReader(data, start), limits,
+                                    end - start)
+            reader.enter()
+            tag = TAGLIST[tagtype](buffer=reader)
+            tag.name = name
+        nbtfile.tags.append(tag)
+        offset = end
+    if offset != len(data):
+        raise MalformedFileError("%d bytes of data after the root tag"
+                                 % (len(data) - offset))
+
+    if not pending:
+        return nbtfile
+    if executor is None and (ProcessPoolExecutor is None or workers < 2):
+        for tag, elementtype, ranges in pending:
+            for start, end, count in ranges:
+                tag.tags.extend(_parse_elements(data[start:end],
+                                                elementtype, count, limits))
+        return nbtfile
+
+    pool = executor or ProcessPoolExecutor(max_workers=workers)
+    try:
+        futures = [(tag, [pool.submit(_parse_elements, data[start:end],
+                                      elementtype, count, limits)
+                          for start, end, count in ranges])
+                   for tag, elementtype, ranges in pending]
+        for tag, results in futures:
+            for future in results:
+                tag.tags.extend(future.result())
+    finally:
+        if executor is None:
+            pool.shutdown()
+    return nbtfile
+
+
+def _scan_list(data, offset, limits):
+    """
+    Skip over the elements of the TAG_List with its payload at offset.
+    Return the element type and an array with the end offset of each
+    element.
+    """
+    elementtype = _BYTE.unpack_from(data, offset)[0]
+    count = _INT.unpack_from(data, offset + 1)[0]
+    if count < 0:
+        raise MalformedFileError("Invalid list length %d" % count)
+    if limits.max_length is not None and count > limits.max_length:
+        raise MalformedFileError(
+            "Length %d exceeds the maximum of %d elements"
+            % (count, limits.max_length))
+    offset += 5
+    ends = array(_INT64_TYPECODE)
+    for i in range(count):
+        offset = _skip(data, elementtype, offset)
+        ends.append(offset)
+    return elementtype, ends
+
+
+def _split_ranges(start, ends, workers):
+    """
+    Return a list of (start, end, element count) ranges of the list
+    elements from start with the given end offsets, of roughly equal size
+    in bytes.
+    """
+    target = (ends[-1] - start) // max(1, workers * RANGES_PER_WORKER) or 1
+    ranges = []
+    i = 0
+    while i < len(ends):
+        # every element takes at least one byte, so ends is increasing
+        j = min(bisect_left(ends, start + target, i), len(ends) - 1)
+        ranges.append((start, ends[j], j + 1 - i))
+        start = ends[j]
+        i = j + 1
+    return ranges
+
+
+def _parse_elements(data, elementtype, count, limits):
+    """Parse count list elements from data. Runs in a worker process."""
+    reader = _LimitedReader(BytesIO(data), limits)
+    # The elements are nested in the root compound and the list.
+    reader.enter()
+    reader.enter()
+    cls = TAGLIST[elementtype]
+    try:
+        return [cls(buffer=reader) for i in range(count)]
+    except StructError:
+        raise MalformedFileError(
+            "Partial File Parse: file possibly truncated.")
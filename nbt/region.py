@@ -5,17 +5,32 @@ For more information about the region file format:
 https://minecraft.wiki/w/Region_file_format
 """
 
-from .nbt import NBTFile, MalformedFileError
-from struct import pack, unpack
+from .nbt import NBTFile, MalformedFileError, TAG_COMPOUND, TAG_INT, TAG_INT_ARRAY
+from .mapped import MappedCursor, _replace
+from .compression import COMPRESSION_NONE, COMPRESSION_GZIP, COMPRESSION_ZLIB, \
+    COMPRESSION_UNCOMPRESSED, COMPRESSION_LZ4, COMPRESSION_CUSTOM, get_codec, compress
+
+try:
+    from concurrent.futures import ThreadPoolExecutor
+except ImportError:  # Python 2 without the futures backport
+    ThreadPoolExecutor = None
+from struct import Struct, pack, unpack, error as StructError
 try:
     from collections.abc import Mapping
 except ImportError:  # for Python 2.7
     from collections import Mapping
-import zlib
-import gzip
 from io import BytesIO
 import time
+import mmap
+import os
+import shutil
 from os import SEEK_END
+import threading
+from collections import deque, OrderedDict
+from itertools import islice
+from array import array
+from bisect import bisect_left, bisect_right
+from contextlib import contextmanager
 
 # constants
 
@@ -47,12 +62,30 @@ STATUS_CHUNK_OK = 0
 STATUS_CHUNK_NOT_CREATED = 1
 """Constant indicating an normal status: the chunk does not exist"""
 
-COMPRESSION_NONE = 0
-"""Constant indicating that the chunk is not compressed."""
-COMPRESSION_GZIP = 1
-"""Constant indicating that the chunk is GZip compressed."""
-COMPRESSION_ZLIB = 2
-"""Constant indicating that the chunk is zlib compressed."""
+# COMPRESSION_* constants are defined in nbt.compression, and imported above.
+
+PREFETCH_PER_WORKER = 4
+"""Number of chunks read ahead per worker thread in :meth:`RegionFile.iter_chunks`."""
+
+DEFAULT_COMMIT_COUNT = 64
+"""Default number of writes after which they are committed in durable mode."""
+
+COMPACT_OFFSET = "offset"
+"""Constant for :meth:`RegionFile.compact`: keep the order of the chunks in the file."""
+COMPACT_ZORDER = "zorder"
+"""Constant for :meth:`RegionFile.compact`: order the chunks along a Z-order curve."""
+
+_HEADER_ENTRIES = Struct(">1024I")
+"""The 1024 locations or timestamps in a header sector"""
+_CHUNK_HEADER = Struct(">IB")
+"""Length and compression type at the start of a chunk"""
+_COALESCE_GAP = 16
+"""Chunk headers at most this many sectors apart are read in one call"""
+_COALESCE_SPAN = 256
+"""Maximum number of sectors read in one call to read chunk headers"""
+_POSITION_TAGS = (("xPos", "zPos"), ("Level/xPos", "Level/zPos"))
+"""Paths of the chunk coordinates in chunk data (1.18 and later; older versions)"""
+_INT_TAG = Struct(">i")
 
 
 # TODO: reconsider these errors. where are they catched? Where would an implementation make a difference in handling the different exceptions.
@@ -107,9 +140,13 @@ class ChunkMetadata(object):
         self.compression = None
         """type of compression used for the chunk block. (8 bit int).
     
-        - 0: uncompressed
+        - 0: uncompressed (non-standard)
         - 1: gzip compression
-        - 2: zlib compression"""
+        - 2: zlib compression
+        - 3: uncompressed
+        - 4: LZ4 compression
+        
+        See :mod:`nbt.compression` for the codecs."""
         self.status = STATUS_CHUNK_NOT_CREATED
         """status as determined from blockstart, blocklength, length, file size
         and location of other chunks in the file.
@@ -166,6 +203,267 @@ class Location(object):
     def __str__(self):
         return "%s(x=%s, y=%s, z=%s)" % (self.__class__.__name__, self.x, self.y, self.z)
 
+def _zorder(x, z):
+    """Return the position of chunk x, z on the Z-order (Morton) curve."""
+    index = 0
+    for bit in range(5):
+        index |= ((x >> bit) & 1) << (2*bit) | ((z >> bit) & 1) << (2*bit + 1)
+    return index
+
+class FragmentationReport(object):
+    """Summary of the used and free sectors of a region file."""
+    def __init__(self, sectors=0, used_sectors=0, free_sectors=0, gaps=0, largest_gap=0):
+        self.sectors = sectors
+        """Size of the file in sectors, including the 2 header sectors"""
+        self.used_sectors = used_sectors
+        """Number of sectors occupied by chunks"""
+        self.free_sectors = free_sectors
+        """Number of sectors not occupied by chunks"""
+        self.gaps = gaps
+        """Number of runs of consecutive free sectors"""
+        self.largest_gap = largest_gap
+        """Number of sectors in the largest run of free sectors"""
+    def __str__(self):
+        return "%d sectors: %d used, %d free in %d gap(s), largest gap %d sector(s)" % \
+            (self.sectors, self.used_sectors, self.free_sectors, self.gaps, self.largest_gap)
+    def __repr__(self):
+        return "%s(sectors=%d, used_sectors=%d, free_sectors=%d, gaps=%d, largest_gap=%d)" % \
+            (self.__class__.__name__, self.sectors, self.used_sectors, self.free_sectors, \
+            self.gaps, self.largest_gap)
+
+def _move_chunk(data, dx, dz):
+    """
+    Return the decompressed data of a chunk, with the xPos and zPos tags (or
+    the Position of an entity chunk) increased by dx and dz. The data is
+    patched in place, without parsing it. Return None if the chunk has no
+    position, e.g. in a POI region file.
+    """
+    data = bytearray(data)
+    offsets = None
+    try:
+        if data[0] != TAG_COMPOUND:
+            raise MalformedFileError("First record is not a Compound Tag")
+        root = MappedCursor(data, TAG_COMPOUND, 3 + unpack(">H", bytes(data[1:3]))[0], 1)
+        for xpath, zpath in _POSITION_TAGS:
+            xpos = root.find(xpath)
+            zpos = root.find(zpath)
+            if xpos is not None and zpos is not None and \
+                    xpos.id == TAG_INT and zpos.id == TAG_INT:
+                offsets = (xpos.offset, zpos.offset)
+                break
+        else:
+            # entity chunks (1.17 and later) have an int array [x, z]
+            position = root.find("Position")
+            if position is not None and position.id == TAG_INT_ARRAY and \
+                    len(position) == 2:
+                offsets = (position.offset + 4, position.offset + 8)
+    except (MalformedFileError, StructError, IndexError) as e:
+        raise ChunkDataError('%s' % e)
+    if offsets is None:
+        return None
+    for offset, delta in zip(offsets, (dx, dz)):
+        _INT_TAG.pack_into(data, offset, _INT_TAG.unpack_from(data, offset)[0] + delta)
+    return bytes(data)
+
+class ChunkCache(object):
+    """
+    Least-recently-used cache of parsed chunks, with a budget in bytes.
+    The size of a chunk is counted as the length of its uncompressed NBT
+    data; the parsed objects take several times more memory.
+    Keys are (x, z, blockstart, timestamp).
+    """
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        """Maximum total size of the cached chunks"""
+        self.size = 0
+        """Total size of the cached chunks"""
+        self.hits = 0
+        """Number of lookups that found a chunk"""
+        self.misses = 0
+        """Number of lookups that found no chunk"""
+        self.evictions = 0
+        """Number of chunks removed to stay within max_bytes"""
+        # {key: (value, size)}, least recently used first
+        self._entries = OrderedDict()
+        # {(x, z): key}, the key of each cached chunk
+        self._keys = {}
+        self._lock = threading.Lock()
+    def get(self, key):
+        """Return the cached value for key, or None."""
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries[key] = entry
+            self.hits += 1
+            return entry[0]
+    def put(self, key, value, size):
+        """Add a value of the given size, evicting the least recently used values."""
+        with self._lock:
+            self._remove(key[:2])
+            if size > self.max_bytes:
+                return
+            self._entries[key] = (value, size)
+            self._keys[key[:2]] = key
+            self.size += size
+            while self.size > self.max_bytes:
+                oldest, (_, oldsize) = self._entries.popitem(last=False)
+                del self._keys[oldest[:2]]
+                self.size -= oldsize
+                self.evictions += 1
+    def invalidate(self, x, z):
+        """Remove the cached chunk x, z, if any."""
+        with self._lock:
+            self._remove((x, z))
+    def _remove(self, xz):
+        key = self._keys.pop(xz, None)
+        if key is not None:
+            self.size -= self._entries.pop(key)[1]
+    def clear(self):
+        """Remove all cached chunks. The counters are kept."""
+        with self._lock:
+            self._entries.clear()
+            self._keys.clear()
+            self.size = 0
+    def __len__(self):
+        return len(self._entries)
+    def __repr__(self):
+        return "<%s %d chunks, %d of %d bytes, %d hits, %d misses, %d evictions>" % \
+            (self.__class__.__name__, len(self._entries), self.size, self.max_bytes, \
+            self.hits, self.misses, self.evictions)
+
+class _SectorMap(object):
+    """
+    Usage of the sectors of a region file, updated as chunks are written and
+    removed. Keeps the number of chunks in each sector, and a sorted list of
+    the extents of free sectors. All sectors from :attr:`end` on are free.
+    """
+    def __init__(self):
+        self.usage = array('H', [1, 1]) # the header
+        """number of chunks occupying each sector, up to the last used sector"""
+        self.chunks = {}
+        """(start, stop) sectors occupied by each chunk, by (x, z)"""
+        self.reserved = []
+        """(start, stop) sectors of removed chunks, that are not free yet"""
+        self.starts = []
+        """sorted first sector of each free extent"""
+        self.lengths = {}
+        """number of sectors of each free extent, by first sector"""
+
+    @property
+    def end(self):
+        """Sector after the last used sector."""
+        return len(self.usage)
+
+    def add(self, xz, start, stop):
+        """Mark sectors start up to stop as used by chunk xz."""
+        self.chunks[xz] = (start, stop)
+        usage = self.usage
+        if stop > len(usage):
+            if start > len(usage):
+                self._free(len(usage), start)
+            usage.extend(array('H', [0]) * (stop - len(usage)))
+        self._take(start, stop)
+        for s in range(start, stop):
+            usage[s] += 1
+
+    def remove(self, xz):
+        """Mark the sectors used by chunk xz (if any) as no longer used by it."""
+        if xz in self.chunks:
+            self._remove(*self.chunks.pop(xz))
+
+    def reserve(self, xz):
+        """Keep the sectors used by chunk xz (if any) in use until release()."""
+        if xz in self.chunks:
+            self.reserved.append(self.chunks.pop(xz))
+
+    def release(self):
+        """Mark all reserved sectors as no longer used."""
+        for start, stop in self.reserved:
+            self._remove(start, stop)
+        self.reserved = []
+
+    def _remove(self, start, stop):
+        usage = self.usage
+        run = None
+        for s in range(start, stop):
+            usage[s] -= 1
+            if usage[s] == 0:
+                if run is None:
+                    run = s
+            elif run is not None:
+                self._free(run, s)
+                run = None
+        if run is not None:
+            self._free(run, stop)
+        if usage[-1] == 0:
+            # the last free extent is now at the end
+            end = self.starts.pop()
+            del self.lengths[end]
+            del usage[end:]
+
+    def _take(self, start, stop):
+        """Remove sectors start up to stop from the free extents."""
+        starts, lengths = self.starts, self.lengths
+        i = max(bisect_right(starts, start) - 1, 0)
+        while i < len(starts) and starts[i] < stop:
+            first = starts[i]
+            last = first + lengths[first]
+            if last <= start:
+                i += 1
+                continue
+            del starts[i]
+            del lengths[first]
+            if first < start:
+                starts.insert(i, first)
+                lengths[first] = start - first
+                i += 1
+            if last > stop:
+                starts.insert(i, stop)
+                lengths[stop] = last - stop
+                i += 1
+
+    def _free(self, start, stop):
+        """Add sectors start up to stop to the free extents, merging adjacent extents."""
+        starts, lengths = self.starts, self.lengths
+        i = bisect_left(starts, start)
+        if i > 0 and starts[i-1] + lengths[starts[i-1]] == start:
+            i -= 1
+            start = starts.pop(i)
+            del lengths[start]
+        if i < len(starts) and starts[i] == stop:
+            stop += lengths.pop(starts.pop(i))
+        starts.insert(i, start)
+        lengths[start] = stop - start
+
+    def is_free(self, start, count):
+        """Return True if count sectors from start on are free."""
+        if start < 2:
+            return False
+        if start >= self.end:
+            return True
+        i = bisect_right(self.starts, start) - 1
+        if i < 0:
+            return False
+        first = self.starts[i]
+        return start + count <= first + self.lengths[first]
+
+    def find(self, count):
+        """
+        Return the first sector of the smallest free extent of at least count
+        sectors (best fit), or the end if there is none.
+        """
+        best = None
+        bestlength = None
+        for start in self.starts:
+            length = self.lengths[start]
+            if length >= count and (best is None or length < bestlength):
+                best, bestlength = start, length
+                if length == count:
+                    break
+        return self.end if best is None else best
+
 class RegionFile(object):
     """A convenience class for extracting NBT files from the Minecraft Beta Region Format."""
     
@@ -193,20 +491,82 @@ class RegionFile(object):
     """Constant indicating an normal status: the chunk does not exist.
     Deprecated. Use :const:`nbt.region.STATUS_CHUNK_NOT_CREATED` instead."""
     
-    def __init__(self, filename=None, fileobj=None, chunkclass = None):
+    def __init__(self, filename=None, fileobj=None, chunkclass = None, limits=None, mapped=False,
+                 lazy=False, durable=False, commit_count=DEFAULT_COMMIT_COUNT, commit_interval=None,
+                 cache_size=None):
         """
         Read a region file by filename or file object. 
         If a fileobj is specified, it is not closed after use; it is the callers responibility to close it.
+        limits is a :class:`nbt.nbt.ParseLimits` instance, used when parsing chunks.
+
+        If mapped is True, the file is memory-mapped and opened read-only.
+        Chunks are then decompressed straight from the memory map, without
+        copying them first. This requires a real file (not e.g. a BytesIO).
+
+        If lazy is True, only the 8 kiByte header is read when the file is opened.
+        The check for overlapping chunks and the 5-byte chunk headers are read
+        when a chunk is read or written. Until then, the length, compression and
+        status in :attr:`metadata` are based on the header only. Call
+        :meth:`load_chunk_headers` to complete them for all chunks.
+
+        If durable is True, writes are committed in groups, as in a :meth:`batch`:
+        the header is written after commit_count writes, or at the first write
+        at least commit_interval seconds after the oldest uncommitted write
+        (either may be None), by :meth:`commit`, and by :meth:`close`.
+        The interval is only checked when a write is done: there is no timer,
+        so if writes stop, the last writes stay uncommitted until the next
+        write, :meth:`commit` or :meth:`close`.
+        The chunk data is stored on disk (fsync) before the header that points
+        to it, so after a crash the header refers either to the old or to the
+        new data of each chunk. Sectors freed by a write are not reused until
+        the next commit.
+
+        If cache_size is set, :meth:`get_nbt` keeps parsed chunks of up to
+        cache_size bytes (uncompressed) in a least-recently-used :attr:`cache`.
+        A chunk is removed from the cache when it is written or unlinked.
+        Cached NBTFile objects are shared between calls: copy a chunk before
+        modifying it.
         """
         self.file = None
         self.filename = None
         self._closefile = False
+        self._mmap = None
         self.closed = False
         """Set to true if `close()` was successfully called on that region"""
         self.chunkclass = chunkclass
+        self.limits = limits
+        """ParseLimits used when parsing chunks. None means nbt.nbt.DEFAULT_LIMITS."""
+        self.mapped = mapped
+        """True if the file is memory-mapped, and read-only."""
+        self.lazy = lazy
+        """True if chunk headers are only read when needed."""
+        # In lazy mode: the metadata of which the chunk header is not read yet,
+        # and if the check for overlapping chunks is still to be done.
+        # None and False if everything is read.
+        self._pending = None
+        self._overlaps_pending = False
+        # _SectorMap with the used and free sectors, built on the first write.
+        self._sectormap = None
+        self.durable = durable
+        """True if writes are committed in groups, with fsync."""
+        self.commit_count = commit_count
+        """In durable mode, the number of writes after which they are committed."""
+        self.commit_interval = commit_interval
+        """In durable mode, the age in seconds of the oldest uncommitted write
+        after which the next write commits."""
+        # In a batch or in durable mode: list of (blockstart, blocklength) of
+        # chunks freed since the last commit.
+        self._batch = [] if durable else None
+        self._uncommitted = 0
+        self._first_uncommitted = None
+        # Serialises seek() and read() of chunks by worker threads.
+        self._lock = threading.Lock()
+        self.cache = ChunkCache(cache_size) if cache_size else None
+        """:class:`ChunkCache` of parsed chunks, or None."""
         if filename:
             self.filename = filename
-            self.file = open(filename, 'r+b') # open for read and write in binary mode
+            # open for read (and write) in binary mode
+            self.file = open(filename, 'rb' if mapped else 'r+b')
             self._closefile = True
         elif fileobj:
             if hasattr(fileobj, 'name'):
@@ -214,6 +574,9 @@ class RegionFile(object):
             self.file = fileobj
         elif not self.file:
             raise ValueError("RegionFile(): Need to specify either a filename or a file object")
+        if mapped and self.get_size() > 0:
+            # An empty file can not be mapped, but has no chunks to read either.
+            self._mmap = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
 
         # Some variables
         self.metadata = {}
@@ -264,7 +627,10 @@ class RegionFile(object):
         
         self._init_header()
         self._parse_header()
-        self._parse_chunk_headers()
+        if lazy:
+            self._pending = set(self.metadata.values())
+        else:
+            self._parse_chunk_headers()
 
     def get_size(self):
         """ Returns the file size in bytes. """
@@ -289,6 +655,16 @@ class RegionFile(object):
         The method is automatically called by garbage collectors, but made public to
         allow explicit cleanup.
         """
+        if self.durable and not self.closed and self.file is not None:
+            self.commit()
+        if self._mmap is not None:
+            try:
+                self._mmap.close()
+            except BufferError:
+                # A memoryview returned by get_raw() is still in use. The
+                # map is closed when the memoryview is released.
+                pass
+            self._mmap = None
         if self._closefile:
             try:
                 self.file.close()
@@ -308,6 +684,7 @@ class RegionFile(object):
         self.file.seek(0)
         self.file.write(header_length*b'\x00')
         self.size = header_length
+        self._sectormap = None
 
     def _init_header(self):
         for x in range(32):
@@ -319,6 +696,7 @@ class RegionFile(object):
         # update the file size, needed when parse_header is called after
         # we have unlinked a chunk or writed a new one
         self.size = self.get_size()
+        self._sectormap = None
 
         if self.size == 0:
             # Some region files seems to have 0 bytes of size, and
@@ -328,16 +706,25 @@ class RegionFile(object):
         elif self.size < 2*SECTOR_LENGTH:
             raise NoRegionHeader('The region file is %d bytes, too small in size to have a header.' % self.size)
         
-        for index in range(0, SECTOR_LENGTH, 4):
-            x = int(index//4) % 32
-            z = int(index//4)//32
-            m = self.metadata[x, z]
-            
-            self.file.seek(index)
-            offset, length = unpack(">IB", b"\0" + self.file.read(4))
+        # Read both header sectors at once, and decode all locations and
+        # timestamps in one call each.
+        if self._mmap is not None:
+            header = self._mmap
+        else:
+            self.file.seek(0)
+            header = self.file.read(2*SECTOR_LENGTH)
+        locations = _HEADER_ENTRIES.unpack_from(header, 0)
+        timestamps = _HEADER_ENTRIES.unpack_from(header, SECTOR_LENGTH)
+        # Chunk headers from this sector on can not be read.
+        maxoffset = (self.size - 5) // SECTOR_LENGTH
+        
+        for index in range(1024):
+            m = self.metadata[index % 32, index // 32]
+            location = locations[index]
+            offset = location >> 8
+            length = location & 0xFF
             m.blockstart, m.blocklength = offset, length
-            self.file.seek(index + SECTOR_LENGTH)
-            m.timestamp = unpack(">I", self.file.read(4))[0]
+            m.timestamp = timestamps[index]
             
             if offset == 0 and length == 0:
                 m.status = STATUS_CHUNK_NOT_CREATED
@@ -345,13 +732,20 @@ class RegionFile(object):
                 m.status = STATUS_CHUNK_ZERO_LENGTH
             elif offset < 2 and offset != 0:
                 m.status = STATUS_CHUNK_IN_HEADER
-            elif SECTOR_LENGTH * offset + 5 > self.size:
+            elif offset > maxoffset:
                 # Chunk header can't be read.
                 m.status = STATUS_CHUNK_OUT_OF_FILE
             else:
                 m.status = STATUS_CHUNK_OK
         
-        # Check for chunks overlapping in the file
+        if self.lazy:
+            self._overlaps_pending = True
+        else:
+            self._check_overlaps()
+
+    def _check_overlaps(self):
+        """Set the status of chunks that overlap other chunks."""
+        self._overlaps_pending = False
         for chunks in self._sectors()[2:]:
             if len(chunks) > 1:
                 # overlapping chunks
@@ -361,24 +755,34 @@ class RegionFile(object):
                                         STATUS_CHUNK_OUT_OF_FILE):
                         m.status = STATUS_CHUNK_OVERLAPPING
 
-    def _parse_chunk_headers(self):
-        for x in range(32):
-            for z in range(32):
-                m = self.metadata[x, z]
-                if m.status not in (STATUS_CHUNK_OK, STATUS_CHUNK_OVERLAPPING, \
-                                    STATUS_CHUNK_MISMATCHED_LENGTHS):
-                    # skip to next if status is NOT_CREATED, OUT_OF_FILE, IN_HEADER,
-                    # ZERO_LENGTH or anything else.
-                    continue
+    def _parse_chunk_headers(self, chunks=None):
+        """Read the 5-byte chunk header of the given (default: all) chunks,
+        and update their status."""
+        if chunks is None:
+            chunks = self.metadata.values()
+        chunks = [m for m in chunks if m.status in \
+                  (STATUS_CHUNK_OK, STATUS_CHUNK_OVERLAPPING, STATUS_CHUNK_MISMATCHED_LENGTHS)]
+        # skip NOT_CREATED, OUT_OF_FILE, IN_HEADER, ZERO_LENGTH or anything else.
+        # Read the headers in file order, with one read for each run of
+        # chunks that are close together.
+        chunks.sort(key=lambda m: m.blockstart)
+        for run in self._coalesce(chunks):
+            start = run[0].blockstart*SECTOR_LENGTH # offset comes in sectors of 4096 bytes
+            if self._mmap is not None:
+                data, start = self._mmap, 0
+            else:
+                end = min(run[-1].blockstart*SECTOR_LENGTH + 5, self.size)
                 try:
-                    self.file.seek(m.blockstart*SECTOR_LENGTH) # offset comes in sectors of 4096 bytes
-                    length = unpack(">I", self.file.read(4))
-                    m.length = length[0] # unpack always returns a tuple, even unpacking one element
-                    compression = unpack(">B",self.file.read(1))
-                    m.compression = compression[0]
+                    self.file.seek(start)
+                    data = self.file.read(end - start)
                 except IOError:
+                    data = b""
+            for m in run:
+                position = m.blockstart*SECTOR_LENGTH - start
+                if position + 5 > len(data):
                     m.status = STATUS_CHUNK_OUT_OF_FILE
                     continue
+                m.length, m.compression = _CHUNK_HEADER.unpack_from(data, position)
                 if m.blockstart*SECTOR_LENGTH + m.length + 4 > self.size:
                     m.status = STATUS_CHUNK_OUT_OF_FILE
                 elif m.length <= 1: # chunk can't be zero length
@@ -387,6 +791,42 @@ class RegionFile(object):
                     # There are not enough sectors allocated for the whole block
                     m.status = STATUS_CHUNK_MISMATCHED_LENGTHS
 
+    def _load_chunk_header(self, m):
+        """In lazy mode, complete the metadata of a single chunk."""
+        if self._overlaps_pending:
+            self._check_overlaps()
+        if self._pending and m in self._pending:
+            self._pending.discard(m)
+            self._parse_chunk_headers([m])
+
+    def load_chunk_headers(self):
+        """
+        Check for overlapping chunks and read all chunk headers not read yet,
+        so all :attr:`metadata` is complete. This is only needed in lazy mode.
+        """
+        if self._overlaps_pending:
+            self._check_overlaps()
+        if self._pending:
+            self._parse_chunk_headers(self._pending)
+        self._pending = None
+
+    @staticmethod
+    def _coalesce(chunks):
+        """
+        Split a list of chunks, sorted by blockstart, in runs of chunks with
+        chunk headers that are at most _COALESCE_GAP sectors apart, and
+        together span at most _COALESCE_SPAN sectors.
+        """
+        run = []
+        for m in chunks:
+            if run and (m.blockstart - run[-1].blockstart > _COALESCE_GAP or
+                        m.blockstart - run[0].blockstart > _COALESCE_SPAN):
+                yield run
+                run = []
+            run.append(m)
+        if run:
+            yield run
+
     def _sectors(self, ignore_chunk=None):
         """
         Return a list of all sectors, each sector is a list of chunks occupying the block.
@@ -407,6 +847,41 @@ class RegionFile(object):
                     sectors[b].append(m)
         return sectors
 
+    def _get_sectormap(self):
+        """
+        Return the _SectorMap of this file. It is built from the metadata
+        when first needed, and then kept up to date by each write.
+        The sectors used by each chunk are the same as in :meth:`_sectors`.
+        """
+        if self._sectormap is None:
+            sectormap = _SectorMap()
+            sectorsize = self._bytes_to_sector(self.size)
+            for xz, m in self.metadata.items():
+                if not (m.is_created() and m.blocklength):
+                    continue
+                blockend = m.blockstart + max(m.blocklength, m.requiredblocks())
+                start, stop = max(m.blockstart, 2), min(blockend, sectorsize)
+                if start < stop:
+                    sectormap.add(xz, start, stop)
+            self._sectormap = sectormap
+        return self._sectormap
+
+    def _release_sectors(self, sectormap, blockstart, blocklength):
+        """
+        Truncate the file after the last used sector, and zero the sectors
+        from blockstart to blockstart + blocklength that are no longer used.
+        """
+        end = sectormap.end
+        if self.size > end*SECTOR_LENGTH:
+            self.size = end*SECTOR_LENGTH
+            self.file.truncate(self.size)
+        usage = sectormap.usage
+        for s in range(blockstart, min(blockstart + blocklength, end)):
+            if not usage[s]:
+                # zero sector s
+                self.file.seek(SECTOR_LENGTH*s)
+                self.file.write(SECTOR_LENGTH*b'\x00')
+
     def _locate_free_sectors(self, ignore_chunk=None):
         """Return a list of booleans, indicating the free sectors."""
         sectors = self._sectors(ignore_chunk=ignore_chunk)
@@ -472,32 +947,87 @@ class RegionFile(object):
                     chunks.append({'x': x, 'z': z, 'length': m.blocklength})
         return chunks
 
-    def iter_chunks(self):
+    def iter_chunks(self, workers=None):
         """
         Yield each readable chunk present in the region.
         Chunks that can not be read for whatever reason are silently skipped.
         Warning: this function returns a :class:`nbt.nbt.NBTFile` object, use ``Chunk(nbtfile)`` to get a
         :class:`nbt.chunk.Chunk` instance.
+
+        If workers is specified, a pool of this many threads reads and decompresses
+        the next chunks, while the current chunk is parsed and processed.
         """
-        for m in self.get_metadata():
+        if not workers:
+            for m in self.get_metadata():
+                try:
+                    yield self.get_chunk(m.x, m.z)
+                except RegionFileFormatError:
+                    pass
+            return
+        for m, data in self._prefetch_blockdata(workers):
             try:
-                yield self.get_chunk(m.x, m.z)
+                yield self._parse_nbt(m.x, m.z, data)
             except RegionFileFormatError:
                 pass
 
+    def _prefetch_blockdata(self, workers):
+        """
+        Yield the metadata and decompressed data of each readable chunk.
+        Up to PREFETCH_PER_WORKER chunks per worker are read and decompressed
+        ahead in a pool of worker threads; zlib releases the GIL while decompressing.
+        """
+        # The chunk headers are read once here, rather than by each worker.
+        self.load_chunk_headers()
+        chunks = iter(self.get_metadata())
+        if ThreadPoolExecutor is None:
+            for m in chunks:
+                data = self._try_blockdata(m)
+                if data is not None:
+                    yield m, data
+            return
+        pool = ThreadPoolExecutor(max_workers=workers)
+        pending = deque()
+        try:
+            for m in islice(chunks, workers * PREFETCH_PER_WORKER):
+                pending.append((m, pool.submit(self._try_blockdata, m)))
+            while pending:
+                m, future = pending.popleft()
+                # keep the pool busy: submit the next chunk, if any
+                n = next(chunks, None)
+                if n is not None:
+                    pending.append((n, pool.submit(self._try_blockdata, n)))
+                data = future.result()
+                if data is not None:
+                    yield m, data
+        finally:
+            # the consumer may stop early
+            for m, future in pending:
+                future.cancel()
+            pool.shutdown()
+
+    def _try_blockdata(self, m):
+        """Return the decompressed data of a chunk, or None if it can not be read."""
+        try:
+            return self.get_blockdata(m.x, m.z)
+        except RegionFileFormatError:
+            return None
+
     # The following method will replace 'iter_chunks'
     # but the previous is kept for the moment
     # until the users update their code
 
-    def iter_chunks_class(self):
+    def iter_chunks_class(self, workers=None):
         """
         Yield each readable chunk present in the region.
         Chunks that can not be read for whatever reason are silently skipped.
         This function returns a :class:`nbt.chunk.Chunk` instance.
+
+        If workers is specified, chunks are read and decompressed ahead in a
+        pool of threads, as in :meth:`iter_chunks`.
         """
-        for m in self.get_metadata():
+        for nbt in self.iter_chunks(workers):
             try:
-                yield self.chunkclass(self.get_chunk(m.x, m.z))
+                yield self.chunkclass(nbt)
             except RegionFileFormatError:
                 pass
 
@@ -520,17 +1050,13 @@ class RegionFile(object):
         """Return the number of defined chunks. This includes potentially corrupt chunks."""
         return len(self.get_metadata())
 
-    def get_blockdata(self, x, z):
+    def _check_chunk(self, x, z):
         """
-        Return the decompressed binary data representing a chunk.
-        
-        May raise a RegionFileFormatError().
-        If decompression of the data succeeds, all available data is returned, 
-        even if it is shorter than what is specified in the header (e.g. in case
-        of a truncated while and non-compressed data).
+        Return the metadata of chunk x, z, if it can be read.
+        Raise a RegionFileFormatError if it can not.
         """
-        # read metadata block
         m = self.metadata[x, z]
+        self._load_chunk_header(m)
         if m.status == STATUS_CHUNK_NOT_CREATED:
             raise InconceivedChunk("Chunk %d,%d is not present in region" % (x,z))
         elif m.status == STATUS_CHUNK_IN_HEADER:
@@ -545,6 +1071,49 @@ class RegionFile(object):
                 raise ChunkHeaderError('Chunk %d,%d has zero length' % (x,z))
         elif m.blockstart * SECTOR_LENGTH + 5 >= self.size:
             raise RegionHeaderError('Chunk %d,%d is partially/completely outside the file' % (x,z))
+        return m
+
+    def _read_raw(self, m):
+        """
+        Return the compressed data of a chunk: a memoryview of the memory
+        map in mapped mode, bytes otherwise.
+        """
+        # offset comes in sectors of 4096 bytes + length bytes + compression byte
+        start = m.blockstart * SECTOR_LENGTH + 5
+        # Do not read past the length of the file.
+        # The length in the file includes the compression byte, hence the -1.
+        length = min(m.length - 1, self.size - start)
+        if self._mmap is not None:
+            return memoryview(self._mmap)[start:start + length]
+        with self._lock:
+            self.file.seek(start)
+            return self.file.read(length)
+
+    def get_raw(self, x, z):
+        """
+        Return the compressed data of a chunk as a memoryview, without the
+        5-byte chunk header. The compression type is in
+        ``metadata[x, z].compression``.
+
+        In mapped mode, the memoryview refers directly to the memory map.
+        Release it (or let it go out of scope) before calling close().
+
+        May raise a RegionFileFormatError().
+        """
+        m = self._check_chunk(x, z)
+        return memoryview(self._read_raw(m))
+
+    def get_blockdata(self, x, z):
+        """
+        Return the decompressed binary data representing a chunk.
+        
+        May raise a RegionFileFormatError().
+        If decompression of the data succeeds, all available data is returned, 
+        even if it is shorter than what is specified in the header (e.g. in case
+        of a truncated while and non-compressed data).
+        """
+        # read metadata block
+        m = self._check_chunk(x, z)
 
         # status is STATUS_CHUNK_OK, STATUS_CHUNK_MISMATCHED_LENGTHS, STATUS_CHUNK_OVERLAPPING
         # or STATUS_CHUNK_OUT_OF_FILE.
@@ -552,31 +1121,25 @@ class RegionFile(object):
         # based on the status.
 
         err = None
+        chunk = raw = None
         try:
-            # offset comes in sectors of 4096 bytes + length bytes + compression byte
-            self.file.seek(m.blockstart * SECTOR_LENGTH + 5)
-            # Do not read past the length of the file.
-            # The length in the file includes the compression byte, hence the -1.
-            length = min(m.length - 1, self.size - (m.blockstart * SECTOR_LENGTH + 5))
-            chunk = self.file.read(length)
+            chunk = raw = self._read_raw(m)
             
-            if (m.compression == COMPRESSION_GZIP):
-                # Python 3.1 and earlier do not yet support gzip.decompress(chunk)
-                f = gzip.GzipFile(fileobj=BytesIO(chunk))
-                chunk = bytes(f.read())
-                f.close()
-            elif (m.compression == COMPRESSION_ZLIB):
-                chunk = zlib.decompress(chunk)
-            elif m.compression != COMPRESSION_NONE:
+            try:
+                codec = get_codec(m.compression)
+            except KeyError:
                 raise ChunkDataError('Unknown chunk compression/format (%s)' % m.compression)
-            
-            return chunk
+            return codec.decompress(chunk)
         except RegionFileFormatError:
             raise
         except Exception as e:
             # Deliberately catch the Exception and re-raise.
             # The details in gzip/zlib/nbt are irrelevant, just that the data is garbled.
             err = '%s' % e # avoid str(e) due to Unicode issues in Python 2.
+        finally:
+            if isinstance(raw, memoryview):
+                # release the memory map
+                raw.release()
         if err:
             # don't raise during exception handling to avoid the warning 
             # "During handling of the above exception, another exception occurred".
@@ -593,12 +1156,25 @@ class RegionFile(object):
         Return a NBTFile of the specified chunk.
         Raise InconceivedChunk if the chunk is not included in the file.
         """
-        # TODO: cache results?
-        data = self.get_blockdata(x, z) # This may raise a RegionFileFormatError.
+        cache = self.cache
+        m = self.metadata.get((x, z))
+        if cache is None or m is None:
+            data = self.get_blockdata(x, z) # This may raise a RegionFileFormatError.
+            return self._parse_nbt(x, z, data)
+        key = (x, z, m.blockstart, m.timestamp)
+        nbt = cache.get(key)
+        if nbt is None:
+            data = self.get_blockdata(x, z)
+            nbt = self._parse_nbt(x, z, data)
+            cache.put(key, nbt, len(data))
+        return nbt
+
+    def _parse_nbt(self, x, z, data):
+        """Return a NBTFile of the decompressed data of chunk x, z."""
         data = BytesIO(data)
         err = None
         try:
-            nbt = NBTFile(buffer=data)
+            nbt = NBTFile(buffer=data, limits=self.limits)
             if self.loc.x != None:
                 x += self.loc.x*32
             if self.loc.z != None:
@@ -621,40 +1197,106 @@ class RegionFile(object):
         """
         return self.get_nbt(x, z)
 
+    def _check_writable(self):
+        if self.mapped:
+            raise IOError("Can not write to a memory-mapped region file")
+        # the free sectors can only be determined with all chunk headers
+        self.load_chunk_headers()
+
     def write_blockdata(self, x, z, data, compression=COMPRESSION_ZLIB):
         """
         Compress the data, write it to file, and add pointers in the header so it 
         can be found as chunk(x,z).
+        compression is the compression byte of a codec in :mod:`nbt.compression`.
         """
-        if compression == COMPRESSION_GZIP:
-            # Python 3.1 and earlier do not yet support `data = gzip.compress(data)`.
-            compressed_file = BytesIO()
-            f = gzip.GzipFile(fileobj=compressed_file)
-            f.write(data)
-            f.close()
-            compressed_file.seek(0)
-            data = compressed_file.read()
-            del compressed_file
-        elif compression == COMPRESSION_ZLIB:
-            data = zlib.compress(data) # use zlib compression, rather than Gzip
-        elif compression != COMPRESSION_NONE:
-            raise ValueError("Unknown compression type %d" % compression)
-        length = len(data)
+        self._check_writable()
+        self._write_raw(x, z, compress(compression, data), compression)
+        self._written()
 
+    def _required_sectors(self, length):
+        """Return the number of sectors for a chunk of length compressed bytes."""
         # 5 extra bytes are required for the chunk block header
         nsectors = self._bytes_to_sector(length + 5)
 
         if nsectors >= 256:
             raise ChunkDataError("Chunk is too large (%d sectors exceeds 255 maximum)" % (nsectors))
+        return nsectors
 
+    def _allocate(self, x, z, nsectors):
+        """
+        Return the first sector of a free location for chunk x, z, and mark
+        it as used. The chunk is rewritten in place if it fits, except in
+        durable mode. Otherwise, in a batch, the current sectors of the chunk
+        stay in use until the batch is committed.
+        """
         # Ensure file has a header
         if self.size < 2*SECTOR_LENGTH:
             self._init_file()
 
         # search for a place where to write the chunk:
         current = self.metadata[x, z]
-        free_sectors = self._locate_free_sectors(ignore_chunk=current)
-        sector = self._find_free_location(free_sectors, nsectors, preferred=current.blockstart)
+        sectormap = self._get_sectormap()
+        if self._batch is None or not self.durable:
+            previous = sectormap.chunks.get((x, z))
+            sectormap.remove((x, z))
+            if current.blockstart and sectormap.is_free(current.blockstart, nsectors):
+                sectormap.add((x, z), current.blockstart, current.blockstart + nsectors)
+                return current.blockstart
+            if previous is not None and self._batch is not None:
+                sectormap.add((x, z), *previous)
+        if self._batch is not None:
+            sectormap.reserve((x, z))
+        sector = sectormap.find(nsectors)
+        sectormap.add((x, z), sector, sector + nsectors)
+        return sector
+
+    def _write_raw(self, x, z, data, compression, sector=None):
+        """
+        Write compressed data as chunk x, z, at the given sector or else at a
+        newly allocated location, and add pointers in the header.
+        """
+        length = len(data)
+        nsectors = self._required_sectors(length)
+        if sector is None:
+            sector = self._allocate(x, z, nsectors)
+        current = self.metadata[x, z]
+        if self.cache is not None:
+            self.cache.invalidate(x, z)
+        try:
+            self._write_sectors(sector, nsectors, data, compression)
+        except:
+            self._abort()
+            raise
+
+        timestamp = int(time.time())
+        if self._batch is None:
+            #seek to header record and write offset and length records
+            self.file.seek(4 * (x + 32*z))
+            self.file.write(pack(">IB", sector, nsectors)[1:])
+
+            #write timestamp
+            self.file.seek(SECTOR_LENGTH + 4 * (x + 32*z))
+            self.file.write(pack(">I", timestamp))
+
+            # Truncate the file and zero freed blocks.
+            self._release_sectors(self._sectormap, current.blockstart, current.blocklength)
+        else:
+            self._batch.append((current.blockstart, current.blocklength))
+        
+        # update file size and header information
+        self.size = max((sector + nsectors)*SECTOR_LENGTH, self.size)
+        if self._batch is None:
+            assert self.get_size() == self.size
+        current.blockstart = sector
+        current.blocklength = nsectors
+        current.status = STATUS_CHUNK_OK
+        current.timestamp = timestamp
+        current.length = length + 1
+        current.compression = compression
+
+    def _write_sectors(self, sector, nsectors, data, compression):
+        """Write the chunk header and compressed data, starting at sector."""
+        length = len(data)
 
         # If file is smaller than sector*SECTOR_LENGTH (it was truncated), pad it with zeroes.
         if self.size < sector*SECTOR_LENGTH:
@@ -673,89 +1315,359 @@ class RegionFile(object):
         remaining_length = SECTOR_LENGTH * nsectors - length - 5
         self.file.write(remaining_length * b"\x00")
 
-        #seek to header record and write offset and length records
-        self.file.seek(4 * (x + 32*z))
-        self.file.write(pack(">IB", sector, nsectors)[1:])
+    def write_chunk(self, x, z, nbt_file, compression=COMPRESSION_ZLIB):
+        """
+        Pack the NBT file as binary data, and write to file in a compressed format.
+        """
+        data = BytesIO()
+        nbt_file.write_file(buffer=data) # render to buffer; uncompressed
+        self.write_blockdata(x, z, data.getvalue(), compression)
 
-        #write timestamp
-        self.file.seek(SECTOR_LENGTH + 4 * (x + 32*z))
-        timestamp = int(time.time())
-        self.file.write(pack(">I", timestamp))
+    def write_chunks(self, chunks, compression=COMPRESSION_ZLIB):
+        """
+        Write multiple chunks in one batch. chunks is a dictionary
+        {(x, z): NBTFile}.
 
-        # Update free_sectors with newly written block
-        # This is required for calculating file truncation and zeroing freed blocks.
-        free_sectors.extend((sector + nsectors - len(free_sectors)) * [True])
-        for s in range(sector, sector + nsectors):
-            free_sectors[s] = False
-        
-        # Check if file should be truncated:
-        truncate_count = list(reversed(free_sectors)).index(False)
-        if truncate_count > 0:
-            self.size = SECTOR_LENGTH * (len(free_sectors) - truncate_count)
-            self.file.truncate(self.size)
-            free_sectors = free_sectors[:-truncate_count]
-        
-        # Calculate freed sectors
-        for s in range(current.blockstart, min(current.blockstart + current.blocklength, len(free_sectors))):
-            if free_sectors[s]:
-                # zero sector s
-                self.file.seek(SECTOR_LENGTH*s)
-                self.file.write(SECTOR_LENGTH*b'\x00')
-        
-        # update file size and header information
-        self.size = max((sector + nsectors)*SECTOR_LENGTH, self.size)
-        assert self.get_size() == self.size
-        current.blockstart = sector
-        current.blocklength = nsectors
-        current.status = STATUS_CHUNK_OK
-        current.timestamp = timestamp
-        current.length = length + 1
-        current.compression = COMPRESSION_ZLIB
+        All chunks are compressed first. Then a location is planned for each
+        chunk (largest chunks first), and the chunks are written in file order.
+        The header is written once, at the end.
+        """
+        self._check_writable()
+        blocks = []
+        for (x, z), nbt_file in chunks.items():
+            data = BytesIO()
+            nbt_file.write_file(buffer=data) # render to buffer; uncompressed
+            data = compress(compression, data.getvalue())
+            blocks.append((self._required_sectors(len(data)), x, z, data))
+        with self.batch():
+            blocks.sort(key=lambda block: -block[0])
+            planned = sorted((self._allocate(x, z, nsectors), x, z, data)
+                             for nsectors, x, z, data in blocks)
+            for sector, x, z, data in planned:
+                self._write_raw(x, z, data, compression, sector)
+        self._written(len(planned))
+
+    def copy_chunk_to(self, dst, x, z, dst_x=None, dst_z=None):
+        """
+        Copy chunk x, z to chunk dst_x, dst_z (by default x, z) of RegionFile
+        dst, which may be this region file.
 
-        # self.parse_header()
-        # self.parse_chunk_headers()
+        The compressed data and compression type are copied as they are. Only
+        if the chunk moves in the world (the chunk coordinates or the
+        :attr:`loc` of the regions differ), the data is decompressed to update
+        xPos and zPos (or Position in entity chunks), and compressed again with
+        the same compression type. Chunks without a position (e.g. in POI
+        region files) are copied as they are.
 
-    def write_chunk(self, x, z, nbt_file):
+        May raise a RegionFileFormatError.
         """
-        Pack the NBT file as binary data, and write to file in a compressed format.
+        dst._check_writable()
+        data, compression = self._copy_data(dst, x, z, dst_x, dst_z)
+        try:
+            dst._write_raw(dst_x if dst_x is not None else x,
+                           dst_z if dst_z is not None else z, data, compression)
+        finally:
+            if isinstance(data, memoryview):
+                data.release()
+        dst._written()
+
+    def copy_chunks_to(self, dst, chunks=None):
         """
-        data = BytesIO()
-        nbt_file.write_file(buffer=data) # render to buffer; uncompressed
-        self.write_blockdata(x, z, data.getvalue())
+        Copy multiple chunks to RegionFile dst in one batch, as in
+        :meth:`copy_chunk_to`. chunks is a dictionary {(x, z): (dst_x, dst_z)},
+        or a sequence of (x, z) to copy to the same coordinates. By default,
+        all chunks with status STATUS_CHUNK_OK are copied; chunks with an
+        error status (e.g. overlapping chunks) are left out, as in
+        :meth:`compact`.
+
+        Chunks are read in file order, and written as in :meth:`write_chunks`.
+        Return the number of copied chunks.
+        """
+        dst._check_writable()
+        if chunks is None:
+            chunks = [(m.x, m.z) for m in self.get_metadata()
+                      if m.status == self.STATUS_CHUNK_OK]
+        if not isinstance(chunks, Mapping):
+            chunks = dict((xz, xz) for xz in chunks)
+        blocks = []
+        try:
+            for x, z in sorted(chunks, key=lambda xz: self.metadata[xz].blockstart):
+                dst_x, dst_z = chunks[x, z]
+                data, compression = self._copy_data(dst, x, z, dst_x, dst_z)
+                blocks.append((dst._required_sectors(len(data)), dst_x, dst_z, data, compression))
+            with dst.batch():
+                blocks.sort(key=lambda block: -block[0])
+                planned = sorted((dst._allocate(x, z, nsectors), x, z, data, compression)
+                                 for nsectors, x, z, data, compression in blocks)
+                for sector, x, z, data, compression in planned:
+                    dst._write_raw(x, z, data, compression, sector)
+        finally:
+            for block in blocks:
+                if isinstance(block[3], memoryview):
+                    block[3].release()
+        dst._written(len(blocks))
+        return len(blocks)
+
+    def _copy_data(self, dst, x, z, dst_x, dst_z):
+        """
+        Return the compressed data and compression type of chunk x, z for
+        chunk dst_x, dst_z of dst.
+        """
+        m = self._check_chunk(x, z)
+        dx = (x if dst_x is None else dst_x) - x
+        dz = (z if dst_z is None else dst_z) - z
+        # If the location of either region is unknown, only the position
+        # within the region is compared.
+        if self.loc.x is not None and dst.loc.x is not None:
+            dx += 32*(dst.loc.x - self.loc.x)
+        if self.loc.z is not None and dst.loc.z is not None:
+            dz += 32*(dst.loc.z - self.loc.z)
+        if dx == 0 and dz == 0:
+            return self._read_raw(m), m.compression
+        data = _move_chunk(self.get_blockdata(x, z), dx, dz)
+        if data is None:
+            # no position to update
+            return self._read_raw(m), m.compression
+        return compress(m.compression, data), m.compression
+
+    @contextmanager
+    def batch(self):
+        """
+        Context manager to write or unlink multiple chunks, with the header
+        written only once::
+
+            with region.batch():
+                for (x, z), nbt_file in chunks:
+                    region.write_chunk(x, z, nbt_file)
+
+        Within the batch, a chunk is rewritten in place if it fits (except in
+        durable mode), and otherwise written to free sectors; sectors that
+        are freed are reused after the batch. At the end, the 8 kiByte
+        header is written, the file is truncated and freed sectors are zeroed.
+        This also happens if the block raises an exception, so the chunks
+        written until then are kept.
+        """
+        if self._batch is not None:
+            # nested batch (or durable mode): commit with the outer one
+            yield self
+            return
+        self._check_writable()
+        self._batch = []
+        try:
+            yield self
+        finally:
+            try:
+                self._commit()
+            finally:
+                self._batch = None
+
+    def commit(self):
+        """
+        Write the header for all chunks written since the last commit, and
+        wait until the chunks and the header are stored on disk (fsync).
+
+        In durable mode, this is done automatically after commit_count writes,
+        at the first write after commit_interval seconds, and when the file is
+        closed. Call it to commit writes after a period without writes.
+        """
+        self._commit(sync=True)
+
+    def _written(self, count=1):
+        """In durable mode, commit if enough writes are pending, or the oldest is old enough."""
+        if not self.durable:
+            return
+        if self._uncommitted == 0:
+            self._first_uncommitted = time.time()
+        self._uncommitted += count
+        if (self.commit_count is not None and self._uncommitted >= self.commit_count) or \
+                (self.commit_interval is not None and \
+                time.time() - self._first_uncommitted >= self.commit_interval):
+            self._commit(sync=True)
+
+    def _sync(self):
+        """Flush the file and wait until it is stored on disk."""
+        self.file.flush()
+        try:
+            fileno = self.file.fileno()
+        except (AttributeError, IOError, ValueError):
+            # not a real file, e.g. a BytesIO
+            return
+        os.fsync(fileno)
+
+    def _commit(self, sync=False):
+        """
+        Write the header and release the sectors freed in a batch.
+        With sync, the chunk data is stored on disk before the header which
+        points to it, and the header before sectors are reused.
+        """
+        freed = self._batch
+        if freed is not None:
+            self._batch = []
+        self._uncommitted = 0
+        if not freed:
+            if sync and freed is None:
+                self._sync()
+            return
+        locations = [0] * 1024
+        timestamps = [0] * 1024
+        for (x, z), m in self.metadata.items():
+            locations[x + 32*z] = (m.blockstart << 8) | m.blocklength
+            timestamps[x + 32*z] = m.timestamp
+        if sync:
+            self._sync()
+        self.file.seek(0)
+        self.file.write(_HEADER_ENTRIES.pack(*locations) + _HEADER_ENTRIES.pack(*timestamps))
+        if sync:
+            self._sync()
+        sectormap = self._get_sectormap()
+        sectormap.release()
+        for blockstart, blocklength in freed:
+            self._release_sectors(sectormap, blockstart, blocklength)
+
+    def _abort(self):
+        """
+        Recover from a failed write: sectors may be allocated to chunks that
+        were not written. Rebuild the sector map from the metadata, and commit
+        the chunks that were written.
+        """
+        self._sectormap = None
+        self._commit(sync=self.durable)
 
     def unlink_chunk(self, x, z):
         """
         Remove a chunk from the header of the region file.
         Fragmentation is not a problem, chunks are written to free sectors when possible.
         """
+        self._check_writable()
         # This function fails for an empty file. If that is the case, just return.
         if self.size < 2*SECTOR_LENGTH:
             return
 
-        # zero the region header for the chunk (offset length and time)
-        self.file.seek(4 * (x + 32*z))
-        self.file.write(pack(">IB", 0, 0)[1:])
-        self.file.seek(SECTOR_LENGTH + 4 * (x + 32*z))
-        self.file.write(pack(">I", 0))
-
-        # Check if file should be truncated:
         current = self.metadata[x, z]
-        free_sectors = self._locate_free_sectors(ignore_chunk=current)
-        truncate_count = list(reversed(free_sectors)).index(False)
-        if truncate_count > 0:
-            self.size = SECTOR_LENGTH * (len(free_sectors) - truncate_count)
-            self.file.truncate(self.size)
-            free_sectors = free_sectors[:-truncate_count]
-        
-        # Calculate freed sectors
-        for s in range(current.blockstart, min(current.blockstart + current.blocklength, len(free_sectors))):
-            if free_sectors[s]:
-                # zero sector s
-                self.file.seek(SECTOR_LENGTH*s)
-                self.file.write(SECTOR_LENGTH*b'\x00')
+        if self.cache is not None:
+            self.cache.invalidate(x, z)
+        sectormap = self._get_sectormap()
+        if self._batch is not None:
+            sectormap.reserve((x, z))
+            self._batch.append((current.blockstart, current.blocklength))
+        else:
+            # zero the region header for the chunk (offset length and time)
+            self.file.seek(4 * (x + 32*z))
+            self.file.write(pack(">IB", 0, 0)[1:])
+            self.file.seek(SECTOR_LENGTH + 4 * (x + 32*z))
+            self.file.write(pack(">I", 0))
+
+            # Truncate the file and zero freed blocks.
+            sectormap.remove((x, z))
+            self._release_sectors(sectormap, current.blockstart, current.blocklength)
 
         # update the header
         self.metadata[x, z] = ChunkMetadata(x, z)
+        self._written()
+
+    def fragmentation(self):
+        """Return a :class:`FragmentationReport` of the sectors in the file."""
+        self.load_chunk_headers()
+        if self.size < 2*SECTOR_LENGTH:
+            return FragmentationReport()
+        sectormap = self._get_sectormap()
+        gaps = [sectormap.lengths[start] for start in sectormap.starts]
+        # free sectors after the last used sector, until the end of the file
+        tail = self._bytes_to_sector(self.size) - sectormap.end
+        if tail > 0:
+            gaps.append(tail)
+        sectors = max(self._bytes_to_sector(self.size), sectormap.end)
+        return FragmentationReport(sectors, sectors - 2 - sum(gaps), sum(gaps),
+                                   len(gaps), max(gaps) if gaps else 0)
+
+    def compact(self, order=COMPACT_OFFSET):
+        """
+        Rewrite the region file with all chunks in one contiguous block,
+        without free sectors between the chunks.
+
+        The chunks are copied without decompressing them, one at a time, to a
+        temporary file next to the region file, which then replaces the region
+        file. Only chunks with status STATUS_CHUNK_OK are copied; chunks with
+        an error status (e.g. because they are outside the file, overlap with
+        another chunk or have a mismatched length) are left out. Timestamps are
+        kept.
+
+        order is COMPACT_OFFSET (keep the current order of the chunks in the
+        file) or COMPACT_ZORDER (sort chunks by the Z-order curve of their
+        coordinates, so nearby chunks are close in the file).
+
+        Return a tuple of :class:`FragmentationReport` before and after.
+        This requires a region file that was opened by filename.
+        """
+        self._check_writable()
+        if not self._closefile:
+            raise IOError("Can only compact a region file opened by filename")
+        if self.durable:
+            self.commit()
+        elif self._batch is not None:
+            raise IOError("Can not compact a region file during a batch")
+        before = self.fragmentation()
+        chunks = []
+        for m in self.get_metadata():
+            try:
+                self._check_chunk(m.x, m.z)
+            except RegionFileFormatError:
+                continue
+            # The sector count must fit in the single byte of the location.
+            if m.status == STATUS_CHUNK_OK and m.requiredblocks() <= 255:
+                chunks.append(m)
+        if order == COMPACT_ZORDER:
+            chunks.sort(key=lambda m: _zorder(m.x, m.z))
+        elif order == COMPACT_OFFSET:
+            chunks.sort(key=lambda m: m.blockstart)
+        else:
+            raise ValueError("Unknown compaction order %r" % (order,))
+
+        tempname = self.filename + ".tmp"
+        locations = [0] * 1024
+        timestamps = [0] * 1024
+        try:
+            with open(tempname, 'w+b') as f:
+                f.write(2*SECTOR_LENGTH*b'\x00')
+                sector = 2
+                for m in chunks:
+                    data = self._read_raw(m)
+                    nsectors = self._required_sectors(len(data))
+                    f.write(_CHUNK_HEADER.pack(len(data) + 1, m.compression))
+                    f.write(data)
+                    f.write((nsectors*SECTOR_LENGTH - len(data) - 5) * b'\x00')
+                    locations[m.x + 32*m.z] = (sector << 8) | nsectors
+                    timestamps[m.x + 32*m.z] = m.timestamp
+                    sector += nsectors
+                f.seek(0)
+                f.write(_HEADER_ENTRIES.pack(*locations) + _HEADER_ENTRIES.pack(*timestamps))
+                f.flush()
+                os.fsync(f.fileno())
+            try:
+                shutil.copymode(self.filename, tempname)
+            except OSError:
+                pass
+        except:
+            if os.path.exists(tempname):
+                os.remove(tempname)
+            raise
+
+        self.file.close()
+        try:
+            _replace(tempname, self.filename)
+        finally:
+            if os.path.exists(tempname):
+                # the region file was not replaced
+                os.remove(tempname)
+            self.file = open(self.filename, 'r+b')
+            self._init_header()
+            self._parse_header()
+            self._pending = None
+            self._parse_chunk_headers()
+            if self.cache is not None:
+                # the chunks moved, so their keys changed
+                self.cache.clear()
+        return before, self.fragmentation()
 
     def _classname(self):
         """Return the fully qualified class name."""
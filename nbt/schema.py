@@ -0,0 +1,259 @@
+"""
+Infer which paths and types occur in a set of NBT documents.
+
+A SchemaProfile scans uncompressed NBT data without creating TAG objects,
+and counts for each path and tag type how often it occurs and how many
+bytes it takes (including the tag header, and for collections including
+all children). Paths are names separated by slashes; the elements of a
+list are named "[]", so "Level/Entities[]/id" is the id of any entity.
+
+Profiles of different documents or files can be merged, so a large set
+of files can be profiled in parallel by separate workers::
+
+    profile = profile_files(glob.glob("world/region/*.mca"))
+    for path, tagtype, count, size in profile.report():
+        print(path, TAGLIST[tagtype].__name__, count, size)
+"""
+
+from gzip import GzipFile
+from io import BytesIO
+from struct import error as StructError
+
+from .nbt import TAG_END, TAG_STRING, TAG_LIST, TAG_COMPOUND, TAGLIST, \
+    MalformedFileError, DEFAULT_LIMITS
+from .arena import _BYTE, _INT, _USHORT, _ITEMSIZES, _SCALARS, \
+    _fixed_size, _skip
+from .region import RegionFile, RegionFileFormatError
+
+try:
+    from concurrent.futures import ProcessPoolExecutor
+except ImportError:  # Python 2 without the futures backport
+    ProcessPoolExecutor = None
+
+REGION_EXTENSIONS = ('.mca', '.mcr')
+"""File name extensions of region files, for profile_files()"""
+
+
+class SchemaProfile(object):
+    """
+    Counts of the paths and tag types in a set of NBT documents.
+    """
+
+    def __init__(self, limits=None):
+        self.limits = limits if limits is not None else DEFAULT_LIMITS
+        self.paths = {}
+        """Dictionary of [count, total bytes] by (path, tag type)"""
+        self.documents = 0
+        """Number of documents added"""
+        self.errors = 0
+        """Number of documents or chunks that could not be read"""
+
+    def add(self, data):
+        """Add one uncompressed NBT document (a bytes-like object)."""
+        try:
+            self._add(data)
+        except StructError:
+            raise MalformedFileError(
+                "Partial File Parse: file possibly truncated.")
+        except UnicodeDecodeError as e:
+            raise MalformedFileError("Invalid UTF-8 in tag name: %s" % e)
+        self.documents += 1
+
+    def _add(self, data):
+        if len(data) < 3 or _BYTE.unpack_from(data, 0)[0] != TAG_COMPOUND:
+            raise MalformedFileError("First record is not a Compound Tag")
+        max_depth = self.limits.max_depth
+        # Collect the counts of this document separately, so a malformed
+        # document does not leave partial counts behind.
+        paths = {}
+        names = {}  # decoded names, by raw name
+        offset = 3 + _USHORT.unpack_from(data, 1)[0]
+        # Each stack entry is [element type, remaining elements, path,
+        # offset of the tag header, tag type]. The element type is None
+        # for compounds.
+        stack = [[None, 0, "", 0, TAG_COMPOUND]]
+        while stack:
+            frame = stack[-1]
+            start = offset
+            if frame[0] is None:
+                tagtype = _BYTE.unpack_from(data, offset)[0]
+                offset += 1
+                if tagtype == TAG_END:
+                    stack.pop()
+                    if stack:
+                        _count(paths, frame[2], TAG_COMPOUND, 1,
+                               offset - frame[3])
+                    continue
+                size = _USHORT.unpack_from(data, offset)[0]
+                raw = bytes(data[offset + 2:offset + 2 + size])
+                offset += 2 + size
+                name = names.get(raw)
+                if name is None:
+                    name = names[raw] = raw.decode("utf-8")
+                path = frame[2] + "/" + name if frame[2] else name
+            else:
+                if frame[1] == 0:
+                    stack.pop()
+                    _count(paths, frame[2], TAG_LIST, 1, offset - frame[3])
+                    continue
+                frame[1] -= 1
+                tagtype = frame[0]
+                path = frame[2] + "[]"
+
+            if tagtype == TAG_COMPOUND:
+                if max_depth is not None and len(stack) >= max_depth:
+                    raise MalformedFileError(
+                        "Nesting depth exceeds the maximum of %d" % max_depth)
+                stack.append([None, 0, path, start, TAG_COMPOUND])
+            elif tagtype == TAG_LIST:
+                elementtype = _BYTE.unpack_from(data, offset)[0]
+                count = _INT.unpack_from(data, offset + 1)[0]
+                if count < 0:
+                    raise MalformedFileError("Invalid list length %d" % count)
+                offset += 5
+                size = _fixed_size(elementtype)
+                if size is not None:
+                    # count all elements at once
+                    offset += count * size
+                    if offset > len(data):
+                        raise MalformedFileError(
+                            "Partial File Parse: file possibly truncated.")
+                    if count:
+                        _count(paths, path + "[]", elementtype, count,
+                               count * size)
+                    _count(paths, path, TAG_LIST, 1, offset - start)
+                else:
+                    if max_depth is not None and len(stack) >= max_depth:
+                        raise MalformedFileError(
+                            "Nesting depth exceeds the maximum of %d"
+                            % max_depth)
+                    stack.append([elementtype, count, path, start, TAG_LIST])
+            elif tagtype in _SCALARS or tagtype in _ITEMSIZES or \
+                    tagtype == TAG_STRING:
+                offset = _skip(data, tagtype, offset)
+                _count(paths, path, tagtype, 1, offset - start)
+            else:
+                raise MalformedFileError("Unrecognised tag type %d" % tagtype)
+        self.merge_counts(paths)
+
+    def add_file(self, filename):
+        """Add an NBT file, which may be GZip-compressed or uncompressed."""
+        with open(filename, 'rb') as f:
+            data = f.read()
+        if data[:2] == b"\x1f\x8b":
+            data = GzipFile(fileobj=BytesIO(data)).read()
+        self.add(data)
+
+    def add_region(self, region):
+        """
+        Add all chunks of a RegionFile. Chunks that can not be read are
+        counted in errors.
+        """
+        for m in region.get_metadata():
+            try:
+                self.add(region.get_blockdata(m.x, m.z))
+            except (RegionFileFormatError, MalformedFileError):
+                self.errors += 1
+
+    def merge(self, other):
+        """Add the counts of another SchemaProfile to this one."""
+        self.merge_counts(other.paths)
+        self.documents += other.documents
+        self.errors += other.errors
+        return self
+
+    def merge_counts(self, paths):
+        """Add a dictionary of [count, total bytes] by (path, tag type)."""
+        own = self.paths
+        for key, (count, size) in paths.items():
+            entry = own.get(key)
+            if entry is None:
+                own[key] = [count, size]
+            else:
+                entry[0] += count
+                entry[1] += size
+
+    def report(self):
+        """Return a sorted list of (path, tag type, count, total bytes)."""
+        return sorted((path, tagtype, count, size) for (path, tagtype),
+                      (count, size) in self.paths.items())
+
+    def to_dict(self):
+        """
+        Return a dictionary {path: {type name: {"count": count, "bytes":
+        total bytes}}}, e.g. to store as JSON.
+        """
+        result = {}
+        for path, tagtype, count, size in self.report():
+            types = result.setdefault(path, {})
+            types[TAGLIST[tagtype].__name__] = {"count": count, "bytes": size}
+        return result
+
+    def __len__(self):
+        """Return the number of distinct (path, tag type) combinations."""
+        return len(self.paths)
+
+    def __str__(self):
+        lines = ["%d document(s), %d error(s)" % (self.documents, self.errors)]
+        for path, tagtype, count, size in self.report():
+            lines.append("%-50s %-15s %10d %12d" % (
+                path, TAGLIST[tagtype].__name__, count, size))
+        return "\n".join(lines)
+
+    def __repr__(self):
+        return "<%s with %d paths in %d documents>" % (
+            self.__class__.__name__, len(self.paths), self.documents)
+
+
+def _count(paths, path, tagtype, count, size):
+    entry = paths.get((path, tagtype))
+    if entry is None:
+        paths[(path, tagtype)] = [count, size]
+    else:
+        entry[0] += count
+        entry[1] += size
+
+
+def profile_file(filename, limits=None):
+    """
+    Return a SchemaProfile of one file: a region file (if the extension is
+    one of REGION_EXTENSIONS) or an NBT file. Errors are counted, not
+    raised.
+    """
+    profile = SchemaProfile(limits)
+    if filename.endswith(REGION_EXTENSIONS):
+        try:
+            region = RegionFile(filename, limits=limits)
+        except (RegionFileFormatError, IOError):
+            profile.errors += 1
+            return profile
+        try:
+            profile.add_region(region)
+        finally:
+            region.close()
+    else:
+        try:
+            profile.add_file(filename)
+        except (MalformedFileError, IOError):
+            profile.errors += 1
+    return profile
+
+
+def profile_files(filenames, workers=None, limits=None):
+    """
+    Return the merged SchemaProfile of a set of region and NBT files.
+    The files are profiled in a pool of workers processes (default: the
+    number of CPUs), or serially if workers is 1 or concurrent.futures is
+    unavailable.
+    """
+    filenames = list(filenames)
+    total = SchemaProfile(limits)
+    if workers == 1 or ProcessPoolExecutor is None:
+        for filename in filenames:
+            total.merge(profile_file(filename, limits))
+        return total
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for profile in executor.map(profile_file, filenames,
+                                    [limits] * len(filenames)):
+            total.merge(profile)
+    return total
@@ -0,0 +1,510 @@
+"""
+Read and write NBT data as a stream.
+
+NBTWriter writes a file without building a tree of TAG objects first.
+NBTPushParser parses data as it arrives in fragments, for example from a
+network connection.
+
+For more information about the NBT format:
+https://minecraft.wiki/w/NBT_format
+"""
+
+from struct import Struct
+from gzip import GzipFile
+from io import BytesIO
+from collections import deque
+import zlib
+
+from .nbt import TAG_END, TAG_BYTE, TAG_SHORT, TAG_INT, TAG_LONG, \
+    TAG_FLOAT, TAG_DOUBLE, TAG_BYTE_ARRAY, TAG_STRING, TAG_LIST, \
+    TAG_COMPOUND, TAG_INT_ARRAY, TAG_LONG_ARRAY, TAGLIST, TAG, TAG_String, \
+    TAG_List, TAG_Compound, NBTFile, MalformedFileError, DEFAULT_LIMITS
+
+_TYPE = Struct(">b")
+_NAME_LENGTH = Struct(">H")
+_LENGTH = Struct(">i")
+_LIST_HEADER = Struct(">bi")
+
+_SCALARS = {
+    TAG_BYTE: Struct(">b"),
+    TAG_SHORT: Struct(">h"),
+    TAG_INT: Struct(">i"),
+    TAG_LONG: Struct(">q"),
+    TAG_FLOAT: Struct(">f"),
+    TAG_DOUBLE: Struct(">d"),
+}
+
+_ITEMSIZES = {TAG_BYTE_ARRAY: 1, TAG_INT_ARRAY: 4, TAG_LONG_ARRAY: 8}
+
+
+class _ZlibWriter(object):
+    """File-like object that zlib compresses all data written to fileobj."""
+
+    def __init__(self, fileobj, level=zlib.Z_DEFAULT_COMPRESSION):
+        self.fileobj = fileobj
+        self.compressor = zlib.compressobj(level)
+
+    def write(self, data):
+        self.fileobj.write(self.compressor.compress(data))
+
+    def flush(self):
+        self.fileobj.write(self.compressor.flush(zlib.Z_SYNC_FLUSH))
+
+    def close(self):
+        self.fileobj.write(self.compressor.flush())
+
+
+class NBTWriter(object):
+    """
+    Write an NBT file tag by tag.
+
+    Tags are written in document order with the write_*() methods, and
+    TAG_Compound and TAG_List are opened and closed with begin_*() and
+    end_*(). The nesting and the type and length of lists are checked as
+    the data is written, and a ValueError is raised for invalid input.
+
+    Example::
+
+        with NBTWriter(fileobj, compression='gzip') as writer:
+            writer.begin_compound("Data")
+            writer.write_int("Version", 1)
+            writer.begin_list("Entities", TAG_COMPOUND, len(entities))
+            for entity in entities:
+                writer.begin_compound()
+                writer.write_string("id", entity.id)
+                writer.end_compound()
+            writer.end_list()
+            writer.end_compound()
+
+    The first tag must be the root TAG_Compound. Within a TAG_Compound, each
+    tag requires a name; within a TAG_List, names must be omitted.
+    """
+
+    def __init__(self, fileobj, compression=None):
+        """
+        Create a new writer, which writes to fileobj.
+
+        compression is None (write uncompressed data), 'gzip' (as used for
+        .dat files) or 'zlib' (as used for chunks in region files). The
+        caller is responsible for closing fileobj.
+        """
+        self.fileobj = fileobj
+        if compression is None:
+            self.file = fileobj
+        elif compression == 'gzip':
+            self.file = GzipFile(fileobj=fileobj, mode="wb")
+        elif compression == 'zlib':
+            self.file = _ZlibWriter(fileobj)
+        else:
+            raise ValueError("Unknown compression %r" % (compression,))
+        self.compression = compression
+        # Each stack entry is [tag type, element type, remaining elements]
+        self._stack = []
+        self._started = False
+        self.closed = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+
+    @property
+    def depth(self):
+        """Number of open TAG_Compounds and TAG_Lists"""
+        return len(self._stack)
+
+    def _header(self, tagtype, name):
+        """Check if a tag of the given type can be written at the current
+        location, and write the type and name if required."""
+        if self.closed:
+            raise ValueError("NBTWriter is closed")
+        if not self._stack:
+            if self._started:
+                raise ValueError("The root tag is already complete")
+            if tagtype != TAG_COMPOUND:
+                raise ValueError("The root tag must be a TAG_Compound")
+            self._started = True
+        elif self._stack[-1][0] == TAG_LIST:
+            frame = self._stack[-1]
+            if name is not None:
+                raise ValueError("Elements of a TAG_List have no name")
+            if tagtype != frame[1]:
+                raise ValueError("List of %s can not contain a %s" % (
+                    TAGLIST[frame[1]].__name__, TAGLIST[tagtype].__name__))
+            if frame[2] <= 0:
+                raise ValueError("Too many elements for TAG_List")
+            frame[2] -= 1
+            return
+        elif name is None:
+            raise ValueError("Elements of a TAG_Compound require a name")
+        self.file.write(_TYPE.pack(tagtype))
+        TAG_String(name if name is not None else "")._render_buffer(self.file)
+
+    def _write_scalar(self, tagtype, name, value):
+        self._header(tagtype, name)
+        self.file.write(_SCALARS[tagtype].pack(value))
+
+    def write_byte(self, name, value):
+        """Write a TAG_Byte. name is None for elements of a TAG_List."""
+        self._write_scalar(TAG_BYTE, name, value)
+
+    def write_short(self, name, value):
+        """Write a TAG_Short. name is None for elements of a TAG_List."""
+        self._write_scalar(TAG_SHORT, name, value)
+
+    def write_int(self, name, value):
+        """Write a TAG_Int. name is None for elements of a TAG_List."""
+        self._write_scalar(TAG_INT, name, value)
+
+    def write_long(self, name, value):
+        """Write a TAG_Long. name is None for elements of a TAG_List."""
+        self._write_scalar(TAG_LONG, name, value)
+
+    def write_float(self, name, value):
+        """Write a TAG_Float. name is None for elements of a TAG_List."""
+        self._write_scalar(TAG_FLOAT, name, value)
+
+    def write_double(self, name, value):
+        """Write a TAG_Double. name is None for elements of a TAG_List."""
+        self._write_scalar(TAG_DOUBLE, name, value)
+
+    def write_string(self, name, value):
+        """Write a TAG_String. name is None for elements of a TAG_List."""
+        self._header(TAG_STRING, name)
+        TAG_String(value)._render_buffer(self.file)
+
+    def write_byte_array(self, name, value):
+        """Write a TAG_Byte_Array. value is a bytes-like object."""
+        self._header(TAG_BYTE_ARRAY, name)
+        value = bytes(value)
+        self.file.write(_LENGTH.pack(len(value)))
+        self.file.write(value)
+
+    def _write_array(self, tagtype, name, value, fmt):
+        self._header(tagtype, name)
+        value = list(value)
+        self.file.write(_LENGTH.pack(len(value)))
+        self.file.write(Struct(">%d%s" % (len(value), fmt)).pack(*value))
+
+    def write_int_array(self, name, value):
+        """Write a TAG_Int_Array. value is a sequence of integers."""
+        self._write_array(TAG_INT_ARRAY, name, value, "i")
+
+    def write_long_array(self, name, value):
+        """Write a TAG_Long_Array. value is a sequence of integers."""
+        self._write_array(TAG_LONG_ARRAY, name, value, "q")
+
+    def write_tag(self, tag, name=None):
+        """
+        Write an existing TAG object, including all its children.
+        The name of the tag is used, unless another name is given.
+        Within a TAG_List, the name is ignored.
+        """
+        if not isinstance(tag, TAG):
+            raise ValueError("tag must be an nbt.TAG, not a %s" %
+                             type(tag).__name__)
+        if name is None:
+            name = tag.name if tag.name is not None else ""
+        if self._stack and self._stack[-1][0] == TAG_LIST:
+            name = None
+        self._header(tag.id, name)
+        tag._render_buffer(self.file)
+
+    def begin_compound(self, name=None):
+        """Start a TAG_Compound. The root compound and elements of a
+        TAG_List may be unnamed."""
+        if not self._stack and name is None:
+            name = ""
+        self._header(TAG_COMPOUND, name)
+        self._stack.append([TAG_COMPOUND, None, 0])
+
+    def end_compound(self):
+        """End the current TAG_Compound."""
+        if not self._stack or self._stack[-1][0] != TAG_COMPOUND:
+            raise ValueError("end_compound() without matching begin_compound()")
+        self.file.write(b'\x00')  # write TAG_END
+        self._stack.pop()
+
+    def begin_list(self, name, tagid, length):
+        """
+        Start a TAG_List of length elements of type tagid.
+
+        tagid is one of the TAG_* constants or a TAG class. Exactly length
+        elements must be written before end_list() is called.
+        """
+        if isinstance(tagid, type):
+            tagid = tagid.id
+        if tagid not in TAGLIST or (tagid == TAG_END and length > 0):
+            raise ValueError("Invalid list element type %r" % (tagid,))
+        if length < 0:
+            raise ValueError("Negative list length %d" % length)
+        self._header(TAG_LIST, name)
+        self.file.write(_LIST_HEADER.pack(tagid, length))
+        self._stack.append([TAG_LIST, tagid, length])
+
+    def end_list(self):
+        """End the current TAG_List."""
+        if not self._stack or self._stack[-1][0] != TAG_LIST:
+            raise ValueError("end_list() without matching begin_list()")
+        if self._stack[-1][2] != 0:
+            raise ValueError("%d element(s) missing in TAG_List"
+                             % self._stack[-1][2])
+        self._stack.pop()
+
+    def close(self):
+        """
+        Finish writing. Raise a ValueError if the root tag is incomplete.
+        The underlying fileobj is not closed.
+        """
+        if self.closed:
+            return
+        if self._stack or not self._started:
+            raise ValueError("NBTWriter.close(): the root tag is incomplete")
+        if self.compression is not None:
+            self.file.close()
+        # make sure the file is complete
+        try:
+            self.fileobj.flush()
+        except (AttributeError, IOError):
+            pass
+        self.closed = True
+
+
+class NBTPushParser(object):
+    """
+    Incremental NBT parser, which is fed data as it arrives.
+
+    Data is passed to feed() in fragments of any size. Tags are created as
+    soon as their bytes are available, and are reported as events, similar
+    to xml.etree.ElementTree.XMLPullParser::
+
+        parser = NBTPushParser(events=('start', 'end'))
+        for fragment in connection:
+            parser.feed(fragment)
+            for event, tag in parser.read_events():
+                ...
+        nbtfile = parser.close()
+
+    The 'start' event is reported for a TAG_Compound or TAG_List as soon as
+    its header is read; its children are added while parsing continues.
+    The 'end' event is reported for every tag once it is complete.
+    """
+
+    def __init__(self, events=('end',), compression=None, limits=None):
+        """
+        events is a sequence of the events to report: 'start' and/or 'end'.
+        compression is None for uncompressed data, 'gzip' (as used for .dat
+        files) or 'zlib' (as used for chunks in region files).
+        limits is a ParseLimits instance. If not specified, DEFAULT_LIMITS
+        is used.
+        """
+        for event in events:
+            if event not in ('start', 'end'):
+                raise ValueError("Unknown event %r" % (event,))
+        self._report = frozenset(events)
+        if compression is None:
+            self._decompressor = None
+        elif compression == 'gzip':
+            self._decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        elif compression == 'zlib':
+            self._decompressor = zlib.decompressobj()
+        else:
+            raise ValueError("Unknown compression %r" % (compression,))
+        self.limits = limits if limits is not None else DEFAULT_LIMITS
+        self._buffer = bytearray()
+        self._pos = 0
+        self._received = 0
+        # Each stack entry is [tag, element type, remaining elements].
+        # The element type is None for compounds.
+        self._stack = []
+        self._events = deque()
+        self.root = None
+        """The root NBTFile. Available as soon as its header is parsed, and
+        complete after the 'end' event of the root tag."""
+        self.done = False
+        """True if the root tag is complete."""
+
+    def feed(self, data):
+        """Feed data to the parser. Tags are parsed as far as possible."""
+        if self._decompressor is not None:
+            try:
+                data = self._decompressor.decompress(data)
+            except zlib.error as e:
+                raise MalformedFileError("Invalid compressed data: %s" % e)
+        self._append(data)
+
+    def _append(self, data):
+        if not data:
+            return
+        if self.done:
+            raise MalformedFileError("Data after the end of the root tag")
+        self._received += len(data)
+        max_bytes = self.limits.max_bytes
+        if max_bytes is not None and self._received > max_bytes:
+            raise MalformedFileError(
+                "Data exceeds the maximum of %d bytes" % max_bytes)
+        self._buffer.extend(data)
+        while not self.done and self._step():
+            pass
+        if self.done and self._pos < len(self._buffer):
+            raise MalformedFileError("Data after the end of the root tag")
+        # Discard parsed data
+        del self._buffer[:self._pos]
+        self._pos = 0
+
+    def read_events(self):
+        """Yield the (event, tag) tuples parsed since the previous call."""
+        events = self._events
+        while events:
+            yield events.popleft()
+
+    def close(self):
+        """
+        Signal the end of the data, and return the root NBTFile.
+        Raise a MalformedFileError if the data is incomplete.
+        """
+        if self._decompressor is not None:
+            self._append(self._decompressor.flush())
+            if not self._decompressor.eof:
+                raise MalformedFileError(
+                    "Partial File Parse: file possibly truncated.")
+        if not self.done:
+            raise MalformedFileError(
+                "Partial File Parse: file possibly truncated.")
+        return self.root
+
+    def _emit(self, event, tag):
+        if event in self._report:
+            self._events.append((event, tag))
+
+    def _check_length(self, length, limit):
+        if length < 0:
+            raise MalformedFileError("Negative length %d" % length)
+        if limit is not None and length > limit:
+            raise MalformedFileError(
+                "Length %d exceeds the maximum of %d" % (length, limit))
+
+    def _push(self, tag, elementtype, length):
+        max_depth = self.limits.max_depth
+        if max_depth is not None and len(self._stack) >= max_depth:
+            raise MalformedFileError(
+                "Nesting depth exceeds the maximum of %d" % max_depth)
+        self._stack.append([tag, elementtype, length])
+        self._emit('start', tag)
+
+    def _pop(self):
+        tag = self._stack.pop()[0]
+        self._emit('end', tag)
+        if not self._stack:
+            self.done = True
+
+    def _read_name(self, pos, available):
+        """Return (name, size), or (None, None) if more data is required."""
+        if available < 2:
+            return None, None
+        length = _NAME_LENGTH.unpack_from(self._buffer, pos)[0]
+        self._check_length(length, self.limits.max_string_length)
+        if available < 2 + length:
+            return None, None
+        name = bytes(self._buffer[pos + 2:pos + 2 + length]).decode("utf-8")
+        return name, 2 + length
+
+    def _payload_size(self, tagtype, pos, available):
+        """Return the size of the payload at pos, or None if more data is
+        required to tell."""
+        if tagtype in _SCALARS:
+            return _SCALARS[tagtype].size
+        elif tagtype == TAG_STRING:
+            if available < 2:
+                return None
+            length = _NAME_LENGTH.unpack_from(self._buffer, pos)[0]
+            self._check_length(length, self.limits.max_string_length)
+            return 2 + length
+        elif tagtype in _ITEMSIZES:
+            if available < 4:
+                return None
+            length = _LENGTH.unpack_from(self._buffer, pos)[0]
+            self._check_length(length, self.limits.max_length)
+            return 4 + length * _ITEMSIZES[tagtype]
+        elif tagtype == TAG_LIST:
+            return 5
+        elif tagtype == TAG_COMPOUND:
+            return 0
+        raise MalformedFileError("Unrecognised tag type %d" % tagtype)
+
+    def _step(self):
+        """Parse the next tag header or value. Return False if more data
+        is required."""
+        buffer, pos = self._buffer, self._pos
+        available = len(buffer) - pos
+        if not self._stack:
+            # header of the root tag
+            if available < 1:
+                return False
+            if _TYPE.unpack_from(buffer, pos)[0] != TAG_COMPOUND:
+                raise MalformedFileError("First record is not a Compound Tag")
+            name, size = self._read_name(pos + 1, available - 1)
+            if name is None:
+                return False
+            self.root = NBTFile()
+            self.root.name = name
+            self._pos += 1 + size
+            self._push(self.root, None, 0)
+            return True
+
+        frame = self._stack[-1]
+        if frame[1] is None:
+            # next tag in a compound
+            if available < 1:
+                return False
+            tagtype = _TYPE.unpack_from(buffer, pos)[0]
+            if tagtype == TAG_END:
+                self._pos += 1
+                self._pop()
+                return True
+            name, header = self._read_name(pos + 1, available - 1)
+            if name is None:
+                return False
+            header += 1
+        else:
+            # next element in a list
+            if frame[2] == 0:
+                self._pop()
+                return True
+            tagtype = frame[1]
+            name, header = None, 0
+
+        size = self._payload_size(tagtype, pos + header, available - header)
+        if size is None or available < header + size:
+            return False
+        start = pos + header
+        self._pos = start + size
+
+        if tagtype == TAG_COMPOUND:
+            tag = TAG_Compound()
+        elif tagtype == TAG_LIST:
+            elementtype, length = _LIST_HEADER.unpack_from(buffer, start)
+            self._check_length(length, self.limits.max_length)
+            if length > 0 and (elementtype == TAG_END or
+                               elementtype not in TAGLIST):
+                raise MalformedFileError(
+                    "Invalid list element type %d" % elementtype)
+            tag = TAG_List()
+            tag.tagID = elementtype
+        else:
+            tag = TAGLIST[tagtype]()
+            tag._parse_buffer(BytesIO(bytes(buffer[start:start + size])))
+        tag.name = name
+        frame[0].tags.append(tag)
+        if frame[1] is not None:
+            frame[2] -= 1
+
+        if tagtype == TAG_COMPOUND:
+            self._push(tag, None, 0)
+        elif tagtype == TAG_LIST:
+            self._push(tag, elementtype, length)
+        else:
+            self._emit('end', tag)
+        return True
@@ -0,0 +1,164 @@
+#!/usr/bin/env python
+import sys,os
+from gzip import GzipFile
+from io import BytesIO
+
+import unittest
+try:
+    from unittest import skip as _skip
+except ImportError:
+    # Python 2.6 has an older unittest API. The backported package is available from pypi.
+    import unittest2 as unittest
+
+# Search parent directory first, to make sure we test the local nbt module, 
+# not an installed nbt module.
+parentdir = os.path.realpath(os.path.join(os.path.dirname(__file__),os.pardir))
+if parentdir not in sys.path:
+    sys.path.insert(1, parentdir)  # insert ../ just after ./
+
+from nbt.nbt import NBTFile, MalformedFileError, ParseLimits, \
+    TAG_COMPOUND, TAG_LIST, TAG_LONG, from_python
+from nbt.arena import NBTArena, ArenaCursor
+
+NBTTESTFILE = os.path.join(os.path.dirname(__file__), 'bigtest.nbt')
+
+
+class ArenaTest(unittest.TestCase):
+    """Test the read-only arena view of bigtest.nbt"""
+
+    def setUp(self):
+        self.data = GzipFile(NBTTESTFILE).read()
+        self.arena = NBTArena(self.data)
+        self.nbtfile = NBTFile(NBTTESTFILE)
+
+    def testSize(self):
+        self.assertEqual(self.arena.size, len(self.data))
+        self.assertEqual(len(self.arena), 29)
+
+    def testRoot(self):
+        root = self.arena.root
+        self.assertEqual(root.id, TAG_COMPOUND)
+        self.assertEqual(root.name, "Level")
+        self.assertEqual(root.keys(), self.nbtfile.keys())
+        self.assertEqual(len(root), 11)
+
+    def testValues(self):
+        for cursor in self.arena.root.children():
+            tag = self.nbtfile[cursor.name]
+            if cursor.id in (TAG_COMPOUND, TAG_LIST):
+                continue
+            self.assertEqual(cursor.value(), tag.value)
+
+    def testFind(self):
+        egg = self.arena.find("nested compound test/egg/value")
+        self.assertAlmostEqual(egg.value(), 0.5)
+        self.assertEqual(self.arena.find(["listTest (long)", 2]).value(), 13)
+        self.assertEqual(self.arena.find("listTest (compound)/1/name").value(),
+                         "Compound tag #1")
+        self.assertEqual(self.arena.find("nonexisting/path"), None)
+        self.assertEqual(self.arena.find("intTest/child"), None)
+
+    def testList(self):
+        cursor = self.arena.root["listTest (long)"]
+        self.assertEqual(len(cursor), 5)
+        self.assertEqual([c.value() for c in cursor.children()],
+                         [11, 12, 13, 14, 15])
+        self.assertTrue(all(c.id == TAG_LONG and c.name is None
+                            for c in cursor.children()))
+        self.assertEqual(cursor[-1].value(), 15)
+        self.assertRaises(IndexError, cursor.__getitem__, 5)
+
+    def testToTag(self):
+        tag = self.arena.root.to_tag()
+        self.assertEqual(tag.name, "Level")
+        self.assertEqual(str(tag), str(self.nbtfile))
+        self.assertEqual(self.arena.root["nested compound test"].to_tag()
+                         .pretty_tree(),
+                         self.nbtfile["nested compound test"].pretty_tree())
+
+    def testCursorEquality(self):
+        self.assertEqual(self.arena.root["intTest"],
+                         ArenaCursor(self.arena, self.arena.root["intTest"].index))
+        self.assertNotEqual(self.arena.root["intTest"], self.arena.root)
+
+    def testMemoryview(self):
+        arena = NBTArena(memoryview(self.data))
+        self.assertEqual(arena.find("stringTest").value(),
+                         self.nbtfile["stringTest"].value)
+
+
+class ArenaWalkTest(unittest.TestCase):
+    """Test ArenaCursor.walk() and ArenaCursor.find_all()"""
+
+    def setUp(self):
+        self.arena = NBTArena.from_file(NBTTESTFILE)
+        self.nbtfile = NBTFile(NBTTESTFILE)
+
+    def testWalkMatchesTree(self):
+        self.assertEqual([(path, cursor.id) for path, cursor in self.arena.root.walk()],
+                         [(path, tag.id) for path, tag in self.nbtfile.walk()])
+
+    def testWalkSubtree(self):
+        paths = [path for path, c in self.arena.find("listTest (compound)").walk()]
+        self.assertEqual(paths, [(), (0,), (0, "name"), (0, "created-on"),
+                                 (1,), (1, "name"), (1, "created-on")])
+
+    def testFindAll(self):
+        self.assertEqual([c.value() for c in self.arena.root.find_all("name")],
+                         [t.value for t in self.nbtfile.find_all("name")])
+
+    def testPruneEmpty(self):
+        """prune is called for the same tags as by TAG.walk, including
+        empty compounds and lists."""
+        nbtfile = NBTFile()
+        nbtfile.name = "root"
+        nbtfile.tags = from_python({"empty": {}, "list": [], "ints": [1, 2],
+                                    "nested": {"a": {}, "b": [[]]}}).tags
+        buffer = BytesIO()
+        nbtfile.write_file(buffer=buffer)
+        arena = NBTArena(buffer.getvalue())
+        for skip in [(), ("empty",), ("nested",), ("nested", "b")]:
+            tree_calls, arena_calls = [], []
+            def tree_prune(path, tag):
+                tree_calls.append(path)
+                return path == skip
+            def arena_prune(path, cursor):
+                arena_calls.append(path)
+                return path == skip
+            self.assertEqual([path for path, c in arena.root.walk(arena_prune)],
+                             [path for path, t in nbtfile.walk(tree_prune)])
+            self.assertEqual(arena_calls, tree_calls)
+        self.assertIn(("empty",), tree_calls)
+        self.assertIn(("list",), tree_calls)
+
+    def testFindAllPrune(self):
+        prune = lambda path, cursor: cursor.id == TAG_LIST
+        names = self.arena.root.find_all("name", prune=prune)
+        self.assertEqual([c.value() for c in names], ["Hampus", "Eggbert"])
+        lists = self.arena.root.find_all(prune=prune,
+                                         predicate=lambda c: c.id == TAG_LIST)
+        self.assertEqual(len(lists), 2)
+
+
+class MalformedArenaTest(unittest.TestCase):
+    """Test that the arena rejects invalid data"""
+
+    def testEmpty(self):
+        self.assertRaises(MalformedFileError, NBTArena, b"")
+
+    def testNotCompound(self):
+        self.assertRaises(MalformedFileError, NBTArena, b"\x01\0\0\x05")
+
+    def testTruncated(self):
+        self.assertRaises(MalformedFileError, NBTArena,
+                          b"\x0A\0\0\x07\0\x01a\0\0\0\x10ab\0")
+
+    def testMaxDepth(self):
+        data = b"\x0A\0\0\x0A\0\x01a\x0A\0\x01b\0\0\0"
+        NBTArena(data, ParseLimits(max_depth=3))
+        self.assertRaises(MalformedFileError, NBTArena, data,
+                          ParseLimits(max_depth=2))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,163 @@
+#!/usr/bin/env python
+import sys,os
+from io import BytesIO
+from gzip import GzipFile
+
+import unittest
+try:
+    from unittest import skip as _skip
+except ImportError:
+    # Python 2.6 has an older unittest API. The backported package is available from pypi.
+    import unittest2 as unittest
+
+# Search parent directory first, to make sure we test the local nbt module, 
+# not an installed nbt module.
+parentdir = os.path.realpath(os.path.join(os.path.dirname(__file__),os.pardir))
+if parentdir not in sys.path:
+    sys.path.insert(1, parentdir)  # insert ../ just after ./
+
+from nbt.nbt import NBTFile, TAG_Compound, TAG_List, TAG_Byte, TAG_Short, \
+    TAG_Int, TAG_Float, TAG_Double, TAG_String, TAG_Int_Array, \
+    MalformedFileError
+from nbt.columnar import ColumnarList
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+NBTTESTFILE = os.path.join(os.path.dirname(__file__), 'bigtest.nbt')
+
+
+def entities_file():
+    """Return an NBTFile with a list of entities with varying fields"""
+    nbtfile = NBTFile()
+    nbtfile.name = "Chunk"
+    entities = TAG_List(name="Entities", type=TAG_Compound)
+    for i in range(6):
+        entity = TAG_Compound()
+        entity.tags.append(TAG_String(name="id", value="mob%d" % (i % 2)))
+        pos = TAG_List(name="Pos", type=TAG_Double)
+        pos.tags.extend(TAG_Double(i + 0.25 * j) for j in range(3))
+        entity.tags.append(pos)
+        if i % 2 == 0:
+            entity.tags.append(TAG_Float(name="Health", value=i * 2.0))
+        # the type of Age varies between entities
+        if i < 3:
+            entity.tags.append(TAG_Short(name="Age", value=i))
+        else:
+            entity.tags.append(TAG_Int(name="Age", value=100000 * i))
+        nested = TAG_Compound(name="Brain")
+        nested.tags.append(TAG_Byte(name="Memory", value=i))
+        entity.tags.append(nested)
+        if i == 5:
+            entity.tags.append(TAG_Int_Array(name="UUID", value=[1, 2, 3, 4]))
+        entities.tags.append(entity)
+    nbtfile.tags.append(entities)
+    return nbtfile
+
+
+class ColumnarTest(unittest.TestCase):
+    """Test columns built from a TAG_List"""
+
+    def setUp(self):
+        self.nbtfile = entities_file()
+        self.columns = self.build()
+
+    def build(self, columns=None):
+        return ColumnarList.from_tag(self.nbtfile["Entities"], columns)
+
+    def testNames(self):
+        self.assertEqual(len(self.columns), 6)
+        self.assertEqual(self.columns.keys(),
+                         ["id", "Pos[0]", "Pos[1]", "Pos[2]", "Health",
+                          "Age", "Brain/Memory", "UUID"])
+
+    def testNumbers(self):
+        column = self.columns["Pos[1]"]
+        self.assertEqual(column.typecode, 'd')
+        self.assertEqual(list(column), [0.25, 1.25, 2.25, 3.25, 4.25, 5.25])
+        self.assertEqual(column.sum(), 16.5)
+        self.assertEqual(self.columns["Brain/Memory"].max(), 5)
+
+    def testMissing(self):
+        column = self.columns["Health"]
+        self.assertEqual(column.count(), 3)
+        self.assertEqual(list(column), [0.0, None, 4.0, None, 8.0, None])
+        self.assertEqual(column.present(), [0.0, 4.0, 8.0])
+        self.assertEqual(column.mean(), 4.0)
+        self.assertEqual(column.min(), 0.0)
+        self.assertEqual(list(self.columns["UUID"])[:5], [None] * 5)
+
+    def testWidening(self):
+        column = self.columns["Age"]
+        self.assertEqual(column.count(), 6)
+        self.assertEqual(list(column), [0, 1, 2, 300000, 400000, 500000])
+
+    def testStrings(self):
+        column = self.columns["id"]
+        self.assertIsNone(column.typecode)
+        self.assertEqual(list(column), ["mob0", "mob1"] * 3)
+        self.assertRaises(TypeError, column.sum)
+
+    def testObjects(self):
+        uuid = self.columns["UUID"][5]
+        self.assertEqual(list(uuid.value), [1, 2, 3, 4])
+
+    def testRow(self):
+        row = self.columns.row(-1)
+        self.assertEqual(row["id"], "mob1")
+        self.assertEqual(row["Age"], 500000)
+        self.assertNotIn("Health", row)
+        self.assertRaises(IndexError, self.columns.row, 6)
+
+    def testSelectColumns(self):
+        columns = self.build(["Health", "Pos[0]"])
+        self.assertEqual(sorted(columns.keys()), ["Health", "Pos[0]"])
+        self.assertEqual(len(columns), 6)
+
+    def testNotAList(self):
+        self.assertRaises(TypeError, ColumnarList.from_tag,
+                          self.nbtfile["Entities"].tags[0])
+
+    @unittest.skipIf(numpy is None, "NumPy is not installed")
+    def testNumpy(self):
+        health = self.columns["Health"].to_numpy()
+        self.assertEqual(health.count(), 3)
+        self.assertEqual(health.sum(), 12.0)
+
+
+class BufferColumnarTest(ColumnarTest):
+    """Test columns built directly from uncompressed NBT data"""
+
+    def build(self, columns=None):
+        buffer = BytesIO()
+        self.nbtfile.write_file(buffer=buffer)
+        return ColumnarList.from_buffer(buffer.getvalue(), "Entities",
+                                        columns)
+
+    def testNotAList(self):
+        data = GzipFile(NBTTESTFILE).read()
+        self.assertRaises(TypeError, ColumnarList.from_buffer, data,
+                          "nested compound test")
+        self.assertRaises(TypeError, ColumnarList.from_buffer, data,
+                          "listTest (long)")
+        self.assertRaises(KeyError, ColumnarList.from_buffer, data,
+                          "nonexistent")
+
+    def testTruncated(self):
+        buffer = BytesIO()
+        self.nbtfile.write_file(buffer=buffer)
+        data = buffer.getvalue()
+        for size in (0, 2, len(data) // 2, len(data) - 3):
+            self.assertRaises(MalformedFileError, ColumnarList.from_buffer,
+                              data[:size], "Entities")
+
+    def testBigtest(self):
+        data = GzipFile(NBTTESTFILE).read()
+        columns = ColumnarList.from_buffer(data, "listTest (compound)")
+        self.assertEqual(list(columns["created-on"]), [1264099775885] * 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,208 @@
+#!/usr/bin/env python
+import sys,os
+import os.path
+from io import BytesIO
+import zlib
+
+import unittest
+try:
+    from unittest import skip as _skip
+except ImportError:
+    # Python 2.6 has an older unittest API. The backported package is available from pypi.
+    import unittest2 as unittest
+
+# Search parent directory first, to make sure we test the local nbt module,
+# not an installed nbt module.
+parentdir = os.path.realpath(os.path.join(os.path.dirname(__file__),os.pardir))
+if parentdir not in sys.path:
+    sys.path.insert(1, parentdir)  # insert ../ just after ./
+
+from nbt.compression import COMPRESSION_GZIP, COMPRESSION_ZLIB, \
+    COMPRESSION_UNCOMPRESSED, COMPRESSION_LZ4, COMPRESSION_CUSTOM, \
+    register_codec, get_codec, compress, decompress, xxh32, \
+    lz4_block_decompress, lz4_compress, lz4_decompress, LZ4_BLOCK_SIZE, \
+    _CODECS
+from nbt.region import RegionFile, ChunkDataError
+from nbt.nbt import NBTFile, TAG_Int, TAG_String
+
+
+def _test_nbt():
+    nbt = NBTFile()
+    nbt.name = "Chunk"
+    nbt.tags.append(TAG_Int(name="xPos", value=3))
+    nbt.tags.append(TAG_String(name="Status", value="full" * 100))
+    return nbt
+
+
+class XXHashTest(unittest.TestCase):
+    """Test the xxHash32 checksum against known values."""
+
+    def test01Empty(self):
+        self.assertEqual(xxh32(b""), 0x02CC5D05)
+
+    def test02Short(self):
+        self.assertEqual(xxh32(b"a"), 0x550D7456)
+        self.assertEqual(xxh32(b"abc"), 0x32D153FF)
+
+    def test03Long(self):
+        """Input of more than 16 bytes is hashed in four lanes."""
+        self.assertEqual(xxh32(b"Nobody inspects the spammish repetition"),
+                         0xE2293B2F)
+
+    def test04Memoryview(self):
+        data = b"Nobody inspects the spammish repetition"
+        self.assertEqual(xxh32(memoryview(data)), xxh32(data))
+
+
+class LZ4BlockTest(unittest.TestCase):
+    """Test decoding of single LZ4 blocks."""
+
+    def test01Literals(self):
+        self.assertEqual(lz4_block_decompress(b"\x50hello", 5), b"hello")
+
+    def test02Match(self):
+        """4 literals, then a match of 4+12 bytes at offset 4 (overlapping)."""
+        data = lz4_block_decompress(b"\x4cabcd\x04\x00\x50efghi", 25)
+        self.assertEqual(data, b"abcd" * 5 + b"efghi")
+
+    def test03RunLength(self):
+        """A match at offset 1 repeats the last byte."""
+        data = lz4_block_decompress(b"\x1fx\x01\x00\x0b\x00", 31)
+        self.assertEqual(data, b"x" * 31)
+
+    def test04ExtendedLiterals(self):
+        """A literal length of 15 or more continues in the next bytes."""
+        literals = b"y" * 300
+        # 300 = 15 + 255 + 30
+        data = lz4_block_decompress(b"\xf0\xff\x1e" + literals, 300)
+        self.assertEqual(data, literals)
+
+    def test05WrongSize(self):
+        self.assertRaises(ValueError, lz4_block_decompress, b"\x50hello", 6)
+
+    def test06InvalidOffset(self):
+        self.assertRaises(ValueError, lz4_block_decompress,
+                          b"\x10a\x05\x00\x10b", 7)
+
+
+class LZ4StreamTest(unittest.TestCase):
+    """Test the LZ4Block stream format."""
+
+    def test01RoundTrip(self):
+        data = os.urandom(1000)
+        self.assertEqual(lz4_decompress(lz4_compress(data)), data)
+
+    def test02MultipleBlocks(self):
+        data = os.urandom(2 * LZ4_BLOCK_SIZE + 10)
+        self.assertEqual(lz4_decompress(lz4_compress(data), True), data)
+
+    def test03Empty(self):
+        self.assertEqual(lz4_decompress(lz4_compress(b"")), b"")
+
+    def test04Checksum(self):
+        stream = bytearray(lz4_compress(b"some chunk data"))
+        stream[21] ^= 0xff  # first byte of the data
+        self.assertRaises(ValueError, lz4_decompress, bytes(stream), True)
+        # not verified
+        self.assertEqual(lz4_decompress(bytes(stream), False)[1:],
+                         b"ome chunk data")
+
+    def test05Truncated(self):
+        stream = lz4_compress(b"some chunk data")
+        self.assertRaises(ValueError, lz4_decompress, stream[:30])
+        self.assertRaises(ValueError, lz4_decompress, stream[:10])
+
+    def test06Magic(self):
+        stream = b"LZ4Brick" + lz4_compress(b"data")[8:]
+        self.assertRaises(ValueError, lz4_decompress, stream)
+
+
+class CodecRegistryTest(unittest.TestCase):
+    """Test the registry of compression codecs."""
+
+    def tearDown(self):
+        _CODECS.pop(COMPRESSION_CUSTOM, None)
+
+    def test01BuiltIn(self):
+        data = b"chunk data" * 10
+        for compression in (COMPRESSION_GZIP, COMPRESSION_ZLIB,
+                            COMPRESSION_UNCOMPRESSED, COMPRESSION_LZ4):
+            self.assertEqual(decompress(compression, compress(compression, data)),
+                             data)
+        self.assertEqual(compress(COMPRESSION_UNCOMPRESSED, data), data)
+        self.assertEqual(get_codec(COMPRESSION_LZ4).name, "lz4")
+
+    def test02Unknown(self):
+        self.assertRaises(KeyError, get_codec, COMPRESSION_CUSTOM)
+        self.assertRaises(ValueError, compress, COMPRESSION_CUSTOM, b"data")
+
+    def test03Register(self):
+        codec = register_codec(COMPRESSION_CUSTOM, lambda data: bytes(data)[::-1],
+                               lambda data: bytes(data)[::-1], "reversed")
+        self.assertIs(get_codec(COMPRESSION_CUSTOM), codec)
+        self.assertEqual(compress(COMPRESSION_CUSTOM, b"abc"), b"cba")
+
+    def test04ReadOnly(self):
+        """A codec without compress function can be read, but not written."""
+        register_codec(COMPRESSION_CUSTOM, bytes)
+        self.assertEqual(decompress(COMPRESSION_CUSTOM, b"abc"), b"abc")
+        self.assertRaises(ValueError, compress, COMPRESSION_CUSTOM, b"abc")
+
+
+class RegionCompressionTest(unittest.TestCase):
+    """Test writing and reading chunks with each compression type."""
+
+    def setUp(self):
+        self.stream = BytesIO()
+        self.region = RegionFile(fileobj=self.stream)
+
+    def tearDown(self):
+        del self.region
+        _CODECS.pop(COMPRESSION_CUSTOM, None)
+
+    def _round_trip(self, compression):
+        nbt = _test_nbt()
+        self.region.write_chunk(0, 0, nbt, compression)
+        self.assertEqual(self.region.metadata[0, 0].compression, compression)
+        # read back through a new RegionFile, to parse the written header
+        region = RegionFile(fileobj=self.stream)
+        self.assertEqual(region.metadata[0, 0].compression, compression)
+        chunk = region.get_nbt(0, 0)
+        self.assertEqual(chunk["xPos"].value, 3)
+        self.assertEqual(chunk["Status"].value, "full" * 100)
+
+    def test01Zlib(self):
+        self._round_trip(COMPRESSION_ZLIB)
+
+    def test02Gzip(self):
+        self._round_trip(COMPRESSION_GZIP)
+
+    def test03Uncompressed(self):
+        self._round_trip(COMPRESSION_UNCOMPRESSED)
+
+    def test04LZ4(self):
+        self._round_trip(COMPRESSION_LZ4)
+
+    def test05Custom(self):
+        register_codec(COMPRESSION_CUSTOM, lambda data: zlib.decompress(data),
+                       lambda data: zlib.compress(data), "custom zlib")
+        self._round_trip(COMPRESSION_CUSTOM)
+
+    def test06UnknownWrite(self):
+        self.assertRaises(ValueError, self.region.write_chunk, 0, 0,
+                          _test_nbt(), COMPRESSION_CUSTOM)
+        self.assertEqual(self.region.chunk_count(), 0)
+
+    def test07UnknownRead(self):
+        """A chunk with an unregistered compression type can not be read."""
+        self.region.write_chunk(0, 0, _test_nbt(), COMPRESSION_ZLIB)
+        # overwrite the compression byte of the chunk, in sector 2
+        self.stream.seek(2 * 4096 + 4)
+        self.stream.write(b"\x63")
+        region = RegionFile(fileobj=self.stream)
+        self.assertEqual(region.metadata[0, 0].compression, 99)
+        self.assertRaises(ChunkDataError, region.get_blockdata, 0, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
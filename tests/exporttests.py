@@ -0,0 +1,161 @@
+#!/usr/bin/env python
+import sys,os
+import json
+from io import BytesIO, StringIO
+from gzip import GzipFile
+
+import unittest
+try:
+    from unittest import skip as _skip
+except ImportError:
+    # Python 2.6 has an older unittest API. The backported package is available from pypi.
+    import unittest2 as unittest
+
+# Search parent directory first, to make sure we test the local nbt module, 
+# not an installed nbt module.
+parentdir = os.path.realpath(os.path.join(os.path.dirname(__file__),os.pardir))
+if parentdir not in sys.path:
+    sys.path.insert(1, parentdir)  # insert ../ just after ./
+
+from nbt.nbt import NBTFile, MalformedFileError, ParseLimits, \
+    TAG_Float, TAG_Byte_Array, TAG_List, TAG_Compound
+from nbt.region import RegionFile
+from nbt.export import write_json, write_json_file, write_region_jsonl
+
+NBTTESTFILE = os.path.join(os.path.dirname(__file__), 'bigtest.nbt')
+REGIONTESTFILE = os.path.join(os.path.dirname(__file__), 'regiontest.mca')
+
+
+def to_json(nbtfile, typed=False):
+    buffer = BytesIO()
+    nbtfile.write_file(buffer=buffer)
+    buffer.seek(0)
+    out = StringIO()
+    write_json(buffer, out, typed)
+    return json.loads(out.getvalue())
+
+
+class ExportTest(unittest.TestCase):
+    """Test JSON output of bigtest.nbt"""
+
+    def setUp(self):
+        self.nbtfile = NBTFile(NBTTESTFILE)
+        out = StringIO()
+        write_json_file(NBTTESTFILE, out)
+        self.json = json.loads(out.getvalue())
+
+    def testValues(self):
+        self.assertEqual(sorted(self.json.keys()), sorted(self.nbtfile.keys()))
+        for name in ("byteTest", "shortTest", "intTest", "longTest",
+                     "doubleTest", "stringTest"):
+            self.assertEqual(self.json[name], self.nbtfile[name].value)
+        self.assertAlmostEqual(self.json["floatTest"],
+                               self.nbtfile["floatTest"].value)
+
+    def testNested(self):
+        self.assertEqual(self.json["nested compound test"]["egg"],
+                         {"name": "Eggbert", "value": 0.5})
+        self.assertEqual(self.json["listTest (long)"], [11, 12, 13, 14, 15])
+        self.assertEqual(self.json["listTest (compound)"][1]["name"],
+                         "Compound tag #1")
+
+    def testByteArray(self):
+        name = "byteArrayTest (the first 1000 values of (n*n*255+n*7)%100, " \
+               "starting with n=0 (0, 62, 34, 16, 8, ...))"
+        self.assertEqual(self.json[name], list(self.nbtfile[name].value))
+
+    def testUncompressed(self):
+        data = GzipFile(NBTTESTFILE).read()
+        out = StringIO()
+        write_json(BytesIO(data), out)
+        self.assertEqual(json.loads(out.getvalue()), self.json)
+
+    def testTyped(self):
+        out = StringIO()
+        write_json_file(NBTTESTFILE, out, typed=True)
+        typed = json.loads(out.getvalue())
+        self.assertEqual(typed["type"], "compound")
+        self.assertEqual(typed["value"]["shortTest"],
+                         {"type": "short", "value": 32767})
+        longs = typed["value"]["listTest (long)"]
+        self.assertEqual(longs["elementType"], "long")
+        self.assertEqual(longs["value"][0], {"type": "long", "value": 11})
+
+
+class ExportValuesTest(unittest.TestCase):
+    """Test JSON output of special values"""
+
+    def testSignedBytes(self):
+        nbtfile = NBTFile()
+        nbtfile.tags.append(TAG_Byte_Array(name="a", value=[0, 127, 128, 255]))
+        self.assertEqual(to_json(nbtfile), {"a": [0, 127, -128, -1]})
+
+    def testNonFinite(self):
+        nbtfile = NBTFile()
+        nbtfile.tags.append(TAG_Float(name="nan", value=float("nan")))
+        nbtfile.tags.append(TAG_Float(name="inf", value=float("inf")))
+        self.assertEqual(to_json(nbtfile), {"nan": None, "inf": None})
+
+    def testEmpty(self):
+        nbtfile = NBTFile()
+        nbtfile.tags.append(TAG_List(name="list", type=TAG_Compound))
+        nbtfile.tags.append(TAG_Compound(name="compound"))
+        self.assertEqual(to_json(nbtfile), {"list": [], "compound": {}})
+        self.assertEqual(to_json(nbtfile, typed=True)["value"]["list"],
+                         {"type": "list", "elementType": "compound",
+                          "value": []})
+
+    def testTruncated(self):
+        data = GzipFile(NBTTESTFILE).read()
+        self.assertRaises(MalformedFileError, write_json,
+                          BytesIO(data[:-10]), StringIO())
+
+    def testInvalidString(self):
+        data = b"\x0A\0\0\x08\0\x01s\0\x02\xff\xfe\0"
+        self.assertRaises(MalformedFileError, write_json, BytesIO(data),
+                          StringIO())
+
+    def testLimits(self):
+        data = GzipFile(NBTTESTFILE).read()
+        self.assertRaises(MalformedFileError, write_json, BytesIO(data),
+                          StringIO(), limits=ParseLimits(max_depth=2))
+
+
+class RegionExportTest(unittest.TestCase):
+    """Test JSON Lines output of a region file"""
+
+    def setUp(self):
+        self.region = RegionFile(REGIONTESTFILE)
+
+    def tearDown(self):
+        self.region.close()
+
+    def testLines(self):
+        out = StringIO()
+        write_region_jsonl(self.region, out)
+        lines = out.getvalue().splitlines()
+        chunks = list(self.region.iter_chunks())
+        self.assertEqual(len(lines), len(chunks))
+        for line, chunk in zip(lines, chunks):
+            record = json.loads(line)
+            self.assertEqual(record["x"] + 32 * (self.region.loc.x or 0),
+                             chunk.loc.x)
+            self.assertEqual(sorted(record["data"].keys()),
+                             sorted(chunk.keys()))
+
+    def testCorruptChunks(self):
+        """Chunks with an invalid string or truncated data are skipped."""
+        region = RegionFile(fileobj=BytesIO())
+        region.write_blockdata(0, 0, b"\x0A\0\0\x03\0\x01a\0\0\0\x01\0")
+        region.write_blockdata(1, 0, b"\x0A\0\0\x08\0\x01s\0\x02\xff\xfe\0")
+        region.write_blockdata(2, 0, b"\x0A\0\0\x03\0\x01a\0\0")
+        region.write_blockdata(3, 0, b"\x0A\0\0\x0B\0\x01a\0\0\0\x02\0\0")
+        out = StringIO()
+        write_region_jsonl(region, out)
+        self.assertEqual([json.loads(line) for line in out.getvalue().splitlines()],
+                         [{"x": 0, "z": 0, "timestamp": region.metadata[0, 0].timestamp,
+                           "data": {"a": 1}}])
+
+
+if __name__ == '__main__':
+    unittest.main()
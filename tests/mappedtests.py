@@ -0,0 +1,146 @@
+#!/usr/bin/env python
+import sys,os
+import tempfile, shutil
+from gzip import GzipFile
+
+import unittest
+try:
+    from unittest import skip as _skip
+except ImportError:
+    # Python 2.6 has an older unittest API. The backported package is available from pypi.
+    import unittest2 as unittest
+
+# Search parent directory first, to make sure we test the local nbt module, 
+# not an installed nbt module.
+parentdir = os.path.realpath(os.path.join(os.path.dirname(__file__),os.pardir))
+if parentdir not in sys.path:
+    sys.path.insert(1, parentdir)  # insert ../ just after ./
+
+from nbt.nbt import NBTFile, MalformedFileError, \
+    TAG_COMPOUND, TAG_LONG
+from nbt.mapped import MappedNBTFile, INDEX_SUFFIX
+
+NBTTESTFILE = os.path.join(os.path.dirname(__file__), 'bigtest.nbt')
+
+
+class MappedTest(unittest.TestCase):
+    """Test path lookups in an uncompressed copy of bigtest.nbt"""
+    index = False
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tempdir, 'bigtest.nbt')
+        with open(self.filename, 'wb') as f:
+            f.write(GzipFile(NBTTESTFILE).read())
+        self.mapped = MappedNBTFile(self.filename, index=self.index)
+        self.nbtfile = NBTFile(NBTTESTFILE)
+
+    def tearDown(self):
+        self.mapped.close()
+        shutil.rmtree(self.tempdir)
+
+    def testRoot(self):
+        root = self.mapped.root
+        self.assertEqual(root.id, TAG_COMPOUND)
+        self.assertEqual(root.name, "Level")
+        self.assertEqual(self.mapped.name, "Level")
+        self.assertEqual(sorted(root.keys()), sorted(self.nbtfile.keys()))
+
+    def testFind(self):
+        tag = self.mapped.find("nested compound test/egg/value")
+        self.assertEqual(tag.value(), 0.5)
+        tag = self.mapped.find(["listTest (long)", 3])
+        self.assertEqual(tag.id, TAG_LONG)
+        self.assertEqual(tag.value(), 14)
+        self.assertIsNone(self.mapped.find("nonexistent/path"))
+        self.assertIsNone(self.mapped.find("listTest (long)/5"))
+        self.assertIsNone(self.mapped.find("shortTest/value"))
+
+    def testValues(self):
+        for name in ("byteTest", "shortTest", "intTest", "longTest",
+                     "floatTest", "doubleTest", "stringTest"):
+            self.assertEqual(self.mapped.find(name).value(),
+                             self.nbtfile[name].value)
+        name = "byteArrayTest (the first 1000 values of (n*n*255+n*7)%100, " \
+               "starting with n=0 (0, 62, 34, 16, 8, ...))"
+        array = self.mapped.find([name])
+        self.assertEqual(len(array), 1000)
+        self.assertEqual(array.value(), self.nbtfile[name].value)
+
+    def testIterList(self):
+        values = [tag.value() for tag in
+                  self.mapped.iter_list("listTest (long)")]
+        self.assertEqual(values, [11, 12, 13, 14, 15])
+        compounds = list(self.mapped.iter_list("listTest (compound)"))
+        self.assertEqual([c["name"].value() for c in compounds],
+                         ["Compound tag #0", "Compound tag #1"])
+        self.assertRaises(KeyError, self.mapped.iter_list, "nonexistent")
+        self.assertRaises(TypeError, self.mapped.iter_list, "intTest")
+
+    def testToTag(self):
+        tag = self.mapped.find("listTest (compound)").to_tag()
+        self.assertEqual(tag.pretty_tree(),
+                         self.nbtfile["listTest (compound)"].pretty_tree())
+
+
+class IndexedMappedTest(MappedTest):
+    """Test path lookups using an index sidecar file"""
+    index = True
+
+    def testSidecar(self):
+        indexfile = self.filename + INDEX_SUFFIX
+        self.assertTrue(os.path.exists(indexfile))
+        self.assertIsNotNone(self.mapped.arena)
+        self.assertEqual(len(self.mapped.arena), 29)
+        mtime = os.stat(indexfile).st_mtime
+        with MappedNBTFile(self.filename, index=True) as mapped:
+            self.assertEqual(mapped.find("intTest").value(), 2147483647)
+        self.assertEqual(os.stat(indexfile).st_mtime, mtime)
+
+    def testInvalidSidecar(self):
+        indexfile = os.path.join(self.tempdir, 'custom.idx')
+        with open(indexfile, 'wb') as f:
+            f.write(b"garbage")
+        with MappedNBTFile(self.filename, index=indexfile) as mapped:
+            self.assertEqual(len(mapped.arena), 29)
+            self.assertEqual(mapped.find("shortTest").value(), 32767)
+        with open(indexfile, 'rb') as f:
+            self.assertNotEqual(f.read(), b"garbage")
+
+
+class MalformedMappedTest(unittest.TestCase):
+    """Test that invalid files are rejected"""
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tempdir, 'test.nbt')
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def write(self, data):
+        with open(self.filename, 'wb') as f:
+            f.write(data)
+
+    def testCompressed(self):
+        shutil.copy(NBTTESTFILE, self.filename)
+        self.assertRaises(MalformedFileError, MappedNBTFile, self.filename)
+
+    def testEmpty(self):
+        self.write(b"")
+        self.assertRaises(MalformedFileError, MappedNBTFile, self.filename)
+
+    def testNotCompound(self):
+        self.write(b"\x01\0\0\x05")
+        self.assertRaises(MalformedFileError, MappedNBTFile, self.filename)
+
+    def testTruncated(self):
+        self.write(b"\x0A\0\0\x07\0\x01a\0\0\0\x10ab\x01\0\x01b\x05\0")
+        with MappedNBTFile(self.filename) as mapped:
+            self.assertRaises(MalformedFileError, mapped.find, "b")
+        self.assertRaises(MalformedFileError, MappedNBTFile, self.filename,
+                          index=True)
+
+
+if __name__ == '__main__':
+    unittest.main()
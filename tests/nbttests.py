@@ -17,7 +17,18 @@ parentdir = os.path.realpath(os.path.join(os.path.dirname(__file__),os.pardir))
 if parentdir not in sys.path:
     sys.path.insert(1, parentdir)  # insert ../ just after ./
 
-from nbt.nbt import _TAG_Numeric, TAG_Int, MalformedFileError, NBTFile, TAGLIST
+from nbt.nbt import _TAG_Numeric, TAG_Int, MalformedFileError, NBTFile, TAGLIST, \
+    ParseLimits, TAG_Compound, TAG_List, TAG_String, TAG_Byte, TAG_Short, \
+    TAG_Long, TAG_Double, TAG_Byte_Array, TAG_Int_Array, TAG_Long_Array, \
+    from_python, pretty_print, _array_to_bytes, _LimitedReader
+from nbt import nbt
+from array import array
+import pickle
+from io import StringIO
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 NBTTESTFILE = os.path.join(os.path.dirname(__file__), 'bigtest.nbt')
 
@@ -126,5 +137,391 @@ class EmptyStringTest(unittest.TestCase):
         self.nbtfile.write_file(buffer=buffer)
         self.assertEqual(buffer.getvalue(), self.golden_value)
 
+class ParseLimitsTest(unittest.TestCase):
+    """Test that corrupt lengths fail fast with a MalformedFileError."""
+
+    def parse(self, data, limits=None):
+        return NBTFile(buffer=BytesIO(data), limits=limits)
+
+    def testHugeByteArray(self):
+        # TAG_Byte_Array claiming 2 GiB, followed by only 3 bytes.
+        data = b"\x0A\0\0\x07\0\x01a\x7f\xff\xff\xff\x01\x02\x03"
+        self.assertRaises(MalformedFileError, self.parse, data)
+
+    def testHugeIntArray(self):
+        data = b"\x0A\0\0\x0B\0\x01a\x10\0\0\0\0\0\0\x01\0"
+        self.assertRaises(MalformedFileError, self.parse, data)
+
+    def testNegativeLength(self):
+        data = b"\x0A\0\0\x0C\0\x01a\xff\xff\xff\xff\0"
+        self.assertRaises(MalformedFileError, self.parse, data)
+
+    def testHugeList(self):
+        # List of 2**31-1 TAG_Byte elements
+        data = b"\x0A\0\0\x09\0\x01a\x01\x7f\xff\xff\xff\0\0"
+        self.assertRaises(MalformedFileError, self.parse, data)
+
+    def testMaxLength(self):
+        data = b"\x0A\0\0\x07\0\x01a\0\0\0\x04abcd\0"
+        self.assertEqual(len(self.parse(data)["a"]), 4)
+        limits = ParseLimits(max_length=3)
+        self.assertRaises(MalformedFileError, self.parse, data, limits)
+
+    def testMaxStringLength(self):
+        data = b"\x0A\0\0\x08\0\x01a\0\x05hello\0"
+        self.assertEqual(self.parse(data)["a"].value, "hello")
+        limits = ParseLimits(max_string_length=4)
+        self.assertRaises(MalformedFileError, self.parse, data, limits)
+
+    def testMaxDepth(self):
+        # 3 nested compounds (including the root compound)
+        data = b"\x0A\0\0\x0A\0\x01a\x0A\0\x01b\0\0\0"
+        self.parse(data, ParseLimits(max_depth=3))
+        self.assertRaises(MalformedFileError, self.parse, data,
+                          ParseLimits(max_depth=2))
+
+    def testMaxBytes(self):
+        data = b"\x0A\0\0\x07\0\x01a\0\0\0\x04abcd\0"
+        self.parse(data, ParseLimits(max_bytes=len(data)))
+        self.assertRaises(MalformedFileError, self.parse, data,
+                          ParseLimits(max_bytes=len(data) - 1))
+
+    def testDirectRead(self):
+        """Without max_bytes, reads are not counted by a wrapper."""
+        buffer = BytesIO(b"\0")
+        self.assertEqual(_LimitedReader(buffer, ParseLimits()).read,
+                         buffer.read)
+
+    def testDepthAfterError(self):
+        """The nesting depth is restored if parsing a compound fails."""
+        # compound with a list of 2**31-1 TAG_Byte elements
+        reader = _LimitedReader(BytesIO(b"\x09\0\x01a\x01\x7f\xff\xff\xff"),
+                                ParseLimits())
+        self.assertRaises(MalformedFileError, TAG_Compound, buffer=reader)
+        self.assertEqual(reader.depth, 0)
+
+    def testBigTest(self):
+        mynbt = NBTFile(NBTTESTFILE, limits=ParseLimits(max_depth=4))
+        self.assertEqual(len(mynbt.tags), 11)
+
+
+class WalkTest(unittest.TestCase):
+    """Test TAG.walk() and TAG.find_all()"""
+
+    def setUp(self):
+        self.nbtfile = NBTFile(NBTTESTFILE)
+
+    def testWalkOrder(self):
+        paths = [path for path, tag in self.nbtfile.walk()]
+        self.assertEqual(len(paths), 29)
+        self.assertEqual(paths[0], ())
+        self.assertEqual(paths[1], ("longTest",))
+        self.assertEqual(paths[7], ("nested compound test", "ham"))
+        self.assertEqual(paths[21], ("listTest (compound)", 0, "name"))
+
+    def testWalkPrune(self):
+        prune = lambda path, tag: isinstance(tag, TAG_List)
+        paths = [path for path, tag in self.nbtfile.walk(prune)]
+        self.assertIn(("listTest (long)",), paths)
+        self.assertNotIn(("listTest (long)", 0), paths)
+        self.assertIn(("nested compound test", "ham", "name"), paths)
+
+    def testWalkDeep(self):
+        # The walker uses an explicit stack, not recursion.
+        root = tag = TAG_Compound(name="root")
+        for i in range(2 * sys.getrecursionlimit()):
+            child = TAG_Compound()
+            tag["child"] = child
+            tag = child
+        self.assertEqual(sum(1 for _ in root.walk()),
+                         2 * sys.getrecursionlimit() + 1)
+
+    def testFindAllByName(self):
+        names = [tag.value for tag in self.nbtfile.find_all(name="name")]
+        self.assertEqual(names, ["Hampus", "Eggbert",
+                                 "Compound tag #0", "Compound tag #1"])
+
+    def testFindAllByPredicate(self):
+        compounds = self.nbtfile.find_all(
+            predicate=lambda tag: isinstance(tag, TAG_Compound) and
+            "name" in tag and tag["name"].value == "Eggbert")
+        self.assertEqual(len(compounds), 1)
+        self.assertEqual(compounds[0].name, "egg")
+
+    def testFindAllPrune(self):
+        prune = lambda path, tag: path == ("listTest (compound)",)
+        self.assertEqual(len(self.nbtfile.find_all("name", prune=prune)), 2)
+
+
+class ValueConstructorTest(unittest.TestCase):
+    """Test the value parameter of collection tags"""
+
+    def roundtrip(self, tag):
+        root = NBTFile()
+        root.tags.append(tag)
+        buffer = BytesIO()
+        root.write_file(buffer=buffer)
+        buffer.seek(0)
+        return NBTFile(buffer=buffer)[tag.name]
+
+    def testByteArray(self):
+        self.assertEqual(TAG_Byte_Array(value=b"\x01\x02").value,
+                         bytearray(b"\x01\x02"))
+        self.assertEqual(TAG_Byte_Array(value=array('b', [-1, 2])).value,
+                         bytearray(b"\xff\x02"))
+        self.assertEqual(TAG_Byte_Array(value=[-1, 2]).value,
+                         bytearray(b"\xff\x02"))
+
+    def testIntArray(self):
+        tag = TAG_Int_Array(name="ints", value=array('i', [1, -2, 3]))
+        self.assertIsInstance(tag.value, array)
+        self.assertEqual(tag.value.tolist(), [1, -2, 3])
+        self.assertEqual(self.roundtrip(tag).value, [1, -2, 3])
+
+    def testArrayRender(self):
+        """Array values are written in bulk, not with a per-element Struct."""
+        tag = TAG_Long_Array(name="longs", value=array('q', [1, -2, 2**40]))
+        calls = []
+        def wrapper(value):
+            calls.append(value)
+            return _array_to_bytes(value)
+        nbt._array_to_bytes = wrapper
+        try:
+            self.assertEqual(self.roundtrip(tag).value, [1, -2, 2**40])
+        finally:
+            nbt._array_to_bytes = _array_to_bytes
+        self.assertEqual(len(calls), 1)
+        self.assertIs(calls[0], tag.value)
+
+    def testArrayOverflow(self):
+        self.assertRaises(ValueError, TAG_Int_Array, value=array('q', [2**40]))
+        self.assertRaises(ValueError, TAG_Int_Array, value=array('I', [2**32 - 1]))
+        self.assertRaises(ValueError, TAG_Long_Array, value=array('Q', [2**64 - 1]))
+        self.assertEqual(TAG_Long_Array(value=array('I', [2**32 - 1])).value.tolist(),
+                         [2**32 - 1])
+
+    @unittest.skipIf(numpy is None, "NumPy is not installed")
+    def testNumpyArray(self):
+        tag = TAG_Int_Array(value=numpy.arange(3, dtype=numpy.int64))
+        self.assertEqual(tag.value.tolist(), [0, 1, 2])
+        self.assertRaises(ValueError, TAG_Int_Array,
+                          value=numpy.array([2**40], dtype=numpy.int64))
+        self.assertRaises(ValueError, TAG_Long_Array,
+                          value=numpy.array([2**64 - 1], dtype=numpy.uint64))
+        self.assertRaises(ValueError, TAG_Int_Array,
+                          value=numpy.zeros((2, 2), dtype=numpy.int32))
+        self.assertEqual(len(TAG_Long_Array(value=numpy.array([], dtype=numpy.uint64))), 0)
+
+    def testLongArray(self):
+        values = array('q', range(-2048, 2048))
+        tag = TAG_Long_Array(name="longs", value=values)
+        self.assertEqual(self.roundtrip(tag).value, list(values))
+        tag = TAG_Long_Array(name="longs", value=[2**40, -1])
+        self.assertEqual(self.roundtrip(tag).value, [2**40, -1])
+
+    def testCompound(self):
+        tag = TAG_Compound(name="c", value={"a": TAG_Int(1), "b": TAG_Byte(2)})
+        self.assertEqual(tag.keys(), ["a", "b"])
+        self.assertEqual(tag["b"].name, "b")
+        tag = TAG_Compound(value=[TAG_Int(1, name="x")])
+        self.assertEqual(tag["x"].value, 1)
+        self.assertRaises(AssertionError, TAG_Compound, value={"a": 1})
+
+    def testList(self):
+        tag = TAG_List(name="l", value=[TAG_Short(1), TAG_Short(2)])
+        self.assertEqual(tag.tagID, TAG_Short.id)
+        self.assertEqual([t.value for t in self.roundtrip(tag)], [1, 2])
+
+
+class FromPythonTest(unittest.TestCase):
+    """Test the from_python() builder"""
+
+    def testPackage(self):
+        """from_python is available from the nbt package."""
+        import nbt as package
+        self.assertIs(package.from_python, from_python)
+
+    def testScalars(self):
+        tag = from_python({"i": 1, "l": 2**40, "d": 0.5, "s": "text", "b": True})
+        self.assertEqual([type(t) for t in tag.tags],
+                         [TAG_Int, TAG_Long, TAG_Double, TAG_String, TAG_Byte])
+        self.assertEqual(tag["s"].value, "text")
+
+    def testArrays(self):
+        tag = from_python({"b": b"\x00\x01", "i": array('i', [1]),
+                           "l": array('q', [1])})
+        self.assertEqual([type(t) for t in tag.tags],
+                         [TAG_Byte_Array, TAG_Int_Array, TAG_Long_Array])
+
+    def testLists(self):
+        tag = from_python({"ints": [1, 2**40], "empty": [], "nested": [[1]]})
+        self.assertEqual(tag["ints"].tagID, TAG_Long.id)
+        self.assertEqual(tag["ints"][0].value, 1)
+        self.assertEqual(len(tag["empty"]), 0)
+        self.assertEqual(tag["nested"].tagID, TAG_List.id)
+        self.assertRaises(TypeError, from_python, [1, "text"])
+
+    def testSchema(self):
+        schema = {"xPos": TAG_Short, "Sections": [{"Y": TAG_Byte}],
+                  "Heights": TAG_Long_Array}
+        tag = from_python({"xPos": 3, "Sections": [{"Y": 0, "Name": "air"}],
+                           "Heights": [1, 2]}, schema, name="Level")
+        self.assertEqual(tag.name, "Level")
+        self.assertIsInstance(tag["xPos"], TAG_Short)
+        self.assertIsInstance(tag["Sections"][0]["Y"], TAG_Byte)
+        self.assertIsInstance(tag["Sections"][0]["Name"], TAG_String)
+        self.assertIsInstance(tag["Heights"], TAG_Long_Array)
+
+    def testTags(self):
+        existing = TAG_Short(5, name="s")
+        tag = from_python({"s": existing})
+        self.assertIs(tag["s"], existing)
+
+    def testRenamedTag(self):
+        """A tag with another name is copied, not renamed."""
+        existing = TAG_Short(5, name="old")
+        tag = from_python({"s": existing})
+        self.assertEqual(tag["s"].value, 5)
+        self.assertEqual(existing.name, "old")
+
+    def testWrite(self):
+        root = NBTFile()
+        root.tags = from_python({"a": [{"b": 1.5}], "c": b"\x01"}).tags
+        buffer = BytesIO()
+        root.write_file(buffer=buffer)
+        buffer.seek(0)
+        self.assertEqual(NBTFile(buffer=buffer)["a"][0]["b"].value, 1.5)
+
+    @unittest.skipIf(numpy is None, "NumPy is not installed")
+    def testNumpy(self):
+        tag = from_python({"b": numpy.arange(4, dtype=numpy.int8),
+                           "i": numpy.arange(4, dtype=numpy.int32),
+                           "l": numpy.arange(4, dtype=numpy.int64),
+                           "f": numpy.float32(0.5),
+                           "d": numpy.arange(2, dtype=numpy.float64)})
+        self.assertIsInstance(tag["b"], TAG_Byte_Array)
+        self.assertEqual(list(tag["i"]), [0, 1, 2, 3])
+        self.assertIsInstance(tag["l"], TAG_Long_Array)
+        self.assertEqual(tag["f"].id, 5)
+        self.assertEqual(tag["d"].tagID, TAG_Double.id)
+
+
+class FreezeTest(unittest.TestCase):
+    """Test frozen (immutable) trees"""
+
+    def setUp(self):
+        self.nbtfile = NBTFile(NBTTESTFILE)
+        self.frozen = self.nbtfile.freeze()
+
+    def testEqualAndHashable(self):
+        other = NBTFile(NBTTESTFILE).freeze()
+        self.assertEqual(self.frozen, other)
+        self.assertEqual(hash(self.frozen), hash(other))
+        cache = {self.frozen: 1}
+        self.assertEqual(cache[other], 1)
+
+    def testDifferent(self):
+        self.nbtfile["intTest"].value = 1
+        self.assertNotEqual(self.nbtfile.freeze(), self.frozen)
+        a = TAG_Int(1, name="a").freeze()
+        self.assertNotEqual(a, TAG_Int(1, name="b").freeze())
+        self.assertNotEqual(a, TAG_Long(1, name="a").freeze())
+
+    def testImmutable(self):
+        self.assertRaises(AttributeError, setattr, self.frozen, "name", "x")
+        self.assertIsInstance(self.frozen.value, tuple)
+        array = self.frozen["byteArrayTest (the first 1000 values of "
+                            "(n*n*255+n*7)%100, starting with n=0 "
+                            "(0, 62, 34, 16, 8, ...))"]
+        self.assertIsInstance(array.value, bytes)
+
+    def testAccess(self):
+        self.assertEqual(self.frozen["nested compound test"]["egg"]["name"].value,
+                         "Eggbert")
+        self.assertEqual(self.frozen["listTest (long)"][1].value, 12)
+        self.assertEqual(self.frozen.keys(), self.nbtfile.keys())
+        self.assertRaises(KeyError, self.frozen.__getitem__, "nonexisting")
+
+    def testThaw(self):
+        thawed = self.frozen.thaw()
+        self.assertEqual(str(thawed), str(self.nbtfile))
+        self.assertEqual(thawed.name, "Level")
+        thawed["intTest"].value = 1
+        self.assertEqual(self.frozen["intTest"].value, 2147483647)
+        buffer = BytesIO()
+        thawed.write_file(buffer=buffer)
+        self.assertEqual(len(buffer.getvalue()), len(GzipFile(NBTTESTFILE).read()))
+
+    def testThawClass(self):
+        """A thawed NBTFile is an NBTFile with the same filename."""
+        thawed = self.frozen.thaw()
+        self.assertIsInstance(thawed, NBTFile)
+        self.assertEqual(thawed.filename, NBTTESTFILE)
+        self.assertIsInstance(thawed["nested compound test"], TAG_Compound)
+        self.assertNotIsInstance(thawed["nested compound test"], NBTFile)
+        compound = TAG_Compound(name="Level", value=list(self.nbtfile.tags))
+        self.assertEqual(compound.freeze(), self.frozen)
+        self.assertNotIsInstance(compound.freeze().thaw(), NBTFile)
+        unpickled = pickle.loads(pickle.dumps(self.frozen))
+        self.assertEqual(unpickled.thaw().filename, NBTTESTFILE)
+
+    def testPickle(self):
+        self.assertEqual(pickle.loads(pickle.dumps(self.frozen)), self.frozen)
+
+
+class PrettyPrintTest(unittest.TestCase):
+    """Test incremental printing of trees with pretty_print()"""
+
+    def setUp(self):
+        self.nbtfile = NBTFile(NBTTESTFILE)
+
+    def pretty_print(self, tree, **kwargs):
+        output = StringIO()
+        pretty_print(tree, output, **kwargs)
+        return output.getvalue()
+
+    def testSameAsPrettyTree(self):
+        self.assertEqual(self.pretty_print(self.nbtfile),
+                         self.nbtfile.pretty_tree() + "\n")
+        tag = TAG_Int(3, name="x")
+        self.assertEqual(self.pretty_print(tag, indent=1),
+                         tag.pretty_tree(1) + "\n")
+
+    def testPrettyTree(self):
+        lines = self.nbtfile["listTest (compound)"].pretty_tree(1).split("\n")
+        self.assertEqual(lines[0], "\tTAG_List('listTest (compound)'): "
+                                   "[2 TAG_Compound(s)]")
+        self.assertEqual(lines[1], "\t{")
+        self.assertEqual(lines[3], "\t\t{")
+        self.assertEqual(lines[-1], "\t}")
+        self.assertEqual(TAG_Compound(name="x").pretty_tree(),
+                         "TAG_Compound('x'): {0 Entries}")
+
+    def testMaxDepth(self):
+        self.assertEqual(self.pretty_print(self.nbtfile, max_depth=0),
+                         self.nbtfile.tag_info() + "\n")
+        lines = self.pretty_print(self.nbtfile, max_depth=1).splitlines()
+        self.assertEqual(len(lines), len(self.nbtfile.tags) + 3)
+        self.assertIn("\tTAG_Compound('nested compound test'): {2 Entries}",
+                      lines)
+
+    def testMaxItems(self):
+        tag = TAG_List(name="big", type=TAG_Int,
+                       value=[TAG_Int(i) for i in range(1000)])
+        lines = self.pretty_print(tag, max_items=3).splitlines()
+        self.assertEqual(lines, ["TAG_List('big'): [1000 TAG_Int(s)]", "{",
+                                 "\tTAG_Int: 0", "\tTAG_Int: 1",
+                                 "\tTAG_Int: 2", "\t... (997 more)", "}"])
+
+    def testDeepTree(self):
+        root = tag = TAG_Compound(name="root")
+        for i in range(2000):
+            child = TAG_Compound(name="c")
+            tag.tags.append(child)
+            tag = child
+        lines = self.pretty_print(root).splitlines()
+        self.assertEqual(len(lines), 1 + 2000 + 2 * 2000)
+
+
 if __name__ == '__main__':
     unittest.main()
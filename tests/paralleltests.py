@@ -0,0 +1,122 @@
+#!/usr/bin/env python
+import sys,os
+from io import BytesIO
+
+import unittest
+try:
+    from unittest import skip as _skip
+except ImportError:
+    # Python 2.6 has an older unittest API. The backported package is available from pypi.
+    import unittest2 as unittest
+
+# Search parent directory first, to make sure we test the local nbt module, 
+# not an installed nbt module.
+parentdir = os.path.realpath(os.path.join(os.path.dirname(__file__),os.pardir))
+if parentdir not in sys.path:
+    sys.path.insert(1, parentdir)  # insert ../ just after ./
+
+from nbt.nbt import NBTFile, MalformedFileError, ParseLimits, \
+    TAG_Compound, TAG_List, TAG_Int, TAG_String, TAG_Double
+from nbt.parallel import parse_parallel, ProcessPoolExecutor
+from nbt import parallel
+try:
+    from concurrent.futures import ThreadPoolExecutor
+except ImportError:
+    ThreadPoolExecutor = None
+
+NBTTESTFILE = os.path.join(os.path.dirname(__file__), 'bigtest.nbt')
+
+
+def entities_file(count=500):
+    """Return an NBTFile with a large list of compounds"""
+    nbtfile = NBTFile()
+    nbtfile.name = "Schematic"
+    nbtfile.tags.append(TAG_Int(name="Width", value=16))
+    entities = TAG_List(name="Entities", type=TAG_Compound)
+    for i in range(count):
+        entity = TAG_Compound()
+        entity.tags.append(TAG_String(name="id", value="mob%d" % (i % 7)))
+        pos = TAG_List(name="Pos", type=TAG_Double)
+        pos.tags.extend(TAG_Double(i + 0.5 * j) for j in range(3))
+        entity.tags.append(pos)
+        entities.tags.append(entity)
+    nbtfile.tags.append(entities)
+    nbtfile.tags.append(TAG_String(name="Author", value="test"))
+    return nbtfile
+
+
+class ParallelParseTest(unittest.TestCase):
+    """Test that parse_parallel() gives the same tree as NBTFile()"""
+
+    def setUp(self):
+        self.nbtfile = entities_file()
+        buffer = BytesIO()
+        self.nbtfile.write_file(buffer=buffer)
+        self.data = buffer.getvalue()
+
+    def assertSameTree(self, nbtfile):
+        self.assertEqual(nbtfile.name, self.nbtfile.name)
+        self.assertEqual(nbtfile.pretty_tree(), self.nbtfile.pretty_tree())
+
+    def testSerial(self):
+        self.assertSameTree(parse_parallel(buffer=self.data, workers=1,
+                                           min_size=0))
+
+    def testSmallList(self):
+        self.assertSameTree(parse_parallel(buffer=BytesIO(self.data),
+                                           workers=4))
+
+    @unittest.skipIf(ThreadPoolExecutor is None, "concurrent.futures missing")
+    def testExecutor(self):
+        with ThreadPoolExecutor(max_workers=3) as executor:
+            nbtfile = parse_parallel(buffer=self.data, workers=3, min_size=0,
+                                     executor=executor)
+        self.assertSameTree(nbtfile)
+        self.assertEqual(len(nbtfile["Entities"]), 500)
+
+    @unittest.skipIf(ProcessPoolExecutor is None, "concurrent.futures missing")
+    def testProcessPool(self):
+        # Pass the pool explicitly, so it is also used with a single CPU.
+        with ProcessPoolExecutor(max_workers=2) as executor:
+            self.assertSameTree(parse_parallel(buffer=self.data, workers=2,
+                                               min_size=0, executor=executor))
+
+    def testSingleCPU(self):
+        """With one CPU, no process pool is created."""
+        def no_pool(*args, **kwargs):
+            raise AssertionError("process pool created")
+        cpu_count, pool = parallel._cpu_count, parallel.ProcessPoolExecutor
+        parallel._cpu_count = lambda: 1
+        parallel.ProcessPoolExecutor = no_pool
+        try:
+            self.assertSameTree(parse_parallel(buffer=self.data, workers=4,
+                                               min_size=0))
+        finally:
+            parallel._cpu_count, parallel.ProcessPoolExecutor = cpu_count, pool
+
+    def testGzipFile(self):
+        nbtfile = parse_parallel(NBTTESTFILE, workers=1, min_size=0)
+        self.assertEqual(nbtfile.pretty_tree(),
+                         NBTFile(NBTTESTFILE).pretty_tree())
+
+    def testTruncated(self):
+        self.assertRaises(MalformedFileError, parse_parallel,
+                          buffer=self.data[:-100], workers=1, min_size=0)
+
+    def testTrailingData(self):
+        self.assertRaises(MalformedFileError, parse_parallel,
+                          buffer=self.data + b"\0", workers=1)
+
+    def testLimits(self):
+        self.assertRaises(MalformedFileError, parse_parallel,
+                          buffer=self.data, workers=1, min_size=0,
+                          limits=ParseLimits(max_length=100))
+        self.assertRaises(MalformedFileError, parse_parallel,
+                          buffer=self.data, workers=1, min_size=0,
+                          limits=ParseLimits(max_depth=3))
+        parse_parallel(buffer=self.data, workers=1, min_size=0,
+                       limits=ParseLimits(max_depth=4))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -6,6 +6,8 @@ import logging
 import random
 import time
 import zlib
+import codecs
+from struct import pack
 
 import unittest
 try:
@@ -24,8 +26,11 @@ if parentdir not in sys.path:
     sys.path.insert(1, parentdir) # insert ../ just after ./
 
 from nbt.region import RegionFile, RegionFileFormatError, NoRegionHeader, \
-    RegionHeaderError, ChunkHeaderError, ChunkDataError, InconceivedChunk
-from nbt.nbt import NBTFile, TAG_Compound, TAG_Byte_Array, TAG_Long, TAG_Int, TAG_String
+    RegionHeaderError, ChunkHeaderError, ChunkDataError, InconceivedChunk, \
+    ChunkMetadata, ChunkCache, Location, _SectorMap, COMPACT_ZORDER, \
+    STATUS_CHUNK_OK
+from nbt.nbt import NBTFile, TAG_Compound, TAG_Byte_Array, TAG_Long, TAG_Int, TAG_String, \
+    TAG_Int_Array
 
 REGIONTESTFILE = os.path.join(os.path.dirname(__file__), 'regiontest.mca')
 
@@ -146,7 +151,7 @@ class ReadWriteTest(unittest.TestCase):
     sector 005: chunk 8 ,0  part 1/1
     sector 006: chunk 9 ,0  part 1/1
     sector 007: chunk 10,0  part 1/1 <<-- deprecated encoding (gzip = 1)
-    sector 008: chunk 11,0  part 1/1 <<-- unknown encoding (3)
+    sector 008: chunk 11,0  part 1/1 <<-- uncompressed (3), but contains zlib data
     sector 009: chunk 2 ,0  part 1/1 <<-- uncompressed (encoding 0)
     sector 010: empty
     sector 011: empty
@@ -182,7 +187,7 @@ class ReadWriteTest(unittest.TestCase):
     07. chunk 8 ,0  Readable 
     08. chunk 9 ,0  Readable 
     09. chunk 10,0  Readable   <<-- deprecated encoding (gzip = 1)
-    10. chunk 11,0  Unreadable <<-- unknown encoding (3)
+    10. chunk 11,0  Unreadable <<-- uncompressed (3), but not an NBT file
     11. chunk 12,0  Readable   <<-- Overlaps with chunk 4,0.
     12. chunk 13,0  Unreadable <<-- 0-sector length in header
     13. chunk 14,0  Unreadable <<-- in header
@@ -322,7 +327,8 @@ class ReadWriteTest(unittest.TestCase):
 
     def test013ReadUnknownEncoding(self):
         """
-        chunk 11,0 has unknown encoding (3). Reading should raise a ChunkDataError.
+        chunk 11,0 is marked as uncompressed (3), but contains zlib data.
+        Reading should raise a ChunkDataError.
         """
         self.assertRaises(ChunkDataError, self.region.get_nbt, 11, 0)
 
@@ -367,7 +373,7 @@ class ReadWriteTest(unittest.TestCase):
         self.assertIn((8, 0), coords)
         self.assertIn((9, 0), coords)
         self.assertIn((10, 0), coords)
-        self.assertNotIn((11, 0), coords) # unknown encoding
+        self.assertNotIn((11, 0), coords) # not an NBT file
         self.assertIn((12, 0), coords) # readable, despite overlapping with chunk 4,1
         self.assertNotIn((13, 0), coords) # zero-length (in header)
         self.assertNotIn((14, 0), coords) # in header
@@ -721,7 +727,7 @@ class ReadWriteTest(unittest.TestCase):
         self.assertEqual(header[1], 3, "Chunk length must be 3 sectors")
         self.assertEqual(header[0], 2, "Chunk should be placed in sector 2")
 
-    # TODO: test write_blockdata, with different compressions. Check the metadata. Read the data back.
+    # Writing with different compressions is tested in compressiontests.
 
     def test070WriteOutOfFileChunk(self):
         """
@@ -1286,6 +1292,807 @@ class LengthTest(unittest.TestCase):
 # TODO: check if metadata is updated after deleting or writing a chunk
 # TODO: in tests, replace region.header or region.chunk_headers with region.metadata
 
+class CountingFileWrapper(PedanticFileWrapper):
+    """Pedantic file wrapper, which counts the number of read() calls."""
+    def __init__(self, stream):
+        PedanticFileWrapper.__init__(self, stream)
+        self.reads = 0
+    def read(self, size = -1):
+        self.reads += 1
+        return PedanticFileWrapper.read(self, size)
+
+
+class HeaderParseTest(unittest.TestCase):
+    """Test parsing of the region header."""
+
+    def testSingleRead(self):
+        """The header is read in a single call."""
+        stream = CountingFileWrapper(BytesIO(8192*b'\x00'))
+        region = RegionFile(fileobj=stream)
+        self.assertEqual(stream.reads, 1)
+        self.assertEqual(region.chunk_count(), 0)
+
+    def testCoalescedChunkHeaders(self):
+        """Chunk headers close to each other are read in a single call."""
+        with open(REGIONTESTFILE, 'rb') as f:
+            stream = CountingFileWrapper(BytesIO(f.read()))
+        region = RegionFile(fileobj=stream)
+        # one read for the region header, one for all chunk headers
+        self.assertEqual(stream.reads, 2)
+        reference = RegionFile(REGIONTESTFILE)
+        for xz, m in region.metadata.items():
+            self.assertEqual(str(m), str(reference.metadata[xz]))
+        reference.close()
+
+    def testCoalesce(self):
+        """Runs of chunks are split at large gaps and long spans."""
+        chunks = []
+        for blockstart in [2, 3, 10, 100, 101, 102] + list(range(200, 500, 10)):
+            m = ChunkMetadata(0, 0)
+            m.blockstart = blockstart
+            chunks.append(m)
+        runs = [[m.blockstart for m in run] for run in RegionFile._coalesce(chunks)]
+        self.assertEqual(runs[0], [2, 3, 10])
+        self.assertEqual(runs[1], [100, 101, 102])
+        self.assertEqual(runs[2][0], 200)
+        self.assertTrue(all(run[-1] - run[0] <= 256 for run in runs))
+        self.assertEqual(sum(len(run) for run in runs), len(chunks))
+
+    def testHeaderValues(self):
+        """Locations and timestamps of all chunks are decoded."""
+        with open(REGIONTESTFILE, 'rb') as f:
+            data = f.read()
+        region = RegionFile(fileobj=BytesIO(data))
+        for (x, z), m in region.metadata.items():
+            index = 4 * (x + 32 * z)
+            location = data[index:index + 4]
+            self.assertEqual(m.blockstart, int(codecs.encode(location[:3], 'hex'), 16))
+            self.assertEqual(m.blocklength, bytearray(location)[3])
+            timestamp = data[4096 + index:4096 + index + 4]
+            self.assertEqual(m.timestamp, int(codecs.encode(timestamp, 'hex'), 16))
+
+
+class MappedRegionTest(unittest.TestCase):
+    """Test reading chunks from a memory-mapped region file."""
+
+    def setUp(self):
+        self.region = RegionFile(REGIONTESTFILE)
+        self.mapped = RegionFile(REGIONTESTFILE, mapped=True)
+
+    def tearDown(self):
+        self.region.close()
+        self.mapped.close()
+
+    def testBlockdata(self):
+        """Test if all chunks read the same as without memory map."""
+        for m in self.region.metadata.values():
+            try:
+                data = self.region.get_blockdata(m.x, m.z)
+            except (RegionFileFormatError, InconceivedChunk) as e:
+                self.assertRaises(type(e), self.mapped.get_blockdata, m.x, m.z)
+            else:
+                self.assertEqual(self.mapped.get_blockdata(m.x, m.z), data)
+
+    def testGetRaw(self):
+        raw = self.mapped.get_raw(1, 0)
+        self.assertIsInstance(raw, memoryview)
+        self.assertEqual(zlib.decompress(raw), self.region.get_blockdata(1, 0))
+        self.assertEqual(bytes(self.region.get_raw(1, 0)), bytes(raw))
+        raw.release()
+        self.assertRaises(InconceivedChunk, self.mapped.get_raw, 2, 2)
+
+    def testReadOnly(self):
+        self.assertRaises(IOError, self.mapped.write_chunk, 1, 0,
+                          self.mapped.get_nbt(1, 0))
+        self.assertRaises(IOError, self.mapped.unlink_chunk, 1, 0)
+
+    def testCloseWithView(self):
+        raw = self.mapped.get_raw(1, 0)
+        self.mapped.close()
+        self.assertEqual(len(raw), self.mapped.metadata[1, 0].length - 1)
+
+    def testEmptyFile(self):
+        tempdir = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(tempdir, 'empty.mca')
+            open(filename, 'wb').close()
+            region = RegionFile(filename, mapped=True)
+            self.assertEqual(region.chunk_count(), 0)
+            region.close()
+        finally:
+            shutil.rmtree(tempdir)
+
+
+class SectorMapTest(unittest.TestCase):
+    """Test the allocation of free sectors."""
+
+    def testExtents(self):
+        sectormap = _SectorMap()
+        sectormap.add((0, 0), 2, 4)
+        sectormap.add((1, 0), 6, 7)
+        sectormap.add((2, 0), 10, 12)
+        self.assertEqual(sectormap.end, 12)
+        self.assertEqual([(s, sectormap.lengths[s]) for s in sectormap.starts],
+                         [(4, 2), (7, 3)])
+        sectormap.remove((1, 0))
+        self.assertEqual([(s, sectormap.lengths[s]) for s in sectormap.starts],
+                         [(4, 6)])
+        sectormap.remove((2, 0))
+        self.assertEqual(sectormap.end, 4)
+        self.assertEqual(sectormap.starts, [])
+
+    def testOverlap(self):
+        """A sector used by two chunks is free when both are removed."""
+        sectormap = _SectorMap()
+        sectormap.add((0, 0), 2, 5)
+        sectormap.add((1, 0), 4, 6)
+        sectormap.add((2, 0), 8, 9)
+        sectormap.remove((0, 0))
+        self.assertFalse(sectormap.is_free(2, 3))
+        self.assertTrue(sectormap.is_free(2, 2))
+        sectormap.remove((1, 0))
+        self.assertTrue(sectormap.is_free(2, 6))
+        self.assertFalse(sectormap.is_free(2, 7))
+        self.assertTrue(sectormap.is_free(9, 100))
+        self.assertFalse(sectormap.is_free(1, 1))
+
+    def testBestFit(self):
+        """The smallest free extent that is large enough is used."""
+        sectormap = _SectorMap()
+        sectormap.add((0, 0), 5, 6)   # free: 2-4 (3 sectors)
+        sectormap.add((1, 0), 8, 9)   # free: 6-7 (2 sectors)
+        sectormap.add((2, 0), 13, 14) # free: 9-12 (4 sectors)
+        self.assertEqual(sectormap.find(1), 6)
+        self.assertEqual(sectormap.find(2), 6)
+        self.assertEqual(sectormap.find(3), 2)
+        self.assertEqual(sectormap.find(4), 9)
+        self.assertEqual(sectormap.find(5), 14)
+
+    def testWriteBestFit(self):
+        """A chunk is written in the smallest hole it fits in."""
+        region = RegionFile(fileobj=BytesIO())
+        for x, size in enumerate([5000, 5000, 5000, 1000, 1000]):
+            region.write_chunk(x, 0, generate_level(size))
+        self.assertEqual([region.metadata[x, 0].blockstart for x in range(5)],
+                         [2, 4, 6, 8, 9])
+        region.unlink_chunk(0, 0) # frees sectors 2-3
+        region.unlink_chunk(3, 0) # frees sector 8
+        region.write_chunk(5, 0, generate_level(1000))
+        self.assertEqual(region.metadata[5, 0].blockstart, 8)
+
+    def testConsistency(self):
+        """The sector map matches the metadata after many writes."""
+        with open(REGIONTESTFILE, 'rb') as f:
+            stream = BytesIO(f.read())
+        region = RegionFile(fileobj=stream)
+        # sectors of chunks outside the file are only taken into account
+        # up to the end of the file, as in _sectors().
+        region.unlink_chunk(15, 0)
+        for i in range(60):
+            x, z = (7 * i) % 20, i % 2
+            if i % 5 == 4:
+                region.unlink_chunk(x, z)
+            else:
+                region.write_chunk(x, z, generate_level(300 + 997 * (i % 11)))
+        sectormap = region._get_sectormap()
+        region._sectormap = None
+        self.assertEqual(list(sectormap.usage), list(region._get_sectormap().usage))
+        self.assertEqual(region.get_size(), sectormap.end * 4096)
+        self.assertEqual(region.get_size(), len(stream.getvalue()))
+
+
+class HeaderWriteCounter(PedanticFileWrapper):
+    """Pedantic file wrapper, which counts the number of write() calls in the header."""
+    def __init__(self, stream):
+        PedanticFileWrapper.__init__(self, stream)
+        self.stream = stream
+        self.headerwrites = 0
+    def write(self, data):
+        if self.stream.tell() < 8192:
+            self.headerwrites += 1
+        return self.stream.write(data)
+
+
+class BatchWriteTest(unittest.TestCase):
+    """Test writing multiple chunks in a batch."""
+
+    def setUp(self):
+        self.stream = HeaderWriteCounter(BytesIO())
+        self.region = RegionFile(fileobj=self.stream)
+        self.chunks = dict(((x, z), generate_level(1000 + 1500 * ((x + z) % 4)))
+                           for x in range(4) for z in range(3))
+
+    def assertReadBack(self, region, chunks):
+        for (x, z), nbt in chunks.items():
+            self.assertEqual(region.get_nbt(x, z).pretty_tree(), nbt.pretty_tree())
+        reopened = RegionFile(fileobj=BytesIO(self.stream.getvalue()))
+        self.assertEqual(reopened.chunk_count(), len(chunks))
+        for xz, m in region.metadata.items():
+            self.assertEqual(str(m), str(reopened.metadata[xz]))
+
+    def testWriteChunks(self):
+        self.region.write_chunks(self.chunks)
+        # The header is initialised once, and written once.
+        self.assertEqual(self.stream.headerwrites, 2)
+        self.assertReadBack(self.region, self.chunks)
+        # the chunks are written contiguously
+        used = sum(m.blocklength for m in self.region.get_metadata())
+        self.assertEqual(self.region.get_size(), (2 + used) * 4096)
+
+    def testBatch(self):
+        self.region.write_chunks(self.chunks)
+        headerwrites = self.stream.headerwrites
+        with self.region.batch():
+            self.region.unlink_chunk(0, 0)
+            self.region.write_chunk(1, 0, generate_level(5000))
+            self.region.write_chunk(3, 2, generate_level(100))
+        self.assertEqual(self.stream.headerwrites, headerwrites + 1)
+        del self.chunks[0, 0]
+        self.chunks[1, 0] = generate_level(5000)
+        self.chunks[3, 2] = generate_level(100)
+        self.assertReadBack(self.region, self.chunks)
+
+    def testFreedSectorsReserved(self):
+        """Sectors freed in a batch are not reused in the same batch."""
+        self.region.write_chunks(self.chunks)
+        start = self.region.metadata[0, 0].blockstart
+        with self.region.batch():
+            self.region.unlink_chunk(0, 0)
+            self.region.write_chunk(3, 3, generate_level(1000))
+            self.assertNotEqual(self.region.metadata[3, 3].blockstart, start)
+        self.region.write_chunk(3, 4, generate_level(1000))
+        self.assertEqual(self.region.metadata[3, 4].blockstart, start)
+
+    def testRewriteInPlace(self):
+        """Rewriting chunks in a batch does not grow the file."""
+        self.region.write_chunks(self.chunks)
+        size = self.region.get_size()
+        for i in range(3):
+            self.region.write_chunks(self.chunks)
+            self.assertEqual(self.region.get_size(), size)
+            self.assertEqual(self.region.fragmentation().free_sectors, 0)
+        with self.region.batch():
+            for (x, z), nbt in self.chunks.items():
+                self.region.write_chunk(x, z, nbt)
+        self.assertEqual(self.region.get_size(), size)
+        self.assertReadBack(self.region, self.chunks)
+
+    def testException(self):
+        """Chunks written before an exception are kept."""
+        self.region.write_chunks(self.chunks)
+        try:
+            with self.region.batch():
+                self.region.write_chunk(0, 0, generate_level(2000))
+                raise ValueError()
+        except ValueError:
+            pass
+        self.chunks[0, 0] = generate_level(2000)
+        self.assertReadBack(self.region, self.chunks)
+        sectormap = self.region._get_sectormap()
+        self.region._sectormap = None
+        self.assertEqual(list(sectormap.usage), list(self.region._get_sectormap().usage))
+
+
+class SyncRecorder(PedanticFileWrapper):
+    """Pedantic file wrapper, which records writes and flushes."""
+    def __init__(self, stream):
+        PedanticFileWrapper.__init__(self, stream)
+        self.stream = stream
+        self.log = []
+    def write(self, data):
+        self.log.append(('write', self.stream.tell(), len(data)))
+        return self.stream.write(data)
+    def flush(self):
+        self.log.append(('flush',))
+        return self.stream.flush()
+
+
+class DurableWriteTest(unittest.TestCase):
+    """Test group commits of writes in durable mode."""
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tempdir, 'regiontest.mca')
+        shutil.copy(REGIONTESTFILE, self.filename)
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def committed(self):
+        """Return the chunk count, as seen by another reader."""
+        region = RegionFile(self.filename)
+        count = region.chunk_count()
+        region.close()
+        return count
+
+    def testCommitCount(self):
+        region = RegionFile(self.filename, durable=True, commit_count=4)
+        for x in range(3):
+            region.write_chunk(x, 5, generate_level(2000))
+        self.assertEqual(region.chunk_count(), 24)
+        self.assertEqual(self.committed(), 21)
+        region.write_chunk(3, 5, generate_level(2000))
+        self.assertEqual(self.committed(), 25)
+        region.unlink_chunk(3, 5)
+        self.assertEqual(self.committed(), 25)
+        region.commit()
+        self.assertEqual(self.committed(), 24)
+        region.write_chunk(3, 5, generate_level(2000))
+        region.close()
+        self.assertEqual(self.committed(), 25)
+
+    def testCommitInterval(self):
+        region = RegionFile(self.filename, durable=True, commit_count=None,
+                            commit_interval=0)
+        region.write_chunk(0, 5, generate_level(2000))
+        self.assertEqual(self.committed(), 22)
+        region.close()
+
+    def testCommitIntervalWithoutWrite(self):
+        """The interval is checked on the next write; there is no timer."""
+        region = RegionFile(self.filename, durable=True, commit_count=None,
+                            commit_interval=0.05)
+        region.write_chunk(0, 5, generate_level(2000))
+        time.sleep(0.1)
+        self.assertEqual(self.committed(), 21)
+        region.write_chunk(1, 5, generate_level(2000))
+        self.assertEqual(self.committed(), 23)
+        region.close()
+
+    def testFreedSectorsReserved(self):
+        """Chunk data referred to by the committed header is not overwritten."""
+        region = RegionFile(self.filename, durable=True)
+        start = region.metadata[1, 0].blockstart
+        region.write_chunk(1, 0, generate_level(2000))
+        self.assertNotEqual(region.metadata[1, 0].blockstart, start)
+        reader = RegionFile(self.filename)
+        self.assertEqual(reader.metadata[1, 0].blockstart, start)
+        reader.get_nbt(1, 0)
+        reader.close()
+        region.commit()
+        region.write_chunk(0, 5, generate_level(2000))
+        self.assertEqual(region.metadata[0, 5].blockstart, start)
+        region.close()
+
+    def testCommitOrder(self):
+        """Chunk data is flushed before the header, the header before reuse."""
+        with open(REGIONTESTFILE, 'rb') as f:
+            stream = SyncRecorder(BytesIO(f.read()))
+        region = RegionFile(fileobj=stream, durable=True, commit_count=2)
+        del stream.log[:]
+        region.write_chunk(1, 0, generate_level(2000))
+        region.write_chunk(2, 0, generate_level(2000))
+        header = stream.log.index(('write', 0, 8192))
+        self.assertEqual(stream.log[header - 1], ('flush',))
+        self.assertEqual(stream.log[header + 1], ('flush',))
+        # chunk data is only written before the header
+        self.assertTrue(all(entry[1] >= 8192 for entry in stream.log[:header]
+                            if entry[0] == 'write'))
+        # afterwards, freed sectors are zeroed
+        self.assertTrue(any(entry[0] == 'write' for entry in stream.log[header + 2:]))
+
+
+class CompactTest(unittest.TestCase):
+    """Test compaction of a region file."""
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tempdir, 'regiontest.mca')
+        shutil.copy(REGIONTESTFILE, self.filename)
+        self.region = RegionFile(self.filename)
+
+    def tearDown(self):
+        self.region.close()
+        shutil.rmtree(self.tempdir)
+
+    def readable(self, region, ok_only=False):
+        chunks = {}
+        for m in region.get_metadata():
+            if ok_only and m.status != STATUS_CHUNK_OK:
+                continue
+            try:
+                chunks[m.x, m.z] = (region.get_blockdata(m.x, m.z), m.timestamp)
+            except RegionFileFormatError:
+                pass
+        return chunks
+
+    def testFragmentation(self):
+        report = self.region.fragmentation()
+        self.assertEqual(report.sectors, 27)
+        self.assertEqual(report.free_sectors, 3) # sectors 10, 11 and 26
+        self.assertEqual(report.gaps, 2)
+        self.assertEqual(report.largest_gap, 2)
+        self.assertEqual(report.used_sectors, 22)
+
+    def testCompact(self):
+        # chunks with an error status are left out
+        chunks = self.readable(self.region, ok_only=True)
+        self.assertNotIn((4, 0), chunks) # overlapping
+        before, after = self.region.compact()
+        self.assertEqual(before.free_sectors, 3)
+        self.assertEqual(after.free_sectors, 0)
+        self.assertEqual(after.gaps, 0)
+        self.assertEqual(self.region.get_size(), after.sectors * 4096)
+        self.assertEqual(self.readable(self.region), chunks)
+        reopened = RegionFile(self.filename)
+        self.assertEqual(self.readable(reopened), chunks)
+        # chunks keep their order in the file
+        order = sorted(reopened.get_metadata(), key=lambda m: m.blockstart)
+        self.assertEqual([(m.x, m.z) for m in order][:3], [(6, 0), (7, 0), (8, 0)])
+        reopened.close()
+        self.assertFalse(os.path.exists(self.filename + ".tmp"))
+
+    def testCompactZOrder(self):
+        chunks = self.readable(self.region, ok_only=True)
+        self.region.compact(COMPACT_ZORDER)
+        self.assertEqual(self.readable(self.region), chunks)
+        order = sorted(self.region.get_metadata(), key=lambda m: m.blockstart)
+        self.assertEqual([(m.x, m.z) for m in order][:4], [(1, 0), (2, 0), (3, 0), (5, 1)])
+        self.assertRaises(ValueError, self.region.compact, "random")
+
+    def testCompactAfterWrites(self):
+        for x in range(8):
+            self.region.write_chunk(x, 5, generate_level(3000 + 2000 * x))
+        for x in range(0, 8, 2):
+            self.region.unlink_chunk(x, 5)
+        self.assertGreater(self.region.fragmentation().gaps, 2)
+        chunks = self.readable(self.region, ok_only=True)
+        before, after = self.region.compact()
+        self.assertEqual(after.gaps, 0)
+        self.assertEqual(self.readable(self.region), chunks)
+        self.region.write_chunk(0, 5, generate_level(3000))
+        self.assertEqual(self.region.metadata[0, 5].blockstart, after.sectors)
+
+    def testLargeChunkLength(self):
+        """A chunk that claims more than 255 sectors is left out."""
+        self.region.write_chunk(5, 5, generate_level(3000))
+        sector = self.region.metadata[5, 5].blockstart
+        self.region.file.seek(sector * 4096)
+        self.region.file.write(pack(">I", 300 * 4096))
+        self.region.close()
+        self.region = RegionFile(self.filename)
+        self.assertNotEqual(self.region.metadata[5, 5].status, STATUS_CHUNK_OK)
+        chunks = self.readable(self.region, ok_only=True)
+        self.region.compact()
+        self.assertFalse(self.region.metadata[5, 5].is_created())
+        self.assertEqual(self.readable(self.region), chunks)
+        for m in self.region.get_metadata():
+            self.assertEqual(m.status, STATUS_CHUNK_OK)
+
+    def testTempFileRemoved(self):
+        """The temporary file is removed if the compaction fails."""
+        def fail(m):
+            raise IOError("read error")
+        self.region._read_raw = fail
+        self.assertRaises(IOError, self.region.compact)
+        self.assertFalse(os.path.exists(self.filename + ".tmp"))
+        del self.region._read_raw
+        self.assertEqual(self.region.fragmentation().free_sectors, 3)
+
+    def testFileObject(self):
+        with open(REGIONTESTFILE, 'rb') as f:
+            region = RegionFile(fileobj=BytesIO(f.read()))
+        self.assertEqual(region.fragmentation().free_sectors, 3)
+        self.assertRaises(IOError, region.compact)
+
+
+class PrefetchTest(unittest.TestCase):
+    """Test iterating over chunks with worker threads."""
+
+    def setUp(self):
+        self.region = RegionFile(REGIONTESTFILE)
+
+    def tearDown(self):
+        self.region.close()
+
+    def testIterChunks(self):
+        serial = [nbt.pretty_tree() for nbt in self.region.iter_chunks()]
+        threaded = [nbt.pretty_tree() for nbt in self.region.iter_chunks(workers=3)]
+        self.assertEqual(len(serial), 13)
+        self.assertEqual(threaded, serial)
+
+    def testLazyMapped(self):
+        serial = [nbt.loc.x for nbt in self.region.iter_chunks()]
+        region = RegionFile(REGIONTESTFILE, mapped=True, lazy=True)
+        self.assertEqual([nbt.loc.x for nbt in region.iter_chunks(workers=2)], serial)
+        region.close()
+
+    def testEarlyStop(self):
+        chunks = self.region.iter_chunks(workers=2)
+        first = next(chunks)
+        chunks.close()
+        self.assertEqual(first.pretty_tree(), next(self.region.iter_chunks()).pretty_tree())
+        # the file can still be read
+        self.assertEqual(len(list(self.region.iter_chunks(workers=1))), 13)
+
+    def testIterChunksClass(self):
+        self.region.chunkclass = lambda nbt: (nbt.loc.x, nbt.loc.z)
+        chunks = list(self.region.iter_chunks_class(workers=2))
+        self.assertEqual(chunks, list(self.region.iter_chunks_class()))
+        self.assertEqual(len(chunks), 13)
+
+
+class LazyRegionTest(unittest.TestCase):
+    """Test a region file opened with lazy=True."""
+
+    def setUp(self):
+        with open(REGIONTESTFILE, 'rb') as f:
+            self.data = f.read()
+        self.stream = CountingFileWrapper(BytesIO(self.data))
+        self.region = RegionFile(fileobj=self.stream, lazy=True)
+        self.reference = RegionFile(REGIONTESTFILE)
+
+    def tearDown(self):
+        self.reference.close()
+
+    def testMetadataOnly(self):
+        """Metadata queries only read the region header."""
+        self.assertEqual(self.region.chunk_count(), 21)
+        self.assertEqual(self.region.get_chunk_coords(),
+                         self.reference.get_chunk_coords())
+        for (x, z) in self.region.metadata:
+            self.assertEqual(self.region.get_timestamp(x, z),
+                             self.reference.get_timestamp(x, z))
+        self.assertEqual(self.stream.reads, 1)
+
+    def testReadOnDemand(self):
+        """Only the chunk header of the requested chunk is read."""
+        self.assertEqual(self.region.get_blockdata(1, 0),
+                         self.reference.get_blockdata(1, 0))
+        self.assertEqual(self.stream.reads, 3)
+        self.assertEqual(self.region.metadata[2, 0].length, 0)
+        self.region.get_blockdata(1, 0)
+        self.assertEqual(self.stream.reads, 4)
+
+    def testBlockdata(self):
+        """Test if all chunks read the same as in eager mode."""
+        for m in self.reference.metadata.values():
+            try:
+                data = self.reference.get_blockdata(m.x, m.z)
+            except (RegionFileFormatError, InconceivedChunk) as e:
+                self.assertRaises(type(e), self.region.get_blockdata, m.x, m.z)
+            else:
+                self.assertEqual(self.region.get_blockdata(m.x, m.z), data)
+        for xz, m in self.region.metadata.items():
+            self.assertEqual(str(m), str(self.reference.metadata[xz]))
+
+    def testLoadChunkHeaders(self):
+        self.region.load_chunk_headers()
+        for xz, m in self.region.metadata.items():
+            self.assertEqual(str(m), str(self.reference.metadata[xz]))
+        reads = self.stream.reads
+        self.region.get_blockdata(1, 0)
+        self.assertEqual(self.stream.reads, reads + 1)
+
+    def testWrite(self):
+        """Writing a chunk allocates the same sectors as in eager mode."""
+        nbt = generate_level(5000)
+        stream = BytesIO(self.data)
+        reference = RegionFile(fileobj=stream)
+        reference.write_chunk(2, 2, nbt)
+        self.region.write_chunk(2, 2, nbt)
+        self.assertEqual(self.region.metadata[2, 2].blockstart,
+                         reference.metadata[2, 2].blockstart)
+        self.assertEqual(self.stream.getvalue(), stream.getvalue())
+
+
+class ChunkCacheTest(unittest.TestCase):
+    """Test the least-recently-used cache of parsed chunks."""
+
+    def testHitMiss(self):
+        cache = ChunkCache(100)
+        self.assertIsNone(cache.get((0, 0, 2, 1000)))
+        cache.put((0, 0, 2, 1000), "a", 40)
+        self.assertEqual(cache.get((0, 0, 2, 1000)), "a")
+        # a chunk at another location or with another timestamp is a miss
+        self.assertIsNone(cache.get((0, 0, 3, 1000)))
+        self.assertIsNone(cache.get((0, 0, 2, 1001)))
+        self.assertEqual((cache.hits, cache.misses), (1, 3))
+
+    def testEviction(self):
+        cache = ChunkCache(100)
+        cache.put((0, 0, 2, 0), "a", 40)
+        cache.put((1, 0, 3, 0), "b", 40)
+        cache.get((0, 0, 2, 0)) # b is now the least recently used
+        cache.put((2, 0, 4, 0), "c", 40)
+        self.assertEqual(cache.evictions, 1)
+        self.assertIsNone(cache.get((1, 0, 3, 0)))
+        self.assertEqual(cache.get((0, 0, 2, 0)), "a")
+        self.assertEqual(cache.get((2, 0, 4, 0)), "c")
+        self.assertEqual(cache.size, 80)
+        self.assertEqual(len(cache), 2)
+
+    def testTooLarge(self):
+        cache = ChunkCache(100)
+        cache.put((0, 0, 2, 0), "a", 40)
+        cache.put((1, 0, 3, 0), "b", 101)
+        self.assertEqual(len(cache), 1)
+        self.assertEqual(cache.evictions, 0)
+
+    def testReplace(self):
+        """A new key for the same chunk replaces the old one."""
+        cache = ChunkCache(100)
+        cache.put((0, 0, 2, 0), "a", 40)
+        cache.put((0, 0, 5, 1), "b", 30)
+        self.assertEqual(len(cache), 1)
+        self.assertEqual(cache.size, 30)
+        cache.invalidate(0, 0)
+        self.assertEqual(len(cache), 0)
+        self.assertEqual(cache.size, 0)
+        cache.invalidate(0, 0)
+
+
+class CachedRegionTest(unittest.TestCase):
+    """Test a region file with a cache of parsed chunks."""
+
+    def setUp(self):
+        self.stream = BytesIO()
+        self.region = RegionFile(fileobj=self.stream, cache_size=18000)
+        self.region.write_chunks(dict(((x, 0), generate_level(5000))
+                                      for x in range(5)))
+
+    def testHit(self):
+        nbt = self.region.get_nbt(1, 0)
+        self.assertIs(self.region.get_nbt(1, 0), nbt)
+        self.assertEqual((self.region.cache.hits, self.region.cache.misses), (1, 1))
+
+    def testBudget(self):
+        for x in range(5):
+            self.region.get_nbt(x, 0)
+        # only 3 chunks of about 5000 bytes fit in 18000 bytes
+        self.assertEqual(len(self.region.cache), 3)
+        self.assertEqual(self.region.cache.evictions, 2)
+        self.assertLessEqual(self.region.cache.size, 18000)
+
+    def testWriteInvalidates(self):
+        nbt = self.region.get_nbt(1, 0)
+        self.region.write_chunk(1, 0, generate_level(100))
+        self.assertEqual(len(self.region.cache), 0)
+        self.assertEqual(self.region.get_nbt(1, 0).pretty_tree(),
+                         generate_level(100).pretty_tree())
+
+    def testUnlinkInvalidates(self):
+        self.region.get_nbt(1, 0)
+        self.region.unlink_chunk(1, 0)
+        self.assertEqual(len(self.region.cache), 0)
+        self.assertEqual(self.region.cache.size, 0)
+        self.assertRaises(InconceivedChunk, self.region.get_nbt, 1, 0)
+
+    def testNoCache(self):
+        region = RegionFile(fileobj=self.stream)
+        self.assertIsNone(region.cache)
+        self.assertIsNot(region.get_nbt(1, 0), region.get_nbt(1, 0))
+
+
+def generate_chunk(x, z, level=False):
+    """Generate a chunk with xPos and zPos, in Level (old format) or at the root."""
+    nbt = NBTFile()
+    parent = nbt
+    if level:
+        parent = TAG_Compound(name="Level")
+        nbt.tags.append(parent)
+    parent.tags.append(TAG_Int(name="xPos", value=x))
+    parent.tags.append(TAG_Int(name="zPos", value=z))
+    parent.tags.append(TAG_String(name="Status", value="full"))
+    nbt.tags.append(TAG_Long(name="LastUpdate", value=1234))
+    return nbt
+
+
+class CopyChunkTest(unittest.TestCase):
+    """Test copying compressed chunks between region files."""
+
+    def setUp(self):
+        self.src = RegionFile(fileobj=BytesIO())
+        self.src.write_chunk(1, 2, generate_chunk(1, 2))
+        self.src.write_chunk(3, 4, generate_chunk(3, 4, level=True), 1) # GZip
+        self.src.write_chunk(5, 6, generate_chunk(5, 6))
+        self.dststream = HeaderWriteCounter(BytesIO())
+        self.dst = RegionFile(fileobj=self.dststream)
+
+    def testCopy(self):
+        """Chunks that do not move are copied byte for byte."""
+        self.src.copy_chunk_to(self.dst, 3, 4)
+        self.assertEqual(self.dst.get_raw(3, 4).tobytes(),
+                         self.src.get_raw(3, 4).tobytes())
+        self.assertEqual(self.dst.metadata[3, 4].compression, 1)
+        reopened = RegionFile(fileobj=BytesIO(self.dststream.getvalue()))
+        self.assertEqual(reopened.get_nbt(3, 4)["Level"]["xPos"].value, 3)
+
+    def testMove(self):
+        self.src.copy_chunk_to(self.dst, 1, 2, 7, 0)
+        nbt = self.dst.get_nbt(7, 0)
+        self.assertEqual(nbt["xPos"].value, 7)
+        self.assertEqual(nbt["zPos"].value, 0)
+        self.assertEqual(nbt["Status"].value, "full")
+        self.assertEqual(nbt["LastUpdate"].value, 1234)
+        self.assertRaises(InconceivedChunk, self.dst.get_nbt, 1, 2)
+
+    def testMoveLevel(self):
+        """Old chunks have their position in the Level compound."""
+        self.src.copy_chunk_to(self.dst, 3, 4, 3, 9)
+        nbt = self.dst.get_nbt(3, 9)
+        self.assertEqual(nbt["Level"]["xPos"].value, 3)
+        self.assertEqual(nbt["Level"]["zPos"].value, 9)
+        self.assertEqual(self.dst.metadata[3, 9].compression, 1)
+
+    def testMoveRegion(self):
+        """A chunk moves if the regions have a different location."""
+        self.src.loc = Location(x=0, z=0)
+        self.dst.loc = Location(x=-1, z=2)
+        self.src.copy_chunk_to(self.dst, 1, 2)
+        nbt = self.dst.get_nbt(1, 2)
+        self.assertEqual(nbt["xPos"].value, 1 - 32)
+        self.assertEqual(nbt["zPos"].value, 2 + 64)
+
+    def testMoveWithinRegion(self):
+        self.src.copy_chunk_to(self.src, 1, 2, 0, 0)
+        self.assertEqual(self.src.get_nbt(0, 0)["xPos"].value, 0)
+        self.assertEqual(self.src.get_nbt(1, 2)["xPos"].value, 1)
+
+    def testMoveWithoutPosition(self):
+        """Chunks without xPos and zPos (e.g. POI chunks) are copied as they are."""
+        self.src.write_chunk(0, 0, generate_level(100))
+        self.src.copy_chunk_to(self.dst, 0, 0, 1, 1)
+        self.assertEqual(self.dst.get_raw(1, 1).tobytes(),
+                         self.src.get_raw(0, 0).tobytes())
+
+    def testMoveEntities(self):
+        """Entity chunks have their position in a Position int array."""
+        nbt = NBTFile()
+        nbt.tags.append(TAG_Int_Array(name="Position", value=[1, 2]))
+        nbt.tags.append(TAG_Int(name="DataVersion", value=3700))
+        self.src.write_chunk(0, 0, nbt)
+        self.src.copy_chunk_to(self.dst, 0, 0, 4, 5)
+        nbt = self.dst.get_nbt(4, 5)
+        self.assertEqual(nbt["Position"].value, [5, 7])
+        self.assertEqual(nbt["DataVersion"].value, 3700)
+
+    def testMoveMalformed(self):
+        self.src.write_blockdata(0, 0, b"not nbt")
+        self.assertRaises(ChunkDataError, self.src.copy_chunk_to, self.dst, 0, 0, 1, 1)
+
+    def testMissing(self):
+        self.assertRaises(InconceivedChunk, self.src.copy_chunk_to, self.dst, 0, 0)
+
+    def testCopyAll(self):
+        self.assertEqual(self.src.copy_chunks_to(self.dst), 3)
+        # The header is initialised once, and written once.
+        self.assertEqual(self.dststream.headerwrites, 2)
+        self.assertEqual(sorted((m.x, m.z) for m in self.dst.get_metadata()),
+                         [(1, 2), (3, 4), (5, 6)])
+        for m in self.src.get_metadata():
+            self.assertEqual(self.dst.get_raw(m.x, m.z).tobytes(),
+                             self.src.get_raw(m.x, m.z).tobytes())
+
+    def testCopyAllCorrupt(self):
+        """Overlapping chunks and chunks with a mismatched length are not copied."""
+        src = RegionFile(REGIONTESTFILE)
+        try:
+            ok = [(m.x, m.z) for m in src.get_metadata()
+                  if m.status == STATUS_CHUNK_OK]
+            self.assertEqual(src.metadata[4, 0].status,
+                             RegionFile.STATUS_CHUNK_OVERLAPPING)
+            self.assertEqual(src.copy_chunks_to(self.dst), len(ok))
+        finally:
+            src.close()
+        self.assertEqual(sorted((m.x, m.z) for m in self.dst.get_metadata()),
+                         sorted(ok))
+        self.assertNotIn((4, 0), ok)
+        self.assertNotIn((12, 0), ok)
+
+    def testCopyMapping(self):
+        count = self.src.copy_chunks_to(self.dst, {(1, 2): (1, 2), (5, 6): (10, 11)})
+        self.assertEqual(count, 2)
+        self.assertEqual(self.dst.chunk_count(), 2)
+        self.assertEqual(self.dst.get_nbt(1, 2)["xPos"].value, 1)
+        nbt = self.dst.get_nbt(10, 11)
+        self.assertEqual((nbt["xPos"].value, nbt["zPos"].value), (10, 11))
+
+    def testCopySequence(self):
+        self.src.copy_chunks_to(self.dst, [(3, 4)])
+        self.assertEqual([(m.x, m.z) for m in self.dst.get_metadata()], [(3, 4)])
+
+
 if __name__ == '__main__':
     logger = logging.getLogger("nbt.tests.regiontests")
     if len(logger.handlers) == 0:
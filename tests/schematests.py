@@ -0,0 +1,122 @@
+#!/usr/bin/env python
+import sys,os
+import pickle
+from gzip import GzipFile
+from io import BytesIO
+
+import unittest
+try:
+    from unittest import skip as _skip
+except ImportError:
+    # Python 2.6 has an older unittest API. The backported package is available from pypi.
+    import unittest2 as unittest
+
+# Search parent directory first, to make sure we test the local nbt module, 
+# not an installed nbt module.
+parentdir = os.path.realpath(os.path.join(os.path.dirname(__file__),os.pardir))
+if parentdir not in sys.path:
+    sys.path.insert(1, parentdir)  # insert ../ just after ./
+
+from nbt.nbt import MalformedFileError, ParseLimits, TAG_COMPOUND, \
+    TAG_LIST, TAG_LONG, TAG_STRING, TAG_FLOAT, TAG_INT
+from nbt.region import RegionFile
+from nbt.schema import SchemaProfile, profile_file, profile_files
+
+NBTTESTFILE = os.path.join(os.path.dirname(__file__), 'bigtest.nbt')
+REGIONTESTFILE = os.path.join(os.path.dirname(__file__), 'regiontest.mca')
+
+
+class SchemaProfileTest(unittest.TestCase):
+    """Test the profile of bigtest.nbt"""
+
+    def setUp(self):
+        self.data = GzipFile(NBTTESTFILE).read()
+        self.profile = SchemaProfile()
+        self.profile.add(self.data)
+
+    def testPaths(self):
+        paths = self.profile.paths
+        self.assertEqual(self.profile.documents, 1)
+        self.assertEqual(paths[("listTest (long)", TAG_LIST)], [1, 63])
+        self.assertEqual(paths[("listTest (long)[]", TAG_LONG)], [5, 40])
+        self.assertEqual(paths[("listTest (compound)[]/name", TAG_STRING)][0],
+                         2)
+        self.assertEqual(paths[("nested compound test/egg/value", TAG_FLOAT)],
+                         [1, 12])
+        # all top-level tags add up to the document, without the root header
+        # (type, name "Level") and the final TAG_End.
+        total = sum(size for (path, tagtype), (count, size) in paths.items()
+                    if "/" not in path and "[" not in path)
+        self.assertEqual(total, len(self.data) - 8 - 1)
+
+    def testMerge(self):
+        other = SchemaProfile()
+        other.add(self.data)
+        merged = pickle.loads(pickle.dumps(self.profile)).merge(other)
+        self.assertEqual(merged.documents, 2)
+        self.assertEqual(merged.paths[("listTest (long)[]", TAG_LONG)],
+                         [10, 80])
+        self.assertEqual(len(merged), len(self.profile))
+
+    def testReport(self):
+        report = self.profile.report()
+        self.assertEqual(len(report), len(self.profile))
+        self.assertEqual(report[0][0], "byteArrayTest (the first 1000 values "
+                         "of (n*n*255+n*7)%100, starting with n=0 "
+                         "(0, 62, 34, 16, 8, ...))")
+        types = self.profile.to_dict()["nested compound test"]
+        self.assertEqual(types["TAG_Compound"]["count"], 1)
+
+    def testMalformed(self):
+        profile = SchemaProfile()
+        self.assertRaises(MalformedFileError, profile.add, self.data[:-20])
+        self.assertRaises(MalformedFileError, profile.add, b"\x01\0\0\x05")
+        self.assertRaises(MalformedFileError, SchemaProfile(
+            ParseLimits(max_depth=2)).add, self.data)
+        self.assertEqual(profile.documents, 0)
+        self.assertEqual(len(profile), 0)
+
+
+class FileProfileTest(unittest.TestCase):
+    """Test profiles of files and region files"""
+
+    def testRegion(self):
+        region = RegionFile(REGIONTESTFILE)
+        profile = SchemaProfile()
+        profile.add_region(region)
+        self.assertEqual(profile.documents + profile.errors,
+                         region.chunk_count())
+        self.assertEqual(profile.documents, len(list(region.iter_chunks())))
+        self.assertLessEqual(profile.paths[("Level", TAG_COMPOUND)][0],
+                             profile.documents)
+        region.close()
+
+    def testCorruptChunks(self):
+        """A chunk with an invalid name or truncated data is counted as an
+        error, and does not stop the profile."""
+        region = RegionFile(fileobj=BytesIO())
+        region.write_blockdata(0, 0, b"\x0A\0\0\x03\0\x01a\0\0\0\x01\0")
+        region.write_blockdata(1, 0, b"\x0A\0\0\x03\0\x02\xff\xfe\0\0\0\x01\0")
+        region.write_blockdata(2, 0, b"\x0A\0\0\x03\0\x01a\0\0")
+        profile = SchemaProfile()
+        profile.add_region(region)
+        self.assertEqual((profile.documents, profile.errors), (1, 2))
+        self.assertEqual(profile.report(), [("a", TAG_INT, 1, 8)])
+
+    def testProfileFiles(self):
+        serial = profile_files([NBTTESTFILE, REGIONTESTFILE], workers=1)
+        self.assertEqual(serial.documents,
+                         profile_file(NBTTESTFILE).documents +
+                         profile_file(REGIONTESTFILE).documents)
+        parallel = profile_files(iter([NBTTESTFILE, REGIONTESTFILE]),
+                                 workers=2)
+        self.assertEqual(parallel.paths, serial.paths)
+
+    def testMissingFile(self):
+        profile = profile_file(os.path.join(os.path.dirname(__file__),
+                                            'nonexistent.dat'))
+        self.assertEqual(profile.errors, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
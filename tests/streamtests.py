@@ -0,0 +1,204 @@
+#!/usr/bin/env python
+import sys,os
+from io import BytesIO
+from gzip import GzipFile
+import zlib
+
+import unittest
+try:
+    from unittest import skip as _skip
+except ImportError:
+    # Python 2.6 has an older unittest API. The backported package is available from pypi.
+    import unittest2 as unittest
+
+# Search parent directory first, to make sure we test the local nbt module, 
+# not an installed nbt module.
+parentdir = os.path.realpath(os.path.join(os.path.dirname(__file__),os.pardir))
+if parentdir not in sys.path:
+    sys.path.insert(1, parentdir)  # insert ../ just after ./
+
+from nbt.nbt import NBTFile, TAG_Int, TAG_INT, TAG_COMPOUND, \
+    MalformedFileError, ParseLimits
+from nbt.stream import NBTWriter, NBTPushParser
+
+NBTTESTFILE = os.path.join(os.path.dirname(__file__), 'bigtest.nbt')
+
+
+class WriterTest(unittest.TestCase):
+    """Test the streaming NBTWriter"""
+
+    def writeSample(self, writer, count=3):
+        writer.begin_compound("Data")
+        writer.write_int("Version", 1)
+        writer.begin_list("Entities", TAG_COMPOUND, count)
+        for i in range(count):
+            writer.begin_compound()
+            writer.write_string("id", "minecraft:pig")
+            writer.write_double("Health", 10.0)
+            writer.write_long_array("UUID", [i, -i])
+            writer.end_compound()
+        writer.end_list()
+        writer.write_byte_array("Blocks", b"\x00\x01\x02")
+        writer.end_compound()
+
+    def testUncompressed(self):
+        buffer = BytesIO()
+        writer = NBTWriter(buffer)
+        self.writeSample(writer)
+        writer.close()
+        buffer.seek(0)
+        nbt = NBTFile(buffer=buffer)
+        self.assertEqual(nbt.name, "Data")
+        self.assertEqual(nbt["Version"].value, 1)
+        self.assertEqual(len(nbt["Entities"]), 3)
+        self.assertEqual(nbt["Entities"][2]["UUID"].value, [2, -2])
+        self.assertEqual(nbt["Blocks"].value, bytearray(b"\x00\x01\x02"))
+
+    def testGzip(self):
+        buffer = BytesIO()
+        with NBTWriter(buffer, compression='gzip') as writer:
+            self.writeSample(writer, 1000)
+        buffer.seek(0)
+        nbt = NBTFile(fileobj=buffer)
+        self.assertEqual(len(nbt["Entities"]), 1000)
+
+    def testZlib(self):
+        buffer = BytesIO()
+        with NBTWriter(buffer, compression='zlib') as writer:
+            self.writeSample(writer)
+        nbt = NBTFile(buffer=BytesIO(zlib.decompress(buffer.getvalue())))
+        self.assertEqual(nbt["Entities"][0]["id"].value, "minecraft:pig")
+
+    def testWriteTag(self):
+        bigtest = NBTFile(NBTTESTFILE)
+        buffer = BytesIO()
+        with NBTWriter(buffer) as writer:
+            writer.write_tag(bigtest)
+        self.assertEqual(buffer.getvalue(), GzipFile(NBTTESTFILE).read())
+
+    def testWriteTagInList(self):
+        buffer = BytesIO()
+        with NBTWriter(buffer) as writer:
+            writer.begin_compound()
+            writer.begin_list("ints", TAG_INT, 2)
+            writer.write_tag(TAG_Int(5, name="ignored"))
+            writer.write_int(None, 6)
+            writer.end_list()
+            writer.end_compound()
+        buffer.seek(0)
+        self.assertEqual([t.value for t in NBTFile(buffer=buffer)["ints"]], [5, 6])
+
+    def testRootMustBeCompound(self):
+        writer = NBTWriter(BytesIO())
+        self.assertRaises(ValueError, writer.write_int, "x", 1)
+        self.assertRaises(ValueError, writer.begin_list, "x", TAG_INT, 1)
+
+    def testListType(self):
+        writer = NBTWriter(BytesIO())
+        writer.begin_compound()
+        writer.begin_list("ints", TAG_INT, 1)
+        self.assertRaises(ValueError, writer.write_long, None, 1)
+        self.assertRaises(ValueError, writer.write_int, "named", 1)
+
+    def testListLength(self):
+        writer = NBTWriter(BytesIO())
+        writer.begin_compound()
+        writer.begin_list("ints", TAG_INT, 1)
+        self.assertRaises(ValueError, writer.end_list)
+        writer.write_int(None, 1)
+        self.assertRaises(ValueError, writer.write_int, None, 2)
+        writer.end_list()
+
+    def testNesting(self):
+        writer = NBTWriter(BytesIO())
+        writer.begin_compound()
+        self.assertRaises(ValueError, writer.write_int, None, 1)
+        self.assertRaises(ValueError, writer.end_list)
+        writer.begin_compound("child")
+        self.assertEqual(writer.depth, 2)
+        self.assertRaises(ValueError, writer.close)
+        writer.end_compound()
+        writer.end_compound()
+        self.assertRaises(ValueError, writer.begin_compound)
+        self.assertRaises(ValueError, writer.end_compound)
+        writer.close()
+
+
+class PushParserTest(unittest.TestCase):
+    """Test the incremental NBTPushParser"""
+
+    def setUp(self):
+        self.data = GzipFile(NBTTESTFILE).read()
+        self.nbtfile = NBTFile(NBTTESTFILE)
+
+    def feed(self, parser, data, size):
+        for i in range(0, len(data), size):
+            parser.feed(data[i:i + size])
+
+    def testByteByByte(self):
+        parser = NBTPushParser()
+        self.feed(parser, self.data, 1)
+        nbt = parser.close()
+        self.assertEqual(nbt.name, "Level")
+        self.assertEqual(str(nbt), str(self.nbtfile))
+        self.assertEqual(nbt["listTest (long)"].tagID, 4)
+
+    def testAllAtOnce(self):
+        parser = NBTPushParser()
+        parser.feed(self.data)
+        self.assertTrue(parser.done)
+        self.assertEqual(str(parser.close()), str(self.nbtfile))
+
+    def testEvents(self):
+        parser = NBTPushParser(events=('start', 'end'))
+        parser.feed(self.data[:100])
+        events = list(parser.read_events())
+        self.assertEqual(events[0], ('start', parser.root))
+        self.assertEqual(events[1][0], 'end')
+        self.assertEqual(events[1][1].name, 'longTest')
+        self.assertEqual(events[1][1].value, 9223372036854775807)
+        self.assertEqual(list(parser.read_events()), [])
+        parser.feed(self.data[100:])
+        events = events + list(parser.read_events())
+        self.assertEqual(len([e for e in events if e[0] == 'start']), 8)
+        self.assertEqual(len([e for e in events if e[0] == 'end']), 29)
+        self.assertEqual(events[-1], ('end', parser.root))
+
+    def testEndEventsOnly(self):
+        parser = NBTPushParser()
+        parser.feed(self.data)
+        names = [tag.name for event, tag in parser.read_events()]
+        self.assertEqual(names[-1], "Level")
+        self.assertEqual(names.index("name"), names.index("ham") - 2)
+
+    def testGzip(self):
+        parser = NBTPushParser(compression='gzip')
+        with open(NBTTESTFILE, 'rb') as f:
+            self.feed(parser, f.read(), 10)
+        self.assertEqual(str(parser.close()), str(self.nbtfile))
+
+    def testZlib(self):
+        parser = NBTPushParser(compression='zlib')
+        self.feed(parser, zlib.compress(self.data), 3)
+        self.assertEqual(str(parser.close()), str(self.nbtfile))
+
+    def testTruncated(self):
+        parser = NBTPushParser()
+        parser.feed(self.data[:-1])
+        self.assertFalse(parser.done)
+        self.assertRaises(MalformedFileError, parser.close)
+
+    def testTrailingData(self):
+        parser = NBTPushParser()
+        self.assertRaises(MalformedFileError, parser.feed, self.data + b"\0")
+
+    def testLimits(self):
+        data = b"\x0A\0\0\x07\0\x01a\x7f\xff\xff\xff"
+        self.assertRaises(MalformedFileError, NBTPushParser().feed, data)
+        parser = NBTPushParser(limits=ParseLimits(max_depth=1))
+        self.assertRaises(MalformedFileError, parser.feed,
+                          b"\x0A\0\0\x0A\0\x01a\0\0")
+
+
+if __name__ == '__main__':
+    unittest.main()